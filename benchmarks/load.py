@@ -0,0 +1,165 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classicserver.bot import Bot
+from classicserver.server import ClassicServer
+
+
+def percentile(values, fraction):
+    # The nearest-rank percentile, None without any values
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def format_ms(value):
+    return "-" if value is None else "%.1f" % (value * 1000)
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run_server(config, pipe):
+    # Runs in its own process, so its CPU time is measured apart from the bots'
+    server = ClassicServer(config)
+    pipe.send(server.get_salt())
+
+    while pipe.recv() == "cpu":
+        pipe.send(time.process_time())
+
+    # The world of a benchmark isn't worth saving on the way out
+    os._exit(0)
+
+
+def run(bot_count, args):
+    """
+    Runs a server with a swarm of bots against it.
+
+    :param bot_count: The amount of bots.
+    :type bot_count: int
+    :param args: The command line arguments.
+    :return: The join latencies, the movement round trip latencies, the outbound bytes per player per second and the
+             server CPU usage.
+    :rtype: tuple
+    """
+    directory = tempfile.mkdtemp()
+    port = free_port()
+    width, height, depth = (int(size) for size in args.world_size.split("x"))
+    config = {
+        "server": {"name": "benchmark", "motd": "", "port": port, "ops": [], "max_players": 255, "mode": args.mode,
+                   "max_level_transfers": args.max_level_transfers},
+        "save": {"file": os.path.join(directory, "save.dat"), "format": "sectioned", "journal": True},
+        "world": {"width": width, "height": height, "depth": depth, "generator": args.generator},
+        "worlds": {"directory": os.path.join(directory, "worlds")},
+        "logging": {"level": "WARNING", "file": os.path.join(directory, "server.log")},
+        "heartbeat_url": ""
+    }
+
+    pipe, server_pipe = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_server, args=(config, server_pipe))
+    process.start()
+
+    bots = []
+    try:
+        salt = pipe.recv()
+        swarm = {}
+        bots = [Bot("bot%d" % index, salt, args.move_rate, args.build_rate, args.chat_rate, index, swarm)
+                for index in range(bot_count)]
+
+        for bot in bots:
+            bot.connect(("127.0.0.1", port))
+
+        deadline = time.time() + args.join_timeout
+        joined = [bot for bot in bots if bot.wait_joined(max(deadline - time.time(), 0))]
+        if len(joined) < len(bots):
+            print("Only %d of %d bots joined within %d seconds" % (len(joined), len(bots), args.join_timeout))
+
+        time.sleep(args.warmup)
+        for bot in bots:
+            bot.reset_stats()
+
+        pipe.send("cpu")
+        cpu_start, start = pipe.recv(), time.time()
+        time.sleep(args.duration)
+        pipe.send("cpu")
+        cpu_end, end = pipe.recv(), time.time()
+
+        join_times = [bot.join_time for bot in joined]
+        latencies = [latency for bot in bots for latency in bot.latencies]
+        outbound = sum(bot.bytes_received for bot in bots) / len(bots) / (end - start)
+        cpu = (cpu_end - cpu_start) / (end - start)
+        return join_times, latencies, outbound, cpu
+    finally:
+        for bot in bots:
+            bot.stop()
+        pipe.send("stop")
+        process.join(10)
+        if process.is_alive():
+            process.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs swarms of bots against a local server and reports the join "
+                                                 "latency, movement round trip, outbound traffic and server CPU usage.")
+    parser.add_argument("--bots", default="10,50,100,255", help="comma separated bot counts, 10,50,100,255 by default")
+    parser.add_argument("--duration", type=float, default=20, help="seconds measured per bot count")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds between joining and measuring")
+    parser.add_argument("--join-timeout", type=float, default=120, help="seconds the bots get to join")
+    parser.add_argument("--move-rate", type=float, default=5, help="movement packets per bot per second")
+    parser.add_argument("--build-rate", type=float, default=0.2, help="blocks placed per bot per second")
+    parser.add_argument("--chat-rate", type=float, default=0.05, help="chat messages per bot per second")
+    parser.add_argument("--mode", default="asyncio", choices=("asyncio", "threaded"), help="server networking mode")
+    parser.add_argument("--max-level-transfers", type=int, default=4, help="levels sent at the same time")
+    parser.add_argument("--world-size", default="256x64x256", help="world width x height x depth")
+    parser.add_argument("--generator", default="flat", help="world generator")
+    args = parser.parse_args()
+
+    print("%5s %9s %9s %9s %9s %9s %12s %7s" % ("bots", "join p50", "join max", "move p50", "move p95", "move p99",
+                                                "out KB/s/pl", "cpu %"))
+    for bot_count in (int(count) for count in args.bots.split(",")):
+        join_times, latencies, outbound, cpu = run(bot_count, args)
+        print("%5d %9s %9s %9s %9s %9s %12.1f %7.1f" % (
+            bot_count, format_ms(percentile(join_times, 0.5)), format_ms(max(join_times) if join_times else None),
+            format_ms(percentile(latencies, 0.5)), format_ms(percentile(latencies, 0.95)),
+            format_ms(percentile(latencies, 0.99)), outbound / 1024, cpu * 100
+        ))
+        sys.stdout.flush()
+
+    print("Latencies in milliseconds, the join latency includes the wait for a level transfer slot.")
+
+
+if __name__ == "__main__":
+    main()
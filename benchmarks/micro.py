@@ -0,0 +1,86 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classicserver.packet.buffer import ReadBuffer
+from classicserver.packet.packet import Packet, SetBlockPacket, PositionAndOrientationPacket, MessagePacket, \
+    SpawnPlayerPacket
+from classicserver.world import World
+
+POSITION = {"player_id": 5, "frac_x": 4096, "frac_y": 1024, "frac_z": 4096, "yaw": 64, "pitch": 0}
+SPAWN = {"player_id": 5, "username": "benchmark", "x": 4096, "y": 1024, "z": 4096, "yaw": 64, "pitch": 0}
+SET_BLOCK = {"x": 16, "y": 32, "z": 16, "mode": 1, "block_type": 1}
+
+
+def measure(name, function, repeat):
+    """
+    Prints the best time of a function over several runs, each run calling it enough times to last a while.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange() if hasattr(timer, "autorange") else (1000, None)
+    best = min(timer.repeat(repeat, number)) / number
+
+    if best >= 0.001:
+        print("%-50s %10.2f ms" % (name, best * 1000))
+    else:
+        print("%-50s %10.2f us" % (name, best * 1000000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the hot paths of the packet codec and the worlds.")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark, the best one is reported")
+    parser.add_argument("--world-size", default="256x64x256", help="world width x height x depth")
+    args = parser.parse_args()
+
+    # The world generation would log every run otherwise
+    logging.disable(logging.INFO)
+
+    width, height, depth = (int(size) for size in args.world_size.split("x"))
+
+    measure("Packet.make SetBlockPacket", lambda: SetBlockPacket.make(SET_BLOCK), args.repeat)
+    measure("Packet.make PositionAndOrientationPacket", lambda: PositionAndOrientationPacket.make(POSITION),
+            args.repeat)
+    measure("Packet.make SpawnPlayerPacket", lambda: SpawnPlayerPacket.make(SPAWN), args.repeat)
+    measure("Packet.make MessagePacket", lambda: MessagePacket.make({"player_id": 5, "message": "Hello"}),
+            args.repeat)
+
+    set_block = SetBlockPacket.make(SET_BLOCK)
+    position = PositionAndOrientationPacket.make(POSITION)
+    message = MessagePacket.make({"player_id": 5, "message": "Hello"})
+    measure("Packet.from_buffer SetBlockPacket", lambda: Packet.from_buffer(ReadBuffer(set_block), True), args.repeat)
+    measure("Packet.from_buffer PositionAndOrientationPacket", lambda: Packet.from_buffer(ReadBuffer(position), True),
+            args.repeat)
+    measure("Packet.from_buffer MessagePacket", lambda: Packet.from_buffer(ReadBuffer(message), True), args.repeat)
+
+    world = World(width=width, height=height, depth=depth)
+    measure("World.encode %s" % args.world_size, world.encode, args.repeat)
+
+    for generator in ("flat", "empty", "terrain"):
+        measure("World._generate %s %s" % (generator, args.world_size),
+                lambda: world._generate(generator, 1234), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+
+
+class BlockQueue(object):
+    """
+    Collects the block changes of a tick, keeping only the last change of every block. The tick applies them to the
+    worlds in one batch and broadcasts each changed block once, so every block change goes through the same place.
+    """
+
+    _changes = None
+    _count = 0
+
+    def __init__(self):
+        self._changes = {}
+
+    def queue(self, world, x, y, z, block, player_id, player_name):
+        """
+        Queues a block change, replacing any change of the same block queued earlier in the tick.
+
+        :param world: The name of the world.
+        :type world: str
+        :param block: The new block type.
+        :type block: int
+        :param player_id: The ID of the player changing the block, for the journal.
+        :type player_id: int
+        :param player_name: The name of the player changing the block, for the block history.
+        :type player_name: str
+        """
+        changes = self._changes.get(world)
+        if changes is None:
+            changes = self._changes[world] = collections.OrderedDict()
+
+        changes[(x, y, z)] = (block, player_id, player_name)
+        self._count += 1
+
+    def take(self):
+        """
+        Takes the queued block changes.
+
+        :return: The changes by world name, each an OrderedDict of (block, player ID, player name) tuples by
+                 (x, y, z), and the amount of changes queued before they were merged.
+        :rtype: tuple
+        """
+        changes, self._changes = self._changes, {}
+        count, self._count = self._count, 0
+        return changes, count
+
+    def __len__(self):
+        return self._count
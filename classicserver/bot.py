@@ -0,0 +1,296 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import collections
+import random
+import socket
+import threading
+import time
+
+from classicserver.packet.framer import PacketFramer
+from classicserver.packet.packet import SERVER_TO_CLIENT, PlayerIdentificationPacket, SetBlockPacket, \
+    PositionAndOrientationPacket, MessagePacket, LevelFinalizePacket, SpawnPlayerPacket, DespawnPlayerPacket, \
+    PositionAndOrientationUpdatePacket, PositionUpdatePacket, OrientationUpdatePacket
+
+# The packets carrying the movement of another player
+MOVEMENT_PACKETS = (PositionAndOrientationPacket.ID, PositionAndOrientationUpdatePacket.ID, PositionUpdatePacket.ID,
+                    OrientationUpdatePacket.ID)
+
+
+class Bot(object):
+    """
+    A simulated Classic client for load testing. It logs in, then moves, places blocks and chats at the configured
+    rates on a thread of its own.
+
+    Bots started together with the same clock measure the movement round trip: each bot keeps the time it sent each of
+    its recent positions, and when a bot receives the movement of another bot, it follows the other bot's position
+    through the absolute and relative updates and records the time since the other bot sent that position as a latency
+    sample.
+    """
+
+    RECEIVE_SIZE = 64 * 1024
+    # How many of its sent positions a bot remembers for the other bots to match
+    SENT_POSITIONS = 256
+    # How far the bots wander from their spawn point, in blocks
+    WANDER_DISTANCE = 16
+
+    name = ""
+    # The seconds from connecting until the level has been loaded, None until then
+    join_time = None
+    bytes_received = 0
+    packets_received = 0
+    latencies = None
+
+    _salt = ""
+    _move_rate = 0
+    _build_rate = 0
+    _chat_rate = 0
+    _random = None
+
+    _sock = None
+    _framer = None
+    _thread = None
+    _running = False
+    _connected_at = 0
+    _joined = None
+
+    _spawn = None
+    _position = None
+    _names = None
+    _sent = None
+    _others = None
+    _swarm = None
+
+    def __init__(self, name, salt, move_rate=0, build_rate=0, chat_rate=0, seed=None, swarm=None):
+        """
+        Creates a bot
+
+        :param name: The user name of the bot.
+        :type name: str
+        :param salt: The salt of the server, see ClassicServer.get_salt().
+        :type salt: str
+        :param move_rate: Movement packets sent per second.
+        :type move_rate: float
+        :param build_rate: Blocks placed per second.
+        :type build_rate: float
+        :param chat_rate: Chat messages sent per second.
+        :type chat_rate: float
+        :param seed: The seed of the random actions.
+        :param swarm: The bots by name, shared by bots measuring the movement round trip between each other.
+        :type swarm: dict
+        """
+        self.name = name
+        self.latencies = []
+
+        self._salt = salt
+        self._move_rate = move_rate
+        self._build_rate = build_rate
+        self._chat_rate = chat_rate
+        self._random = random.Random(seed)
+
+        self._framer = PacketFramer(SERVER_TO_CLIENT)
+        self._joined = threading.Event()
+        self._names = {}
+        self._sent = collections.OrderedDict()
+        self._others = {}
+        self._swarm = swarm if swarm is not None else {}
+        self._swarm[name] = self
+
+    def connect(self, address):
+        """
+        Connects to a server, logs in and starts the bot's thread.
+
+        :param address: The host and port of the server.
+        :type address: tuple
+        """
+        self._sock = socket.create_connection(address)
+        self._sock.settimeout(0.05)
+        self._connected_at = time.time()
+
+        key = hashlib.md5((self._salt + self.name).encode("utf-8")).hexdigest()
+        self._sock.sendall(PlayerIdentificationPacket.make({
+            "protocol_version": 7,
+            "username": self.name,
+            "key": key,
+            "reserved": 0
+        }))
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="bot-%s" % self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait_joined(self, timeout=None):
+        """
+        Waits until the bot has loaded the level.
+
+        :rtype: bool
+        :return: Whether the bot has joined.
+        """
+        return self._joined.wait(timeout)
+
+    def reset_stats(self):
+        self.bytes_received = 0
+        self.packets_received = 0
+        self.latencies = []
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+        if self._sock:
+            self._sock.close()
+
+    def move(self, x, y, z, yaw=0, pitch=0):
+        """
+        Sends the position of the bot, in blocks.
+        """
+        self._position = (x, y, z)
+        state = (int(x * 32), int(y * 32), int(z * 32), yaw, pitch)
+
+        # The bots receiving the move look its time up by the position they end up with
+        self._sent.pop(state, None)
+        self._sent[state] = time.time()
+        if len(self._sent) > self.SENT_POSITIONS:
+            self._sent.popitem(last=False)
+
+        self._send(PositionAndOrientationPacket.make({
+            "player_id": -1,
+            "frac_x": state[0],
+            "frac_y": state[1],
+            "frac_z": state[2],
+            "yaw": yaw,
+            "pitch": pitch
+        }))
+
+    def get_sent_time(self, state):
+        """
+        Gets when the bot sent a position.
+
+        :param state: The position in 1/32 blocks, the yaw and the pitch.
+        :type state: tuple
+        :return: The time the position was last sent, None if the bot doesn't remember sending it.
+        :rtype: float
+        """
+        return self._sent.get(state)
+
+    def place_block(self, x, y, z, block_type):
+        self._send(SetBlockPacket.make({"x": x, "y": y, "z": z, "mode": 1, "block_type": block_type}))
+
+    def chat(self, message):
+        self._send(MessagePacket.make({"player_id": 0xff, "message": message}))
+
+    def _send(self, data):
+        try:
+            self._sock.sendall(data)
+        except OSError:
+            self._running = False
+
+    def _run(self):
+        # The actions are scheduled at random times around their rates, so the bots don't act in lockstep
+        actions = [[rate, action, 0] for rate, action in ((self._move_rate, self._random_move),
+                                                          (self._build_rate, self._random_block),
+                                                          (self._chat_rate, self._random_chat)) if rate > 0]
+
+        while self._running:
+            try:
+                data = self._sock.recv(self.RECEIVE_SIZE)
+                if not data:
+                    break
+                self._received(data)
+            except socket.timeout:
+                pass
+            except OSError:
+                break
+
+            if not self._joined.is_set() or self._spawn is None:
+                continue
+
+            now = time.time()
+            for action in actions:
+                if now >= action[2]:
+                    if action[2]:
+                        action[1]()
+                    action[2] = now + self._random.expovariate(action[0])
+
+        self._running = False
+
+    def _received(self, data):
+        self.bytes_received += len(data)
+        self._framer.feed(data)
+
+        for frame in self._framer.frames():
+            self.packets_received += 1
+            packet_id = frame[0]
+
+            if packet_id == LevelFinalizePacket.ID:
+                self.join_time = time.time() - self._connected_at
+                self._joined.set()
+            elif packet_id == SpawnPlayerPacket.ID:
+                fields = SpawnPlayerPacket.unpack(frame)
+                self._names[fields["player_id"]] = fields["username"]
+                self._others[fields["player_id"]] = (fields["x"], fields["y"], fields["z"], fields["yaw"],
+                                                     fields["pitch"])
+            elif packet_id == DespawnPlayerPacket.ID:
+                self._names.pop(frame[1], None)
+                self._others.pop(frame[1], None)
+            elif packet_id in MOVEMENT_PACKETS:
+                self._moved(SERVER_TO_CLIENT[packet_id].unpack(frame))
+
+    def _moved(self, fields):
+        player_id = fields["player_id"]
+        if player_id == -1:
+            if "frac_x" in fields:
+                self._spawn = (fields["frac_x"] / 32, fields["frac_y"] / 32, fields["frac_z"] / 32)
+                self._position = self._spawn
+            return
+
+        last = self._others.get(player_id)
+        if "frac_x" in fields:
+            state = (fields["frac_x"], fields["frac_y"], fields["frac_z"], fields["yaw"], fields["pitch"])
+        elif last is None:
+            # A relative update for a player the bot hasn't seen spawn, the next absolute one catches up
+            return
+        elif "delta_x" in fields:
+            state = (last[0] + fields["delta_x"], last[1] + fields["delta_y"], last[2] + fields["delta_z"],
+                     fields.get("yaw", last[3]), fields.get("pitch", last[4]))
+        else:
+            state = last[:3] + (fields["yaw"], fields["pitch"])
+        self._others[player_id] = state
+
+        # Only the first update reaching each position counts, the far updates repeat it
+        other = self._swarm.get(self._names.get(player_id))
+        if other is not None and state != last:
+            sent_at = other.get_sent_time(state)
+            if sent_at is not None:
+                self.latencies.append(time.time() - sent_at)
+
+    def _random_move(self):
+        x, y, z = (coordinate + self._random.uniform(-1, 1) for coordinate in self._position)
+        x = min(max(x, self._spawn[0] - self.WANDER_DISTANCE), self._spawn[0] + self.WANDER_DISTANCE)
+        z = min(max(z, self._spawn[2] - self.WANDER_DISTANCE), self._spawn[2] + self.WANDER_DISTANCE)
+        self.move(x, self._spawn[1], z, self._random.randrange(256), self._random.randrange(256))
+
+    def _random_block(self):
+        x, y, z = (int(coordinate) for coordinate in self._spawn)
+        self.place_block(x + self._random.randint(-self.WANDER_DISTANCE, self.WANDER_DISTANCE), y,
+                         z + self._random.randint(-self.WANDER_DISTANCE, self.WANDER_DISTANCE), 1)
+
+    def _random_chat(self):
+        self.chat("Hello from %s" % self.name)
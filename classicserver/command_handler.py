@@ -16,6 +16,8 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import math
+
 from classicserver.packet.packet import MessagePacket, DisconnectPlayerPacket, PositionAndOrientationPacket
 
 HELP_TEXT = """
@@ -25,10 +27,153 @@ HELP_TEXT = """
 &e /tp &2<x> <y> <z> &b - teleport to coordinates
 &e /tp &2<playerName> &b - teleport to player
 &e /kick &2<playerName> [reason] &b - kick a player
+&e /goto &2<worldName> &b - go to another world
+&e /worlds &b - list the worlds
+&e /limits &b - show the packets dropped by the rate limits
+&e /cuboid &2<x1 y1 z1> <x2 y2 z2> <block> &b - fill a box
+&e /replace &2<x1 y1 z1> <x2 y2 z2> <old> <new>
+&e /copy &2<x1 y1 z1> <x2 y2 z2> &b - copy a box
+&e /paste &2<x> <y> <z> &b - paste the copied box
+&e /undo &2<playerName> <minutes> &b - undo a player's changes
+&e /blockinfo &2<x> <y> <z> &b - who changed a block
 """
 
+# The block types of the Classic protocol
+BLOCK_TYPES = 50
+
+EDIT_USAGE = {
+    "cuboid": "/cuboid <x1 y1 z1> <x2 y2 z2> <block>",
+    "replace": "/replace <x1 y1 z1> <x2 y2 z2> <old> <new>",
+    "copy": "/copy <x1 y1 z1> <x2 y2 z2>",
+    "paste": "/paste <x> <y> <z>"
+}
+
+# The most changes of a block /blockinfo lists, the latest ones
+BLOCK_INFO_CHANGES = 8
+
+
+def format_age(seconds):
+    """
+    Formats how long ago something happened in a few characters, e.g. "5m".
+
+    :type seconds: float
+    :rtype: str
+    """
+    for unit, length in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= length:
+            return "%d%s" % (seconds // length, unit)
+    return "%ds" % max(seconds, 0)
+
 
 class CommandHandler(object):
+    @staticmethod
+    def _edit_done(player, verb):
+        # Replies once the blocks changed by an edit have been found
+        def done(count, resent):
+            player.connection.send(MessagePacket.make({
+                "player_id": 0,
+                "message": "&a%s %d blocks%s." % (verb, count, ", resending the level" if resent else "")
+            }))
+        return done
+
+    @staticmethod
+    def _block_info_done(player):
+        # Lists the latest changes of a block once they've been read
+        def done(changes, now):
+            if not changes:
+                player.connection.send(MessagePacket.make({"player_id": 0, "message": "&aNobody changed that block."}))
+
+            for timestamp, name, old_block, new_block in changes[-BLOCK_INFO_CHANGES:]:
+                # Bulk edits don't record the types of the blocks
+                change = "bulk edit" if old_block is None else "%d to %d" % (old_block, new_block)
+                player.connection.send(MessagePacket.make({
+                    "player_id": 0,
+                    "message": "&e%s&f: %s, %s ago" % (name, change, format_age(now - timestamp))
+                }))
+        return done
+
+    @staticmethod
+    def _edit_command(server, player, command, args):
+        # The corners of the box may be given in any order, the block types follow them
+        try:
+            numbers = [int(arg) for arg in args]
+        except ValueError:
+            numbers = None
+
+        counts = {"cuboid": 7, "replace": 8, "copy": 6, "paste": 3}
+        if numbers is None or len(numbers) != counts[command] or \
+                any(not 0 <= block < BLOCK_TYPES for block in numbers[6:]):
+            player.connection.send(MessagePacket.make({"player_id": 0, "message": "&4Usage: " + EDIT_USAGE[command]}))
+            return
+
+        if command == "paste":
+            if not player.clipboard:
+                player.connection.send(MessagePacket.make({"player_id": 0, "message": "&4Use /copy first."}))
+                return
+
+            x, y, z = numbers
+            width, height, depth = player.clipboard[0]
+            box = (x, y, z, x + width - 1, y + height - 1, z + depth - 1)
+        else:
+            corners = numbers[:6]
+            box = tuple(min(corners[axis], corners[axis + 3]) for axis in range(3)) + \
+                tuple(max(corners[axis], corners[axis + 3]) for axis in range(3))
+
+        if command == "copy":
+            player.clipboard = server.get_world(player.world).copy(*box)
+            width, height, depth = player.clipboard[0]
+            player.connection.send(MessagePacket.make({
+                "player_id": 0,
+                "message": "&aCopied %d blocks." % (width * height * depth)
+            }))
+            return
+
+        done = CommandHandler._edit_done(player, "Changed")
+        if command == "cuboid":
+            block = numbers[6]
+            server.edit_world(player.world, box, lambda world: world.fill(*(box + (block,))), done, player)
+        elif command == "replace":
+            old_block, new_block = numbers[6:]
+            server.edit_world(player.world, box, lambda world: world.replace(*(box + (old_block, new_block))), done,
+                              player)
+        else:
+            clipboard = player.clipboard
+            server.edit_world(player.world, box, lambda world: world.paste(box[0], box[1], box[2], clipboard), done,
+                              player)
+
+    @staticmethod
+    def _history_command(server, player, command, args):
+        if command == "undo":
+            try:
+                minutes = float(args[1]) if len(args) == 2 else -1
+            except ValueError:
+                minutes = -1
+
+            # "nan" and "inf" parse as well
+            if not math.isfinite(minutes) or minutes <= 0:
+                player.connection.send(MessagePacket.make({"player_id": 0,
+                                                           "message": "&4Usage: /undo <playerName> <minutes>"}))
+                return
+
+            server.undo_player(player.world, player, args[0], minutes * 60,
+                               CommandHandler._edit_done(player, "Undid"))
+        else:
+            try:
+                x, y, z = (int(arg) for arg in args)
+            except ValueError:
+                x = y = z = None
+
+            if x is None or not server.get_world(player.world).contains(x, y, z):
+                player.connection.send(MessagePacket.make({"player_id": 0,
+                                                           "message": "&4Usage: /blockinfo <x> <y> <z>"}))
+                return
+
+            server.get_block_history(player.world, x, y, z, CommandHandler._block_info_done(player))
+
+        if server.get_level(player.world).history is None:
+            player.connection.send(MessagePacket.make({"player_id": 0,
+                                                       "message": "&4The block history is turned off."}))
+
     @staticmethod
     def handle_command(server, player, command, args):
         if command == "tp":
@@ -42,13 +187,7 @@ class CommandHandler(object):
                                                                               "yaw": player.yaw,
                                                                               "pitch": player.pitch
                                                                               }))
-                    server.broadcast(PositionAndOrientationPacket.make({"player_id": player.player_id,
-                                                                        "frac_x": int(player.coordinates[0] * 32),
-                                                                        "frac_y": int(player.coordinates[1] * 32),
-                                                                        "frac_z": int(player.coordinates[2] * 32),
-                                                                        "yaw": player.yaw,
-                                                                        "pitch": player.pitch
-                                                                        }))
+                    server.broadcast_movement(player)
                 except ValueError:
                     player.connection.send(MessagePacket.make({"player_id": 0, "message": "&4Invalid coordinates,"}))
                     player.connection.send(MessagePacket.make({"player_id": 0,
@@ -57,7 +196,14 @@ class CommandHandler(object):
             elif len(args) == 1:
                 for target_player in server.get_players().values():
                     if target_player.name == args[0]:
-                        player.coordinates = target_player.coordinates
+                        if target_player.world != player.world:
+                            player.connection.send(MessagePacket.make({
+                                "player_id": 0,
+                                "message": "&4Target player is in the world %s, use /goto first." % target_player.world
+                            }))
+                            break
+
+                        player.coordinates = list(target_player.coordinates)
                         player.connection.send(PositionAndOrientationPacket.make({"player_id": -1,
                           "frac_x": int(player.coordinates[0] * 32),
                           "frac_y": int(player.coordinates[1] * 32),
@@ -65,13 +211,7 @@ class CommandHandler(object):
                           "yaw": player.yaw,
                           "pitch": player.pitch
                         }))
-                        server.broadcast(PositionAndOrientationPacket.make({"player_id": player.player_id,
-                            "frac_x": int(player.coordinates[0] * 32),
-                            "frac_y": int(player.coordinates[1] * 32),
-                            "frac_z": int(player.coordinates[2] * 32),
-                            "yaw": player.yaw,
-                            "pitch": player.pitch
-                        }))
+                        server.broadcast_movement(player)
                         break
                 else:
                     player.connection.send(MessagePacket.make({"player_id": 0,
@@ -100,6 +240,55 @@ class CommandHandler(object):
             else:
                 player.connection.send(MessagePacket.make({"player_id": 0,
                     "message": "&4You need to be an op to do that!"}))
+        elif command == "goto":
+            if len(args) == 1:
+                if args[0] == player.world:
+                    player.connection.send(MessagePacket.make({"player_id": 0,
+                                                               "message": "&4You are already in that world."}))
+                elif not server.join_world(player, args[0]):
+                    player.connection.send(MessagePacket.make({"player_id": 0,
+                                                               "message": "&4World not found, see /worlds."}))
+            else:
+                player.connection.send(MessagePacket.make({"player_id": 0, "message": "&4Usage: /goto <worldName>"}))
+        elif command == "worlds":
+            # Messages are limited to 64 characters, so long lists are split over several lines
+            line = "&eWorlds:&f"
+            for name in server.get_world_names():
+                if len(line) + len(name) + 1 > 64:
+                    player.connection.send(MessagePacket.make({"player_id": 0, "message": line}))
+                    line = "&f"
+                line += " " + name
+            player.connection.send(MessagePacket.make({"player_id": 0, "message": line}))
+        elif command == "limits":
+            if server.is_op(player.name):
+                found = False
+                for target_player in server.get_players().values():
+                    dropped = target_player.connection.limits.get_dropped()
+                    if dropped:
+                        found = True
+                        player.connection.send(MessagePacket.make({
+                            "player_id": 0,
+                            "message": "&e%s&f: %s" % (target_player.name, ", ".join(
+                                "%s %d" % (name, count) for name, count in sorted(dropped.items())))
+                        }))
+                if not found:
+                    player.connection.send(MessagePacket.make({"player_id": 0,
+                                                               "message": "&aNo player went over the rate limits."}))
+            else:
+                player.connection.send(MessagePacket.make({"player_id": 0,
+                    "message": "&4You need to be an op to do that!"}))
+        elif command in EDIT_USAGE:
+            if server.is_op(player.name):
+                CommandHandler._edit_command(server, player, command, args)
+            else:
+                player.connection.send(MessagePacket.make({"player_id": 0,
+                    "message": "&4You need to be an op to do that!"}))
+        elif command in ("undo", "blockinfo"):
+            if server.is_op(player.name):
+                CommandHandler._history_command(server, player, command, args)
+            else:
+                player.connection.send(MessagePacket.make({"player_id": 0,
+                    "message": "&4You need to be an op to do that!"}))
         elif command == "help":
             for line in HELP_TEXT.split("\n"):
                 line = line.strip()
@@ -16,11 +16,83 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import asyncio
+import collections
+import itertools
+import logging
+import threading
+import time
+
+from classicserver.metrics import METRICS, BYTES_RECEIVED, BYTES_SENT, LOCK_WAIT_SECONDS, count_sent_packets
+from classicserver.packet.framer import PacketFramer, FramingError
+
+
+class SlowClientError(IOError):
+    pass
+
+
+class BaseConnection(object):
+    # Clients with more queued outbound data than the high water mark for longer than the stall timeout are dropped,
+    # and so are the ones exceeding the maximum right away
+    HIGH_WATER_MARK = 1024 * 1024
+    STALL_TIMEOUT = 15
+    MAX_QUEUED = 16 * 1024 * 1024
+
+    # The bytes sent and received over the connection so far
+    bytes_sent = 0
+    bytes_received = 0
+    # The RateLimits of the connection, set by the server
+    limits = None
 
-class Connection(object):
     _address = None
+    _stalled_since = None
+
+    def _count_sent(self, data):
+        self.bytes_sent += len(data)
+        if METRICS.enabled:
+            BYTES_SENT.inc(amount=len(data))
+            count_sent_packets(data)
+
+    def _count_received(self, length):
+        self.bytes_received += length
+        if METRICS.enabled:
+            BYTES_RECEIVED.inc(amount=length)
+
+    def _check_queued(self, queued):
+        if queued > self.MAX_QUEUED:
+            raise SlowClientError("%d bytes are queued for the client" % queued)
+
+        if queued <= self.HIGH_WATER_MARK:
+            self._stalled_since = None
+        elif self._stalled_since is None:
+            self._stalled_since = time.time()
+        elif time.time() - self._stalled_since > self.STALL_TIMEOUT:
+            raise SlowClientError("The client has been stalled for %d seconds" % self.STALL_TIMEOUT)
+
+    def get_queued(self):
+        """
+        Gets the amount of outbound bytes which haven't been written to the socket yet.
+
+        :rtype: int
+        """
+        raise NotImplementedError()
+
+    def get_address(self):
+        return self._address
+
+
+class Connection(BaseConnection):
+    RECEIVE_SIZE = 4096
+    # The most buffers written by a single sendmsg() call, the usual IOV_MAX
+    MAX_BUFFERS = 1024
+
     _sock = None
     _buffer = None
+    _framer = None
+
+    _queue = None
+    _queued = 0
+    _queue_lock = None
 
     def __init__(self, server, address, sock):
         """
@@ -37,24 +109,148 @@ class Connection(object):
         self._sock = sock
         self.server = server
 
+        self._buffer = bytearray(self.RECEIVE_SIZE)
+        self._framer = PacketFramer()
+
+        self._queue = collections.deque()
+        self._queue_lock = threading.Lock()
+
         self._sock.setblocking(0)
 
     def send(self, data):
-        self._sock.send(data)
+        """
+        Queues data to be sent and writes as much of the queue as the socket accepts without blocking.
+
+        :param data: The data to send.
+        :type data: bytes
+        """
+        self._count_sent(data)
+
+        if METRICS.enabled:
+            start = time.time()
+            self._queue_lock.acquire()
+            LOCK_WAIT_SECONDS.observe(time.time() - start, ("connection_queue",))
+        else:
+            self._queue_lock.acquire()
+
+        try:
+            self._queue.append(data)
+            self._queued += len(data)
+            self._write()
+        finally:
+            self._queue_lock.release()
+
+    def _write(self):
+        # Writes the queued buffers with as few system calls as possible, must be called with the queue lock held
+        while self._queue:
+            buffers = list(itertools.islice(self._queue, self.MAX_BUFFERS))
+            length = sum(len(buf) for buf in buffers)
+
+            try:
+                if hasattr(self._sock, "sendmsg"):
+                    sent = self._sock.sendmsg(buffers)
+                else:
+                    sent = self._sock.send(buffers[0])
+                    length = len(buffers[0])
+            except (BlockingIOError, InterruptedError):
+                break
+
+            self._queued -= sent
+            partial = sent < length
+
+            while sent:
+                buf = self._queue[0]
+                if sent >= len(buf):
+                    sent -= len(buf)
+                    self._queue.popleft()
+                else:
+                    self._queue[0] = memoryview(buf)[sent:]
+                    sent = 0
+
+            if partial:
+                break
+
+        self._check_queued(self._queued)
+
+    def get_queued(self):
+        return self._queued
+
+    def close(self):
+        with self._queue_lock:
+            try:
+                self._write()
+            except IOError:
+                pass
+            self._queue.clear()
+            self._queued = 0
+
+        self._sock.close()
 
     def flush(self):
-        success = False
-        buf = b""
+        if self._queued:
+            with self._queue_lock:
+                self._write()
+
+        view = memoryview(self._buffer)
 
         while True:
             try:
-                buf += self._sock.recv(1024)
-                success = True
+                length = self._sock.recv_into(view)
             except BlockingIOError:
                 break
 
-        if success:
-            self.server.data_hook(self, buf)
+            if not length:
+                raise ConnectionResetError("The connection was closed by the peer")
 
-    def get_address(self):
-        return self._address
+            self._count_received(length)
+            self._framer.feed(view[:length])
+
+            for frame in self._framer.frames():
+                self.server.data_hook(self, frame)
+
+
+class AsyncConnection(BaseConnection, asyncio.Protocol):
+    _transport = None
+    _framer = None
+
+    def __init__(self, server):
+        """
+        Creates a connection object driven by an asyncio event loop
+
+        :param server: A server object, which should contain tne data_hook(connection, buf) method
+        :type server: server
+        """
+        self.server = server
+        self._framer = PacketFramer()
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._address = transport.get_extra_info("peername")
+        self.server.add_connection(self)
+
+    def data_received(self, data):
+        self._count_received(len(data))
+        self._framer.feed(data)
+
+        try:
+            for frame in self._framer.frames():
+                self.server.data_hook(self, frame)
+        except FramingError as ex:
+            logging.error("Dropping connection %s: %s" % (repr(self._address), repr(ex)))
+            self.close()
+
+    def connection_lost(self, exc):
+        self.server.remove_connection(self)
+
+    def send(self, data):
+        if self._transport.is_closing():
+            raise BrokenPipeError("The connection is closed")
+        self._count_sent(data)
+        self._transport.write(data)
+        self._check_queued(self._transport.get_write_buffer_size())
+
+    def get_queued(self):
+        return self._transport.get_write_buffer_size()
+
+    def close(self):
+        self._transport.close()
@@ -0,0 +1,115 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from classicserver.packet.packet import BlockUpdatePacket
+
+
+def find_changes(before, after):
+    """
+    Finds the blocks which differ between two copies of the same box.
+
+    :param before: The blocks of the box before the change.
+    :type before: bytes
+    :param after: The blocks of the box after the change.
+    :type after: bytes
+    :return: The indexes of the changed blocks in the box.
+    :rtype: array.array
+    """
+    if numpy:
+        changed = numpy.flatnonzero(numpy.frombuffer(before, dtype=numpy.uint8) !=
+                                    numpy.frombuffer(after, dtype=numpy.uint8))
+        return array.array("I", changed.astype(numpy.uint32).tobytes())
+
+    return array.array("I", (index for index in range(len(before)) if before[index] != after[index]))
+
+
+class BulkEdit(object):
+    """
+    The blocks changed by a large edit, which are sent to the players in the world a batch at a time. The blocks are
+    encoded when they're sent, with their type at that time, so a block changed again meanwhile is never sent stale.
+    """
+
+    world = None
+
+    _origin = None
+    _width = 0
+    _depth = 0
+    _changes = None
+    _offset = 0
+
+    def __init__(self, world, origin, dimensions, changes):
+        """
+        Creates a bulk edit
+
+        :param world: The name of the world.
+        :type world: str
+        :param origin: The lowest corner of the edited box.
+        :type origin: tuple
+        :param dimensions: The (width, height, depth) of the edited box.
+        :type dimensions: tuple
+        :param changes: The indexes of the changed blocks in the box, see find_changes().
+        :type changes: array.array
+        """
+        self.world = world
+        self._origin = origin
+        self._width, _, self._depth = dimensions
+        self._changes = changes
+
+    def __len__(self):
+        return len(self._changes)
+
+    def is_done(self):
+        return self._offset >= len(self._changes)
+
+    def take(self, world, count):
+        """
+        Encodes the next changed blocks.
+
+        :param world: The world edited.
+        :type world: World
+        :param count: The most blocks to encode.
+        :type count: int
+        :return: The encoded BlockUpdate packets.
+        :rtype: bytes
+        """
+        changes = self._changes[self._offset:self._offset + count]
+        self._offset += len(changes)
+
+        origin_x, origin_y, origin_z = self._origin
+        data = bytearray(len(changes) * BlockUpdatePacket.SIZE)
+        offset = 0
+
+        for index in changes:
+            rest, x = divmod(index, self._width)
+            y, z = divmod(rest, self._depth)
+            x, y, z = x + origin_x, y + origin_y, z + origin_z
+            offset = BlockUpdatePacket.pack_into(data, offset, {
+                "x": x,
+                "y": y,
+                "z": z,
+                "block_type": world.get_block(x, y, z)
+            })
+
+        return bytes(data)
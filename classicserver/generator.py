@@ -0,0 +1,112 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+
+AIR = 0
+STONE = 1
+GRASS = 2
+DIRT = 3
+WATER = 9
+SAND = 12
+
+
+def _layers(width, depth, blocks):
+    # Builds the blocks of a world made of uniform horizontal layers, one block type per layer from the bottom up
+    layer = width * depth
+    return bytearray(b"".join(bytes((block,)) * layer for block in blocks))
+
+
+def flat(width, height, depth, seed=None):
+    """
+    Generates a flat world, filled with dirt up to the middle of the world and covered with grass.
+    """
+    surface = height // 2
+    return _layers(width, depth, [DIRT] * surface + [GRASS] + [AIR] * (height - surface - 1))
+
+
+def empty(width, height, depth, seed=None):
+    """
+    Generates an empty world with a grass floor.
+    """
+    return _layers(width, depth, [GRASS] + [AIR] * (height - 1))
+
+
+def _value_noise(width, depth, scale, rng):
+    # Smoothly interpolated random values on a lattice with the given spacing, one value in [0, 1) per column
+    lattice_width = width // scale + 2
+    lattice = [rng.random() for _ in range(lattice_width * (depth // scale + 2))]
+
+    steps = []
+    for i in range(max(width, depth)):
+        cell, offset = divmod(i, scale)
+        t = offset / scale
+        steps.append((cell, t * t * (3 - 2 * t)))
+
+    noise = []
+    for z in range(depth):
+        cell_z, tz = steps[z]
+        row = lattice_width * cell_z
+        for x in range(width):
+            cell_x, tx = steps[x]
+            top = lattice[row + cell_x] + (lattice[row + cell_x + 1] - lattice[row + cell_x]) * tx
+            bottom = lattice[row + lattice_width + cell_x] + \
+                (lattice[row + lattice_width + cell_x + 1] - lattice[row + lattice_width + cell_x]) * tx
+            noise.append(top + (bottom - top) * tz)
+
+    return noise
+
+
+def terrain(width, height, depth, seed=None):
+    """
+    Generates rolling hills from layered value noise, with water filling everything below the middle of the world.
+    """
+    rng = random.Random(seed)
+    octaves = [(_value_noise(width, depth, scale, rng), amplitude) for scale, amplitude in ((64, 0.6), (16, 0.3),
+                                                                                            (4, 0.1))]
+
+    sea_level = height // 2
+    relief = height // 3
+    highest = min(height - 1, 255)
+    heights = bytes(max(1, min(highest, int(sea_level - relief / 2 + relief * sum(noise[i] * amplitude
+                                                                                   for noise, amplitude in octaves))))
+                    for i in range(width * depth))
+
+    # Each layer is the height map translated to the block found at that height in every column
+    layers = []
+    for y in range(height):
+        table = bytearray(256)
+        for column_height in range(256):
+            if y < column_height - 3:
+                table[column_height] = STONE
+            elif y < column_height:
+                table[column_height] = DIRT
+            elif y == column_height:
+                table[column_height] = GRASS if column_height > sea_level else SAND
+            elif y <= sea_level:
+                table[column_height] = WATER
+        layers.append(heights.translate(table))
+
+    return bytearray(b"".join(layers))
+
+
+GENERATORS = {
+    "flat": flat,
+    "empty": empty,
+    "terrain": terrain
+}
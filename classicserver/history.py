@@ -0,0 +1,634 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import array
+import binascii
+import bisect
+import collections
+import concurrent.futures
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import traceback
+
+# x, y, z, old block, new block, timestamp in milliseconds of the history's clock, see BlockHistory.get_time()
+HISTORY_RECORD = struct.Struct("!HHHBBQ")
+
+# The records kept in memory for each world by default, 16 bytes each
+MEMORY_RECORDS = 262144
+
+# The records in the file of a player's log by default, when it's full it replaces the previous one
+FILE_RECORDS = 1048576
+
+# The side of the cubes the blocks are indexed by, for finding who changed a block
+INDEX_SECTION = 16
+
+# The records read at once when indexing a file
+READ_RECORDS = 65536
+
+# The corners of a box edited at once, the timestamp in milliseconds and the length of the name of the player who
+# edited it
+EDIT_RECORD = struct.Struct("!HHHHHHQB")
+
+# The most edited boxes kept, the older half is dropped when there are more
+MAX_EDITS = 4096
+
+# The names used as they are for the files of the logs, the others are hex encoded after a "-"
+SAFE_NAME = re.compile(r"^[A-Za-z0-9_.]{1,64}$")
+
+
+def get_section(x, y, z):
+    return x // INDEX_SECTION, y // INDEX_SECTION, z // INDEX_SECTION
+
+
+def _count_records(path):
+    # Counts the records of a file, dropping a record torn by a crash as the following records would be misaligned
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+    if size % HISTORY_RECORD.size:
+        logging.warning("Dropping a torn record at the end of the block history %s" % path)
+        with open(path, "r+b") as file:
+            file.truncate(size - size % HISTORY_RECORD.size)
+
+    return size // HISTORY_RECORD.size
+
+
+class LogReader(object):
+    """
+    Reads the records of a player's log by number, from its files or its memory, keeping the files open until it's
+    closed.
+    """
+
+    _log = None
+    _files = None
+
+    def __init__(self, log):
+        """
+        :type log: PlayerLog
+        """
+        self._log = log
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, first, end):
+        """
+        Reads a range of records.
+
+        :param first: The number of the first record.
+        :type first: int
+        :param end: The number of the record after the last one.
+        :type end: int
+        :return: The packed records.
+        :rtype: bytes
+        """
+        size = HISTORY_RECORD.size
+        data = []
+
+        for path, start, count in self._log.get_segments():
+            low, high = max(first, start), min(end, start + count)
+            if low >= high:
+                continue
+
+            if path is None:
+                data.append(bytes(self._log.get_memory()[(low - start) * size:(high - start) * size]))
+                continue
+
+            file = self._files.get(path)
+            if file is None:
+                file = self._files[path] = open(path, "rb")
+            file.seek((low - start) * size)
+            data.append(file.read((high - low) * size))
+
+        return b"".join(data)
+
+    def read_record(self, number):
+        return HISTORY_RECORD.unpack(self.read(number, number + 1))
+
+    def close(self):
+        for file in self._files.values():
+            file.close()
+        self._files = {}
+
+
+class PlayerLog(object):
+    """
+    The block changes of a player in a world, oldest first. The latest changes are held in memory and the older ones
+    in a file, which both have the same packed records so either can be searched by time. Once the file is full, it
+    replaces the previous file of the log, whose changes are forgotten, so the log never takes more than two files.
+
+    The records are numbered in order and indexed by section, so the changes of a block are read without reading the
+    rest of the log. The index takes 4 bytes per record, it's built from the files when the log is opened and kept up
+    to date as changes are recorded.
+
+    The timestamps of the records never decrease, see BlockHistory. A log is only used by the thread of its history.
+    """
+
+    name = ""
+    # The timestamp of the latest change, in milliseconds
+    latest = 0
+
+    _path = None
+    _old_path = None
+    _file_records = 0
+
+    # The number of the first record kept, in the previous file if there is one
+    _base = 0
+    _old_count = 0
+    _file_count = 0
+    _records = None
+
+    # The numbers of the records by section, in order
+    _sections = None
+
+    def __init__(self, name, path, file_records=FILE_RECORDS):
+        """
+        Opens a player's log, with the changes already in its files if there are any.
+
+        :param name: The name of the player.
+        :type name: str
+        :param path: The path of the file the older changes are moved to.
+        :type path: str
+        :param file_records: The most records in the file before it replaces the previous one.
+        :type file_records: int
+        """
+        self.name = name
+        self._path = path
+        self._old_path = path + ".old"
+        self._file_records = file_records
+        self._records = bytearray()
+        self._sections = {}
+
+        self._old_count = _count_records(self._old_path)
+        self._file_count = _count_records(self._path)
+        self._index_file(self._old_path, 0)
+        self._index_file(self._path, self._old_count)
+
+    def _index_file(self, path, number):
+        if not os.path.exists(path):
+            return
+
+        with open(path, "rb") as file:
+            while True:
+                data = file.read(READ_RECORDS * HISTORY_RECORD.size)
+                if not data:
+                    break
+
+                for x, y, z, _, _, timestamp in HISTORY_RECORD.iter_unpack(data):
+                    self._index(number, x, y, z)
+                    number += 1
+                self.latest = max(self.latest, timestamp)
+
+    def _index(self, number, x, y, z):
+        section = get_section(x, y, z)
+        numbers = self._sections.get(section)
+        if numbers is None:
+            numbers = self._sections[section] = array.array("I")
+        numbers.append(number)
+
+    def __len__(self):
+        return self._old_count + self._file_count + self.get_memory_count()
+
+    def get_memory_count(self):
+        return len(self._records) // HISTORY_RECORD.size
+
+    def get_memory(self):
+        return self._records
+
+    def get_segments(self):
+        """
+        Gets where the records are.
+
+        :return: The (path, number of the first record, amount of records) tuples of the previous file, the file and
+                 the memory, which has None as its path.
+        :rtype: tuple
+        """
+        return ((self._old_path, self._base, self._old_count),
+                (self._path, self._base + self._old_count, self._file_count),
+                (None, self._base + self._old_count + self._file_count, self.get_memory_count()))
+
+    def get_sections(self):
+        return self._sections.keys()
+
+    def append(self, x, y, z, old_block, new_block, timestamp):
+        self._index(self._base + len(self), x, y, z)
+        self._records += HISTORY_RECORD.pack(x, y, z, old_block, new_block, timestamp)
+        self.latest = timestamp
+
+    def spill(self):
+        """
+        Moves the changes held in memory to the file. If the file is full afterwards, it replaces the previous file.
+
+        :return: The amount of changes moved, and the sections the log has no changes in anymore.
+        :rtype: tuple
+        """
+        count = self.get_memory_count()
+        if not count:
+            return 0, []
+
+        with open(self._path, "ab") as file:
+            file.write(self._records)
+        self._records = bytearray()
+        self._file_count += count
+
+        if self._file_count < self._file_records:
+            return count, []
+
+        os.replace(self._path, self._old_path)
+        self._base += self._old_count
+        self._old_count, self._file_count = self._file_count, 0
+
+        # The records of the previous file are gone, the numbers are in order so they're at the start of every list
+        dropped = []
+        for section, numbers in list(self._sections.items()):
+            first = bisect.bisect_left(numbers, self._base)
+            if first == len(numbers):
+                del self._sections[section]
+                dropped.append(section)
+            elif first:
+                del numbers[:first]
+
+        return count, dropped
+
+    def get_changes(self, since=0):
+        """
+        Gets the changes made since a time, found by a binary search of the files and the memory.
+
+        :param since: The timestamp of the earliest change to get, in milliseconds.
+        :type since: float
+        :return: The (x, y, z, old block, new block, timestamp) tuples, oldest first.
+        :rtype: list
+        """
+        end = self._base + len(self)
+
+        with LogReader(self) as reader:
+            low, high = self._base, end
+            while low < high:
+                middle = (low + high) // 2
+                if reader.read_record(middle)[5] < since:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            return list(HISTORY_RECORD.iter_unpack(reader.read(low, end)))
+
+    def get_block_changes(self, x, y, z):
+        """
+        Gets the changes of a block, only reading the records of its section.
+
+        :return: The (x, y, z, old block, new block, timestamp) tuples, oldest first.
+        :rtype: list
+        """
+        changes = []
+
+        with LogReader(self) as reader:
+            for number in self._sections.get(get_section(x, y, z), ()):
+                record = reader.read_record(number)
+                if record[:3] == (x, y, z):
+                    changes.append(record)
+
+        return changes
+
+
+class BlockHistory(object):
+    """
+    Who changed which blocks of a world, kept as a log of packed records for each player so a player's changes can be
+    found without going through anyone else's. Up to a number of records are held in memory, when there are more the
+    logs of the players who haven't built for the longest are moved to files, from which they're searched the same way.
+
+    The sections of the world are indexed with the players who changed blocks in them, so finding who changed a block
+    only reads the records of the block's section in the logs of those players. The logs are opened and indexed
+    together with the history, i.e. when the world is loaded.
+
+    Bulk edits change too many blocks to log each of them, the boxes they edited are kept instead, so the blocks in
+    them are known to have been changed since their logged changes.
+
+    The logs and their files are only used by the history's own thread, so the thread owning the world never waits for
+    the disk: changes are queued to the history's thread, and queries return futures which complete on it once the
+    changes queued before them have been applied, in the order the queries were made.
+
+    Changes are timed with the history's clock, which starts at the time of the system clock and goes on with the
+    monotonic clock, so the logs stay in order if the system clock is set back, even between runs.
+    """
+
+    _directory = None
+    _memory_records = 0
+    _file_records = 0
+
+    _logs = None
+    _memory_count = 0
+    # The names of the players who changed blocks in every section
+    _sections = None
+    # The (box, timestamp, player name) tuples of the bulk edits, oldest first, with the timestamps in milliseconds
+    _edits = None
+    # The timestamp of the latest change, in milliseconds
+    _latest = 0
+
+    # The clock's time when the history was opened, and the monotonic time it was opened at
+    _start_time = 0
+    _start_monotonic = 0
+
+    _executor = None
+    # The (function, args) tuples applying the queued changes on the history's thread, in order
+    _pending = None
+    _pending_lock = None
+    _drain_queued = False
+
+    def __init__(self, directory, memory_records=MEMORY_RECORDS, file_records=FILE_RECORDS):
+        """
+        Opens the history of a world, the changes of previous runs are kept in its directory.
+
+        :param directory: The directory holding the logs of the players.
+        :type directory: str
+        :param memory_records: The most changes kept in memory.
+        :type memory_records: int
+        :param file_records: The most records in a file of a player's log, see PlayerLog.
+        :type file_records: int
+        """
+        self._directory = directory
+        self._memory_records = memory_records
+        self._file_records = file_records
+        self._logs = collections.OrderedDict()
+        self._sections = {}
+        self._edits = []
+        self._pending = collections.deque()
+        self._pending_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_edits()
+
+        for file_name in sorted(os.listdir(directory)):
+            name = file_name[:-len(".old")] if file_name.endswith(".old") else file_name
+            if not name.endswith(".log"):
+                continue
+
+            name = name[:-len(".log")]
+            if name.startswith("-"):
+                try:
+                    name = binascii.unhexlify(name[1:]).decode("utf-8")
+                except (binascii.Error, UnicodeDecodeError):
+                    continue
+            self._get_log(name, True)
+
+        if self._logs:
+            logging.info("Indexed the block history of %d players in %s" % (len(self._logs), directory))
+
+        # The clock never goes back to before the changes already recorded
+        self._latest = max([log.latest for log in self._logs.values()] + [edit[1] for edit in self._edits] + [0])
+        self._start_time = max(time.time(), self._latest / 1000.0)
+        self._start_monotonic = time.monotonic()
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def get_time(self):
+        """
+        Gets the time of the history's clock, which the changes are timed with. It's close to the UNIX time, but only
+        ever goes forward.
+
+        :return: The time in seconds.
+        :rtype: float
+        """
+        return self._start_time + time.monotonic() - self._start_monotonic
+
+    def _get_timestamp(self, timestamp):
+        return int((self.get_time() if timestamp is None else timestamp) * 1000)
+
+    def _queue(self, function, *args):
+        with self._pending_lock:
+            self._pending.append((function, args))
+            if self._drain_queued:
+                return
+            self._drain_queued = True
+
+        self._executor.submit(self._drain)
+
+    def _drain(self):
+        with self._pending_lock:
+            self._drain_queued = False
+        self._apply_pending()
+
+    def _apply_pending(self):
+        while True:
+            with self._pending_lock:
+                if not self._pending:
+                    return
+                function, args = self._pending.popleft()
+
+            try:
+                function(*args)
+            except Exception as ex:
+                logging.error("Writing the block history %s failed: %s" % (self._directory, repr(ex)))
+                logging.debug(traceback.format_exc())
+
+    def _query(self, function, *args):
+        def query():
+            self._apply_pending()
+            return function(*args)
+
+        return self._executor.submit(query)
+
+    def _get_edits_path(self):
+        return os.path.join(self._directory, "edits.dat")
+
+    def _load_edits(self):
+        try:
+            with open(self._get_edits_path(), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+
+        offset = 0
+        while offset + EDIT_RECORD.size <= len(data):
+            record = EDIT_RECORD.unpack_from(data, offset)
+            offset += EDIT_RECORD.size
+            name = data[offset:offset + record[7]]
+            if len(name) < record[7]:
+                # Torn by a crash
+                break
+            offset += record[7]
+            self._edits.append((record[:6], record[6], name.decode("utf-8", "replace")))
+
+    @staticmethod
+    def _pack_edit(box, timestamp, player_name):
+        name = player_name.encode("utf-8")
+        return EDIT_RECORD.pack(*(box + (timestamp, len(name)))) + name
+
+    def _get_path(self, name):
+        if not SAFE_NAME.match(name):
+            name = "-" + binascii.hexlify(name.encode("utf-8")).decode("ascii")
+        return os.path.join(self._directory, name + ".log")
+
+    def _get_log(self, name, create=False):
+        log = self._logs.get(name)
+        if log is None and create:
+            log = self._logs[name] = PlayerLog(name, self._get_path(name), self._file_records)
+            for section in log.get_sections():
+                self._sections.setdefault(section, set()).add(name)
+        return log
+
+    def record(self, player_name, x, y, z, old_block, new_block, timestamp=None):
+        """
+        Records a block change, which is written in the background.
+
+        :param player_name: The name of the player who changed the block.
+        :type player_name: str
+        :param timestamp: The time of the change, see get_time(), now by default. A change is never recorded as made
+                          before the latest change.
+        :type timestamp: float
+        """
+        self._queue(self._record, player_name, x, y, z, old_block, new_block, self._get_timestamp(timestamp))
+
+    def _record(self, player_name, x, y, z, old_block, new_block, timestamp):
+        self._latest = max(self._latest, timestamp)
+        log = self._get_log(player_name, True)
+        log.append(x, y, z, old_block, new_block, self._latest)
+        self._logs.move_to_end(player_name)
+        self._memory_count += 1
+        self._sections.setdefault(get_section(x, y, z), set()).add(player_name)
+
+        if self._memory_count > self._memory_records:
+            self._evict()
+
+    def record_edit(self, player_name, box, timestamp=None):
+        """
+        Records a bulk edit, which is written in the background. Its blocks show up as changed by the player without
+        their types.
+
+        :param player_name: The name of the player who made the edit.
+        :type player_name: str
+        :param box: The corners of the edited box, (x1, y1, z1, x2, y2, z2) with x1 <= x2 and so on.
+        :type box: tuple
+        :param timestamp: The time of the edit, see get_time(), now by default.
+        :type timestamp: float
+        """
+        self._queue(self._record_edit, player_name, tuple(box), self._get_timestamp(timestamp))
+
+    def _record_edit(self, player_name, box, timestamp):
+        self._latest = max(self._latest, timestamp)
+        self._edits.append((box, self._latest, player_name))
+
+        if len(self._edits) <= MAX_EDITS:
+            with open(self._get_edits_path(), "ab") as file:
+                file.write(self._pack_edit(box, self._latest, player_name))
+            return
+
+        del self._edits[:len(self._edits) - MAX_EDITS // 2]
+        path = self._get_edits_path()
+        with open(path + ".tmp", "wb") as file:
+            file.write(b"".join(self._pack_edit(*edit) for edit in self._edits))
+        os.replace(path + ".tmp", path)
+
+    def _spill(self, log):
+        count, dropped = log.spill()
+        self._memory_count -= count
+
+        for section in dropped:
+            names = self._sections[section]
+            names.discard(log.name)
+            if not names:
+                del self._sections[section]
+
+    def _evict(self):
+        # Moves the logs of the players who have built least recently to their files, until half the memory is free
+        for log in list(self._logs.values()):
+            if self._memory_count <= self._memory_records // 2:
+                break
+            self._spill(log)
+
+    def get_changes(self, player_name, since=0):
+        """
+        Gets the block changes of a player since a time, in the background.
+
+        :param player_name: The name of the player.
+        :type player_name: str
+        :param since: The time of the earliest change to get, see get_time().
+        :type since: float
+        :return: A future with the (x, y, z, old block, new block, timestamp) tuples, oldest first.
+        :rtype: concurrent.futures.Future
+        """
+        return self._query(self._get_changes, player_name, since)
+
+    def _get_changes(self, player_name, since):
+        log = self._get_log(player_name)
+        if not log:
+            return []
+        return [record[:5] + (record[5] / 1000.0,) for record in log.get_changes(since * 1000)]
+
+    def get_edits(self, player_name, since=0):
+        """
+        Gets the bulk edits of a player since a time, in the background.
+
+        :param player_name: The name of the player.
+        :type player_name: str
+        :param since: The time of the earliest edit to get, see get_time().
+        :type since: float
+        :return: A future with the (box, timestamp) tuples, oldest first.
+        :rtype: concurrent.futures.Future
+        """
+        return self._query(self._get_edits, player_name, since)
+
+    def _get_edits(self, player_name, since):
+        return [(box, timestamp / 1000.0) for box, timestamp, name in self._edits
+                if name == player_name and timestamp >= since * 1000]
+
+    def get_block_changes(self, x, y, z):
+        """
+        Gets who changed a block in the background, only reading the records of its section in the logs of the
+        players who changed blocks in it.
+
+        :return: A future with the (timestamp, player name, old block, new block) tuples, oldest first. The blocks
+                 are None for bulk edits.
+        :rtype: concurrent.futures.Future
+        """
+        return self._query(self._get_block_changes, x, y, z)
+
+    def _get_block_changes(self, x, y, z):
+        changes = []
+        for name in self._sections.get(get_section(x, y, z), ()):
+            changes.extend((timestamp, name, old_block, new_block)
+                           for _, _, _, old_block, new_block, timestamp in self._logs[name].get_block_changes(x, y, z))
+
+        for box, timestamp, name in self._edits:
+            if box[0] <= x <= box[3] and box[1] <= y <= box[4] and box[2] <= z <= box[5]:
+                changes.append((timestamp, name, None, None))
+
+        changes.sort(key=lambda change: change[0])
+        return [(change[0] / 1000.0,) + change[1:] for change in changes]
+
+    def close(self):
+        """
+        Writes the queued changes, and moves every change held in memory to the files, where they're kept for the next
+        run. The history can't be used afterwards.
+        """
+        closed = self._query(self._spill_all)
+        self._executor.shutdown()
+        closed.result()
+
+    def _spill_all(self):
+        for log in list(self._logs.values()):
+            self._spill(log)
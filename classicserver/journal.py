@@ -0,0 +1,215 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import traceback
+
+# Sequence number, x, y, z, old block, new block, player ID, timestamp
+JOURNAL_RECORD = struct.Struct("!QHHHBBBd")
+
+
+def _read_last_sequence(path):
+    try:
+        with open(path, "rb") as journal_file:
+            size = os.fstat(journal_file.fileno()).st_size // JOURNAL_RECORD.size * JOURNAL_RECORD.size
+            if not size:
+                return 0
+
+            journal_file.seek(size - JOURNAL_RECORD.size)
+            return JOURNAL_RECORD.unpack(journal_file.read(JOURNAL_RECORD.size))[0]
+    except FileNotFoundError:
+        return 0
+
+
+class BlockJournal(object):
+    """
+    An append-only journal of the block changes made since the last save.
+
+    Records are written by the journal's own thread, which collects every record appended while the previous batch
+    was being synced, so a single fsync commits all of them. When a save starts, the journal is rotated: the records
+    it holds are covered by the save, and are deleted once the save is complete. Until then, both journals are
+    replayed over the save on startup.
+
+    Every record has a sequence number, which keeps growing across rotations, so a save which is updated in place can
+    tell which records it already covers.
+    """
+
+    # How long the writer waits for more records before committing a batch, in seconds
+    COMMIT_INTERVAL = 0.05
+
+    _path = None
+    _rotated_path = None
+    _file = None
+
+    _sequence = 0
+    _records = None
+    _condition = None
+    _file_lock = None
+    _running = False
+    _thread = None
+
+    def __init__(self, path):
+        """
+        Opens a journal, records from a previous run are kept until the next rotation.
+
+        :param path: The path of the journal file.
+        :type path: str
+        """
+        self._path = path
+        self._rotated_path = path + ".old"
+        self._records = []
+        self._condition = threading.Condition()
+        self._file_lock = threading.Lock()
+
+        self._open()
+        self._sequence = max(_read_last_sequence(self._rotated_path), _read_last_sequence(self._path))
+        self._running = True
+        self._thread = threading.Thread(target=self._writer_thread)
+        self._thread.start()
+
+    def _open(self):
+        self._file = open(self._path, "ab")
+
+        # Drop a record torn by a crash, the following records would be misaligned otherwise
+        size = self._file.tell()
+        if size % JOURNAL_RECORD.size:
+            logging.warning("Dropping a torn record at the end of the block journal")
+            self._file.truncate(size - size % JOURNAL_RECORD.size)
+
+    def append(self, x, y, z, old_block, new_block, player_id):
+        """
+        Adds a block change to the journal, it's committed to the disk by the writer thread shortly after.
+        """
+        with self._condition:
+            self._sequence += 1
+            self._records.append(JOURNAL_RECORD.pack(self._sequence, x, y, z, old_block, new_block, player_id,
+                                                     time.time()))
+            self._condition.notify()
+
+    def _writer_thread(self):
+        while True:
+            with self._condition:
+                while self._running and not self._records:
+                    self._condition.wait()
+
+                if not self._records:
+                    return
+
+            # Group the records appended in the meantime into the same commit
+            time.sleep(self.COMMIT_INTERVAL)
+
+            with self._file_lock:
+                try:
+                    self._commit()
+                except IOError as ex:
+                    logging.error("Writing the block journal failed: %s" % repr(ex))
+                    logging.debug(traceback.format_exc())
+
+    def _commit(self):
+        # Has to be called with the file lock held, appending can go on while the records are synced
+        with self._condition:
+            records, self._records = self._records, []
+
+        if not records:
+            return
+
+        self._file.write(b"".join(records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def rotate(self):
+        """
+        Starts a new journal, to be called right before taking the snapshot of a save, which then covers every record
+        appended so far. If the rotated journal of a failed save is still there, the records are added to it instead.
+
+        :return: The sequence number of the last record rotated.
+        :rtype: int
+        """
+        with self._file_lock:
+            with self._condition:
+                sequence = self._sequence
+            self._commit()
+            self._file.close()
+
+            if os.path.exists(self._rotated_path):
+                with open(self._rotated_path, "ab") as rotated_file, open(self._path, "rb") as journal_file:
+                    rotated_file.write(journal_file.read())
+                    rotated_file.flush()
+                    os.fsync(rotated_file.fileno())
+                os.remove(self._path)
+            else:
+                os.replace(self._path, self._rotated_path)
+
+            self._open()
+
+        return sequence
+
+    def discard_rotated(self):
+        """
+        Deletes the rotated journal, to be called once the save which rotated it is complete.
+        """
+        with self._file_lock:
+            try:
+                os.remove(self._rotated_path)
+            except FileNotFoundError:
+                pass
+
+    def replay(self, world, after=0):
+        """
+        Applies the journaled block changes to a world loaded from the last save.
+
+        :type world: World
+        :param after: The sequence number of the last record the save already covers, only later records are applied.
+        :type after: int
+        :return: The amount of block changes applied.
+        :rtype: int
+        """
+        count = 0
+
+        # The journal may have been discarded since the save, the new records have to come after the covered ones
+        with self._condition:
+            self._sequence = max(self._sequence, after)
+
+        for path in (self._rotated_path, self._path):
+            try:
+                with open(path, "rb") as journal_file:
+                    data = journal_file.read()
+            except FileNotFoundError:
+                continue
+
+            for offset in range(0, len(data) - JOURNAL_RECORD.size + 1, JOURNAL_RECORD.size):
+                sequence, x, y, z, _, new_block, _, _ = JOURNAL_RECORD.unpack_from(data, offset)
+                if sequence > after and world.contains(x, y, z):
+                    world.set_block(x, y, z, new_block)
+                    count += 1
+
+        return count
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+
+        with self._file_lock:
+            self._commit()
+            self._file.close()
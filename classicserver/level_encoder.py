@@ -0,0 +1,108 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures
+import os
+import struct
+import threading
+import zlib
+
+# Magic, deflate, no flags, no modification time, no extra flags, unknown OS
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+GZIP_TRAILER = struct.Struct("<II")
+
+
+class LevelEncoder(object):
+    """
+    Gzips the level data sent to joining players, compressing slices of the data on several threads.
+
+    Every slice is compressed on its own into raw deflate blocks, ending with a sync flush so the next slice starts on
+    a byte boundary, except for the last one which ends the deflate stream. Joined together with a gzip header and
+    trailer, they make up a single valid gzip stream. zlib releases the GIL while compressing, so the slices are
+    compressed in parallel.
+    """
+
+    # Slices are never smaller than this, as each one loses the history of the previous ones
+    MIN_SLICE_SIZE = 256 * 1024
+
+    _level = 6
+    _threads = 1
+    _executor = None
+    _lock = None
+
+    def __init__(self, level=6, threads=None):
+        """
+        Creates a level encoder
+
+        :param level: The compression level, from 1 (fastest) to 9 (smallest).
+        :type level: int
+        :param threads: The amount of threads to compress on, the amount of CPUs by default.
+        :type threads: int
+        """
+        if not 1 <= level <= 9:
+            raise ValueError("Invalid compression level: %d" % level)
+
+        self._level = level
+        self._threads = threads or os.cpu_count() or 1
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # The threads are only started once there's something big enough to compress in parallel
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._threads)
+            return self._executor
+
+    def _compress(self, data, last):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def encode(self, data):
+        """
+        Gzips data.
+
+        :type data: bytes
+        :return: The gzip stream.
+        :rtype: bytes
+        """
+        view = memoryview(data)
+        slice_size = max(self.MIN_SLICE_SIZE, -(-len(data) // self._threads))
+        slices = [view[offset:offset + slice_size] for offset in range(0, len(data), slice_size)] or [view]
+
+        if len(slices) == 1:
+            body = [self._compress(view, True)]
+            crc = zlib.crc32(view)
+        else:
+            executor = self._get_executor()
+            futures = [executor.submit(self._compress, part, index == len(slices) - 1)
+                       for index, part in enumerate(slices)]
+            # The checksum is computed over the whole data while the slices are compressed
+            crc = zlib.crc32(view)
+            body = [future.result() for future in futures]
+
+        return b"".join([GZIP_HEADER] + body + [GZIP_TRAILER.pack(crc, len(data) & 0xffffffff)])
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+# Used by worlds which haven't been given an encoder of their own
+DEFAULT_ENCODER = LevelEncoder()
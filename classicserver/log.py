@@ -0,0 +1,71 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import logging.handlers
+import queue
+
+# Below DEBUG, for the diagnostics of every tick and packet
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(threadName)s] %(message)s"
+
+
+def is_tracing():
+    """
+    Checks whether the trace diagnostics are logged, they're only worth formatting if they are.
+
+    :rtype: bool
+    """
+    return logging.getLogger().isEnabledFor(TRACE)
+
+
+def setup_logging(config):
+    """
+    Sets up the root logger to hand the records over to a queue, which is written out on a thread of its own, so
+    logging never waits for the output.
+
+    :param config: The logging section of the config.
+    :type config: dict
+    :return: The listener writing the records, to be stopped on shutdown.
+    :rtype: logging.handlers.QueueListener
+    """
+    level = config.get("level", "INFO").upper()
+    if level == "TRACE":
+        level = TRACE
+    elif not isinstance(logging.getLevelName(level), int):
+        raise ValueError("Unknown log level: %s" % level)
+
+    if config.get("file"):
+        handler = logging.FileHandler(config["file"])
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    records = queue.Queue()
+    listener = logging.handlers.QueueListener(records, handler)
+
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+
+    listener.start()
+    return listener
@@ -0,0 +1,124 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import mmap
+import os
+import struct
+
+from classicserver.world import World
+
+# The file holds the uncompressed blocks followed by a trailer, so the blocks can be mapped starting at offset 0. The
+# trailer holds the dimensions and the sequence number of the last journal record the blocks were flushed with.
+MAPPED_MAGIC = b"CSWM"
+TRAILER = struct.Struct("!HHHQ4s")
+
+
+def _read_trailer(map_file):
+    size = os.fstat(map_file.fileno()).st_size
+    if size < TRAILER.size:
+        return None
+
+    map_file.seek(size - TRAILER.size)
+    width, height, depth, sequence, magic = TRAILER.unpack(map_file.read(TRAILER.size))
+    if magic != MAPPED_MAGIC or size != width * height * depth + TRAILER.size:
+        return None
+
+    return width, height, depth, sequence
+
+
+def is_mapped(path):
+    """
+    Checks whether a file is a world file which can be mapped.
+
+    :rtype: bool
+    """
+    try:
+        with open(path, "rb") as map_file:
+            return _read_trailer(map_file) is not None
+    except FileNotFoundError:
+        return False
+
+
+def read_sequence(path):
+    """
+    Reads the sequence number of the last journal record a map file covers.
+
+    :rtype: int
+    """
+    with open(path, "rb") as map_file:
+        trailer = _read_trailer(map_file)
+        if not trailer:
+            raise ValueError("Not a map file: %s" % path)
+
+    return trailer[3]
+
+
+def write_sequence(path, sequence):
+    """
+    Records that a map file covers the journal up to a sequence number, to be called once the blocks have been flushed.
+
+    :type sequence: int
+    """
+    with open(path, "r+b") as map_file:
+        trailer = _read_trailer(map_file)
+        if not trailer:
+            raise ValueError("Not a map file: %s" % path)
+
+        map_file.seek(-TRAILER.size, os.SEEK_END)
+        map_file.write(TRAILER.pack(trailer[0], trailer[1], trailer[2], sequence, MAPPED_MAGIC))
+        map_file.flush()
+        os.fsync(map_file.fileno())
+
+
+def write_mapped(path, world, sequence=0):
+    """
+    Writes a world to a new map file, which atomically replaces the file at the path.
+
+    :type world: World
+    :param sequence: The sequence number of the last journal record the world covers.
+    :type sequence: int
+    """
+    temp_path = path + ".tmp"
+
+    with open(temp_path, "wb") as map_file:
+        map_file.write(world.blocks)
+        map_file.write(TRAILER.pack(world.width, world.height, world.depth, sequence, MAPPED_MAGIC))
+        map_file.flush()
+        os.fsync(map_file.fileno())
+
+    os.replace(temp_path, path)
+
+
+def open_mapped(path):
+    """
+    Opens a world whose blocks are a writable mapping of a map file, so changes to the world go to the file through
+    the page cache. Use World.close() to release it.
+
+    :return: The mapped world.
+    :rtype: World
+    """
+    with open(path, "r+b") as map_file:
+        dimensions = _read_trailer(map_file)
+        if not dimensions:
+            raise ValueError("Not a map file: %s" % path)
+
+        width, height, depth, _ = dimensions
+        # The mapping stays valid after the file is closed
+        blocks = mmap.mmap(map_file.fileno(), width * height * depth)
+
+    return World(blocks, width, height, depth)
@@ -0,0 +1,306 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import http.server
+import logging
+import threading
+
+from classicserver.packet.packet import SERVER_TO_CLIENT
+
+# The upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = ['%s="%s"' % (name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+    A named metric, with one value per combination of label values.
+    """
+
+    TYPE = None
+
+    name = ""
+    description = ""
+    labels = ()
+
+    _values = None
+    _lock = None
+
+    def __init__(self, name, description, labels=()):
+        """
+        Creates a metric
+
+        :param name: The name of the metric.
+        :type name: str
+        :param description: The help text of the metric.
+        :type description: str
+        :param labels: The names of the labels.
+        :type labels: tuple
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def remove(self, labels):
+        with self._lock:
+            self._values.pop(tuple(labels), None)
+
+    def render(self):
+        """
+        Renders the metric in the Prometheus text format.
+
+        :rtype: list
+        :return: The lines.
+        """
+        lines = ["# HELP %s %s" % (self.name, self.description), "# TYPE %s %s" % (self.name, self.TYPE)]
+        with self._lock:
+            values = list(self._values.items())
+
+        for label_values, value in sorted(values):
+            lines.extend(self._render_value(label_values, value))
+
+        return lines
+
+    def _render_value(self, label_values, value):
+        return ["%s%s %s" % (self.name, _format_labels(self.labels, label_values), _format_value(value))]
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    buckets = DEFAULT_BUCKETS
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # The count of every bucket, then the sum and the count of all observations
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _render_value(self, label_values, counts):
+        lines = []
+        for bound, count in zip(self.buckets + (float("inf"),), counts[:-2] + counts[-1:]):
+            lines.append("%s_bucket%s %d" % (self.name, _format_labels(self.labels, label_values,
+                                                                        'le="%s"' % _format_value(bound)), count))
+
+        lines.append("%s_sum%s %s" % (self.name, _format_labels(self.labels, label_values), _format_value(counts[-2])))
+        lines.append("%s_count%s %d" % (self.name, _format_labels(self.labels, label_values), counts[-1]))
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    Holds the metrics of the server. The metrics are only updated once the registry has been enabled, so the checks
+    of the enabled flag are all the instrumentation costs otherwise.
+    """
+
+    enabled = False
+
+    _metrics = None
+    _collectors = None
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self._register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Adds a function which is called on every scrape, to report values which are cheaper to read when they're
+        needed than to keep up to date.
+
+        :param collector: A function returning a list of metrics.
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text format.
+
+        :rtype: str
+        """
+        metrics = list(self._metrics)
+        for collector in self._collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as ex:
+                logging.error("Collecting metrics failed: %s" % repr(ex))
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the log otherwise
+        pass
+
+
+class MetricsServer(object):
+    """
+    Serves the metrics over HTTP at /metrics on a thread of its own.
+    """
+
+    _http_server = None
+    _thread = None
+
+    def __init__(self, registry, address, port):
+        """
+        Starts a metrics server
+
+        :type registry: MetricsRegistry
+        :param address: The address to listen on, keep it local unless the metrics are meant to be public.
+        :type address: str
+        :type port: int
+        """
+        self._http_server = http.server.HTTPServer((address, port), _MetricsRequestHandler)
+        self._http_server.registry = registry
+        self._thread = threading.Thread(target=self._http_server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get_port(self):
+        return self._http_server.server_address[1]
+
+    def stop(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+
+
+# The registry of the whole process
+METRICS = MetricsRegistry()
+
+PACKETS_RECEIVED = METRICS.counter("classic_packets_received_total", "Packets received from clients, by type.",
+                                   ("type",))
+PACKETS_SENT = METRICS.counter("classic_packets_sent_total", "Packets sent to clients, by type.", ("type",))
+BYTES_RECEIVED = METRICS.counter("classic_received_bytes_total", "Bytes received from clients.")
+BYTES_SENT = METRICS.counter("classic_sent_bytes_total", "Bytes queued to be sent to clients.")
+TICK_SECONDS = METRICS.histogram("classic_tick_seconds", "Duration of the game ticks.")
+BROADCAST_SECONDS = METRICS.histogram("classic_broadcast_flush_seconds",
+                                      "Duration of encoding and fanning out the broadcasts of a tick.")
+FLUSH_LOOP_SECONDS = METRICS.histogram("classic_flush_loop_seconds",
+                                       "Duration of a pass of the threaded mode's flush loop over every connection.")
+LEVEL_SEND_SECONDS = METRICS.histogram("classic_level_send_seconds",
+                                       "Time from a player joining a world until the whole level has been queued.",
+                                       buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+SAVE_SECONDS = METRICS.histogram("classic_save_seconds", "Duration of the world saves.", ("file",))
+SAVE_SIZE = METRICS.gauge("classic_save_size_bytes", "Bytes written by the last save.", ("file",))
+BLOCK_CHANGES_RECEIVED = METRICS.counter("classic_block_changes_received_total", "Block changes queued by players.")
+BLOCK_CHANGES_APPLIED = METRICS.counter("classic_block_changes_applied_total",
+                                        "Block changes applied, after merging the changes of a block within a tick.")
+RATE_LIMITED = METRICS.counter("classic_rate_limited_total", "Packets dropped for going over the rate limits.",
+                               ("limit",))
+INBOUND_WAIT_SECONDS = METRICS.histogram("classic_inbound_wait_seconds",
+                                         "Time the oldest packet or connection event waited for its tick.")
+LOCK_WAIT_SECONDS = METRICS.histogram("classic_lock_wait_seconds", "Time the tick spent waiting for locks.", ("lock",))
+
+_SENT_PACKETS = dict((packet_id, (packet.__name__, packet.SIZE)) for packet_id, packet in SERVER_TO_CLIENT.items())
+# The data counted last with its packet counts, as a broadcast sends the same buffer to every player in a row
+_last_counted = (None, None)
+
+
+def count_sent_packets(data):
+    """
+    Counts the packets in a buffer sent to a client by their type.
+
+    :param data: Whole encoded packets.
+    :type data: bytes
+    """
+    global _last_counted
+
+    last_data, counts = _last_counted
+    if data is not last_data:
+        counts = {}
+        offset = 0
+        while offset < len(data):
+            if data[offset] not in _SENT_PACKETS:
+                break
+            name, size = _SENT_PACKETS[data[offset]]
+            counts[name] = counts.get(name, 0) + 1
+            offset += size
+        _last_counted = (data, counts)
+
+    for name, count in counts.items():
+        PACKETS_SENT.inc((name,), count)
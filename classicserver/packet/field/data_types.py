@@ -14,23 +14,14 @@ class ShortField(BaseField):
 
 
 class StringField(BaseField):
-    def decode(self, buf):
-        return buf.read(64).decode("ascii").rstrip()
+    STRUCTURE = "!64s"
 
-    def encode(self, buf, val):
-        raw = val.encode("ascii")
-        raw = raw[:64]  # Trim
-        pad = 64 - len(val)
-        raw += (pad * b" ")
-        buf.write(raw)
+    def prepare(self, val):
+        return val.encode("ascii")[:64].ljust(64, b" ")
+
+    def convert(self, raw):
+        return raw.decode("ascii").rstrip()
 
 
 class ByteArrayField(BaseField):
-    def decode(self, buf):
-        return buf.read(1024)
-
-    def encode(self, buf, val):
-        val = val[:1024]
-        pad = 1024 - len(val)
-        val += (b"\0" * pad)
-        buf.write(val)
+    STRUCTURE = "!1024s"
@@ -10,10 +10,28 @@ class BaseField(object):
         self.name = name
 
     def encode(self, buf, val):
-        buf.write(struct.pack(self.STRUCTURE, val))
+        buf.write(struct.pack(self.STRUCTURE, self.prepare(val)))
 
     def decode(self, buf):
-        return struct.unpack(self.STRUCTURE, buf.read(struct.calcsize(self.STRUCTURE)))[0]
+        return self.convert(struct.unpack(self.STRUCTURE, buf.read(struct.calcsize(self.STRUCTURE)))[0])
+
+    def prepare(self, val):
+        """
+        Converts a field value to the object packed by the field's structure.
+        """
+        return val
+
+    def convert(self, raw):
+        """
+        Converts an object unpacked by the field's structure to the field value.
+        """
+        return raw
+
+    def is_converted(self):
+        return type(self).prepare is not BaseField.prepare or type(self).convert is not BaseField.convert
+
+    def size(self):
+        return struct.calcsize(self.STRUCTURE)
 
     def get_name(self):
         return self.name
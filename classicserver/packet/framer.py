@@ -0,0 +1,104 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from classicserver.packet.packet import CLIENT_TO_SERVER
+
+
+class FramingError(IOError):
+    pass
+
+
+class PacketFramer(object):
+    """
+    Splits a stream of received bytes into complete packets.
+
+    All Classic packets have a fixed size determined by their ID, so the framer only has to look at the first byte to
+    know whether a whole packet has been received. Incomplete tails stay in the receive buffer until the rest of the
+    packet arrives with a later read.
+    """
+
+    # Compact the receive buffer once this many consumed bytes have piled up in front of it
+    COMPACT_THRESHOLD = 4096
+
+    _buf = None
+    _offset = None
+    _sizes = None
+
+    def __init__(self, packets=None):
+        """
+        Creates a packet framer
+
+        :param packets: The packet set to frame, defaults to the packets sent by the client.
+        :type packets: dict
+        """
+        self._buf = bytearray()
+        self._offset = 0
+        self._sizes = dict((packet_id, packet.size()) for packet_id, packet in
+                           (packets if packets else CLIENT_TO_SERVER).items())
+
+    def feed(self, data):
+        """
+        Appends received data to the receive buffer.
+
+        :param data: The received bytes, any bytes-like object.
+        :type data: bytes
+        """
+        self._buf += data
+
+    def frames(self):
+        """
+        Yields every complete packet in the receive buffer, leaving a partial packet for the next read.
+
+        :return: A generator of complete encoded packets.
+        :rtype: generator
+        """
+        buf = self._buf
+        view = memoryview(buf)
+
+        try:
+            while len(buf) - self._offset > 0:
+                packet_id = buf[self._offset]
+                if packet_id not in self._sizes:
+                    raise FramingError("Unknown packet ID: 0x%02x" % packet_id)
+
+                end = self._offset + self._sizes[packet_id]
+                if end > len(buf):
+                    break
+
+                frame = bytes(view[self._offset:end])
+                self._offset = end
+                yield frame
+        finally:
+            view.release()
+            self._compact()
+
+    def pending(self):
+        """
+        Gets the amount of buffered bytes which haven't formed a complete packet yet.
+
+        :rtype: int
+        """
+        return len(self._buf) - self._offset
+
+    def _compact(self):
+        if self._offset == len(self._buf):
+            del self._buf[:]
+            self._offset = 0
+        elif self._offset >= self.COMPACT_THRESHOLD:
+            del self._buf[:self._offset]
+            self._offset = 0
@@ -16,11 +16,28 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from classicserver.packet.buffer import WriteBuffer
+import operator
+import struct
+
 from classicserver.packet.field.data_types import ByteField, StringField, ShortField, SignedByteField, ByteArrayField
 
 
-class Packet(object):
+class PacketMeta(type):
+    """
+    Compiles the field list of every packet class into a single precompiled structure, so a packet is packed or
+    unpacked with one call instead of one struct call per field.
+    """
+    def __init__(cls, name, bases, namespace):
+        super(PacketMeta, cls).__init__(name, bases, namespace)
+
+        cls.STRUCT = struct.Struct(ByteField.STRUCTURE + "".join(field.STRUCTURE.lstrip("!") for field in cls.FIELDS))
+        cls.SIZE = cls.STRUCT.size
+        cls.NAMES = tuple(field.get_name() for field in cls.FIELDS)
+        cls.CONVERTED_FIELDS = tuple((index, field) for index, field in enumerate(cls.FIELDS) if field.is_converted())
+        cls.GETTER = operator.itemgetter(*cls.NAMES) if len(cls.NAMES) > 1 else None
+
+
+class Packet(object, metaclass=PacketMeta):
     ID = -1
 
     FIELDS = []
@@ -34,9 +51,7 @@ class Packet(object):
         :param values: Field values for encoding
         :type values: dict
         """
-        ByteField().encode(buf, self.ID)
-        for field in self.FIELDS:
-            field.encode(buf, values[field.get_name()])
+        buf.write(self.make(values))
 
     def decode(self, buf):
         """
@@ -46,12 +61,45 @@ class Packet(object):
         :return: The decoded field values
         :rtype: dict
         """
-        if (ByteField().decode(buf) != self.ID) and not (self.ID == -1):
+        return self.unpack(buf.read(self.SIZE))
+
+    @classmethod
+    def size(cls):
+        """
+        Calculates the size of the encoded packet, including the ID byte.
+        :return: The packet size in bytes.
+        :rtype: int
+        """
+        return cls.SIZE
+
+    @classmethod
+    def _arguments(cls, values):
+        if cls.GETTER and not cls.CONVERTED_FIELDS:
+            return cls.GETTER(values)
+
+        args = [values[name] for name in cls.NAMES]
+        for index, field in cls.CONVERTED_FIELDS:
+            args[index] = field.prepare(args[index])
+        return args
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        """
+        Decodes the packet from a bytes-like object.
+        :param data: The bytes-like object containing the packet.
+        :type data: bytes
+        :param offset: The offset of the packet in the data.
+        :type offset: int
+        :return: The decoded field values
+        :rtype: dict
+        """
+        raw = cls.STRUCT.unpack_from(data, offset)
+        if (raw[0] != cls.ID) and not (cls.ID == -1):
             raise ValueError("Invalid packet ID")
 
-        values = {}
-        for field in self.FIELDS:
-            values[field.get_name()] = field.decode(buf)
+        values = dict(zip(cls.NAMES, raw[1:]))
+        for index, field in cls.CONVERTED_FIELDS:
+            values[cls.NAMES[index]] = field.convert(raw[index + 1])
 
         return values
 
@@ -71,7 +119,7 @@ class Packet(object):
 
         if packet_id in packets:
             packet = packets[packet_id]
-            fields = packet().decode(buf)
+            fields = packet.unpack(buf.read(packet.SIZE))
             return packet, fields
         else:
             raise ValueError("Invalid packet ID")
@@ -89,9 +137,27 @@ class Packet(object):
         if not values:
             values = {}
 
-        buf = WriteBuffer()
-        cls().encode(buf, values)
-        return buf.get_buffer()
+        return cls.STRUCT.pack(cls.ID, *cls._arguments(values))
+
+    @classmethod
+    def pack_into(cls, buf, offset, values=None):
+        """
+        Encodes the packet directly into a writable buffer.
+        :param buf: The writable buffer, e.g. a bytearray, to encode the packet into.
+        :type buf: bytearray
+        :param offset: The offset in the buffer to encode the packet at.
+        :type offset: int
+        :param values: The field values to use.
+        :type values: dict
+        :return: The offset right after the encoded packet.
+        :rtype: int
+        """
+
+        if not values:
+            values = {}
+
+        cls.STRUCT.pack_into(buf, offset, cls.ID, *cls._arguments(values))
+        return offset + cls.SIZE
 
 
 class PlayerIdentificationPacket(Packet):
@@ -150,6 +216,23 @@ class SpawnPlayerPacket(Packet):
               ByteField("yaw"), ByteField("pitch")]
 
 
+class PositionAndOrientationUpdatePacket(Packet):
+    ID = 0x09
+    FIELDS = [SignedByteField("player_id"), SignedByteField("delta_x"), SignedByteField("delta_y"),
+              SignedByteField("delta_z"), ByteField("yaw"), ByteField("pitch")]
+
+
+class PositionUpdatePacket(Packet):
+    ID = 0x0a
+    FIELDS = [SignedByteField("player_id"), SignedByteField("delta_x"), SignedByteField("delta_y"),
+              SignedByteField("delta_z")]
+
+
+class OrientationUpdatePacket(Packet):
+    ID = 0x0b
+    FIELDS = [SignedByteField("player_id"), ByteField("yaw"), ByteField("pitch")]
+
+
 class DespawnPlayerPacket(Packet):
     ID = 0x0c
     FIELDS = [ByteField("player_id")]
@@ -179,7 +262,10 @@ SERVER_TO_CLIENT = {
     0x04: LevelFinalizePacket,
     0x06: BlockUpdatePacket,
     0x07: SpawnPlayerPacket,
-
+    0x08: PositionAndOrientationPacket,
+    0x09: PositionAndOrientationUpdatePacket,
+    0x0a: PositionUpdatePacket,
+    0x0b: OrientationUpdatePacket,
     0x0c: DespawnPlayerPacket,
     0x0d: MessagePacket,
     0x0e: DisconnectPlayerPacket,
@@ -20,10 +20,13 @@ import hashlib
 import logging
 import traceback
 from classicserver.command_handler import CommandHandler
+from classicserver.log import is_tracing, TRACE
+from classicserver.metrics import METRICS, PACKETS_RECEIVED
 
 from classicserver.packet.buffer import ReadBuffer
 from classicserver.packet.packet import *
 from classicserver.world import *
+from classicserver.world_manager import MAIN_WORLD
 
 
 class PacketHandler(object):
@@ -36,8 +39,117 @@ class PacketHandler(object):
         """
         self._server = server
 
-    def handle_packet(self, connection, data):
+    @staticmethod
+    def encode_movement(player):
+        """
+        Encodes the smallest packet which brings the other players up to date with the position and orientation of a
+        player, relative to the last state sent.
+
+        :type player: Player
+        :return: The encoded packet, empty if nothing has changed.
+        :rtype: bytes
+        """
+        position = [int(coordinate * 32) for coordinate in player.coordinates]
+        orientation = (player.yaw, player.pitch)
+
+        last_position, last_orientation = player.sent_position, player.sent_orientation
+        player.sent_position, player.sent_orientation = position, orientation
+
+        if last_position is None:
+            deltas = None
+        else:
+            deltas = [position[i] - last_position[i] for i in range(3)]
+            if min(deltas) < -128 or max(deltas) > 127:
+                deltas = None
+
+        if deltas is None:
+            return PositionAndOrientationPacket.make({
+                "player_id": player.player_id,
+                "frac_x": position[0],
+                "frac_y": position[1],
+                "frac_z": position[2],
+                "yaw": orientation[0],
+                "pitch": orientation[1]
+            })
+
+        turned = orientation != last_orientation
+
+        if not any(deltas):
+            if not turned:
+                return b""
+
+            return OrientationUpdatePacket.make({
+                "player_id": player.player_id,
+                "yaw": orientation[0],
+                "pitch": orientation[1]
+            })
+
+        if not turned:
+            return PositionUpdatePacket.make({
+                "player_id": player.player_id,
+                "delta_x": deltas[0],
+                "delta_y": deltas[1],
+                "delta_z": deltas[2]
+            })
+
+        return PositionAndOrientationUpdatePacket.make({
+            "player_id": player.player_id,
+            "delta_x": deltas[0],
+            "delta_y": deltas[1],
+            "delta_z": deltas[2],
+            "yaw": orientation[0],
+            "pitch": orientation[1]
+        })
+
+    @staticmethod
+    def encode_position(player):
+        """
+        Encodes the absolute position and orientation of a player as last sent to the other players.
+
+        :type player: Player
+        :return: The encoded packet.
+        :rtype: bytes
+        """
+        position, orientation = player.get_sent_state()
+        return PositionAndOrientationPacket.make({
+            "player_id": player.player_id,
+            "frac_x": position[0],
+            "frac_y": position[1],
+            "frac_z": position[2],
+            "yaw": orientation[0],
+            "pitch": orientation[1]
+        })
+
+    def _rate_limited(self, connection, packet, fields):
+        # Movement over the limit is dropped, the next update brings the player up to date again. Blocks over the limit
+        # are reverted on the client which placed them, and chat gets a notice.
+        if packet == SetBlockPacket:
+            player = self._server.get_player_by_address(connection.get_address())
+            world = self._server.get_world(player.world) if player is not None else None
+            x, y, z = fields["x"], fields["y"], fields["z"]
+            if world is not None and world.contains(x, y, z):
+                connection.send(BlockUpdatePacket.make({
+                    "x": x,
+                    "y": y,
+                    "z": z,
+                    "block_type": world.get_block(x, y, z)
+                }))
+        elif packet == MessagePacket:
+            connection.send(MessagePacket.make({"player_id": 0, "message": "&4You are sending messages too fast."}))
+
+    @staticmethod
+    def decode(connection, data):
+        """
+        Decodes a frame received from a connection, on the networking side so the tick only gets the decoded packets.
+
+        :type connection: BaseConnection
+        :param data: The frame, holding whole packets.
+        :type data: bytes
+        :return: The (packet class, fields) tuples of the packets, up to the first one which can't be decoded.
+        :rtype: list
+        """
         buf = ReadBuffer(data)
+        packets = []
 
         while buf.left() > 0:
             try:
@@ -47,6 +159,37 @@ class PacketHandler(object):
                 logging.debug(traceback.format_exc())
                 break
 
+            if METRICS.enabled:
+                PACKETS_RECEIVED.inc((packet.__name__,))
+
+            if is_tracing():
+                logging.log(TRACE, "%s from %s: %s" % (packet.__name__, repr(connection.get_address()), repr(fields)))
+
+            packets.append((packet, fields))
+
+        return packets
+
+    def handle_packets(self, connection, packets):
+        """
+        Handles the packets decoded by decode(), on the tick.
+
+        :type connection: BaseConnection
+        :param packets: The (packet class, fields) tuples.
+        :type packets: list
+        """
+        for packet, fields in packets:
+            if not connection.limits.allow(packet):
+                self._rate_limited(connection, packet, fields)
+                continue
+
+            if packet != PlayerIdentificationPacket:
+                # Only the identification is handled before the connection has joined as a player
+                player = self._server.get_player_by_address(connection.get_address())
+                if player is None:
+                    logging.debug("Dropping %s from %s, which hasn't identified" % (packet.__name__,
+                                                                                   repr(connection.get_address())))
+                    continue
+
             if packet == PlayerIdentificationPacket:
                 if fields["key"] == hashlib.md5((self._server.get_salt() + fields["username"]).encode("utf-8"))\
                         .hexdigest():
@@ -61,68 +204,18 @@ class PacketHandler(object):
                         connection.send(DisconnectPlayerPacket.make({"reason":
                                         "Another player with the same name is already on this server"}))
 
-                sendbuf = ServerIdentificationPacket.make({
+                connection.send(ServerIdentificationPacket.make({
                     "protocol_version": 7,
                     "server_name": self._server.get_name(),
                     "server_motd": self._server.get_motd(),
                     "user_type": 0x64 if self._server.is_op(fields["username"]) else 0x00
-                })
-
-                chunk = self._server.get_world().encode()
-                parts = [chunk[i: i + 1024] for i in range(0, len(chunk), 1024)]
-
-                sendbuf += LevelInitializePacket.make()
-
-                for count, part in enumerate(parts):
-                    sendbuf += LevelDataChunkPacket.make({
-                        "chunk_length": len(part),
-                        "chunk": part,
-                        "percent": int((100 / len(parts)) * count)
-                    })
-
-                sendbuf += LevelFinalizePacket.make({
-                    "x": WORLD_WIDTH,
-                    "y": WORLD_HEIGHT,
-                    "z": WORLD_DEPTH
-                })
-
-                connection.send(sendbuf)
+                }))
 
                 username = fields["username"]
                 player_id = self._server.add_player(connection, None, username)
                 logging.info("Player %s has joined with ID=%d!" % (username, player_id))
                 player = self._server.get_player(player_id)
-
-                for server_player in self._server.get_players().values():
-                    if server_player.player_id != player_id:
-                        connection.send(SpawnPlayerPacket.make({
-                            "player_id": server_player.player_id,
-                            "username": server_player.name,
-                            "x": int(server_player.coordinates[0]),
-                            "y": int(server_player.coordinates[1]),
-                            "z": int(server_player.coordinates[2]),
-                            "yaw": server_player.yaw,
-                            "pitch": server_player.pitch
-                        }))
-
-                connection.send(PositionAndOrientationPacket.make({
-                    "player_id": -1,
-                    "frac_x": int(player.coordinates[0] * 32),
-                    "frac_y": int(player.coordinates[1] * 32),
-                    "frac_z": int(player.coordinates[2] * 32),
-                    "yaw": 0,
-                    "pitch": 0
-                }))
-
-                self._server.broadcast(SpawnPlayerPacket.make({
-                    "player_id": player.player_id,
-                    "username": player.name,
-                    "x": int(player.coordinates[0]),
-                    "y": int(player.coordinates[1]),
-                    "z": int(player.coordinates[2]),
-                    "yaw": 0,
-                    "pitch": 0
-                }), [connection.get_address()])
+                self._server.join_world(player, MAIN_WORLD)
 
                 self._server.broadcast(MessagePacket.make({
                     "player_id": player_id,
@@ -130,7 +223,6 @@ class PacketHandler(object):
                 }))
 
             elif packet == PositionAndOrientationPacket:
-                player = self._server.get_player_by_address(connection.get_address())
                 player.coordinates = [float(fields["frac_x"] / 32.0),
                                       float(fields["frac_y"] / 32.0),
                                       float(fields["frac_z"] / 32.0)]
@@ -138,31 +230,23 @@ class PacketHandler(object):
                 player.yaw = fields["yaw"]
                 player.pitch = fields["pitch"]
 
-                fields["player_id"] = player.player_id
-
-                self._server.broadcast(PositionAndOrientationPacket.make(fields))
+                self._server.broadcast_movement(player)
 
             elif packet == SetBlockPacket:
                 x, y, z = fields["x"], fields["y"], fields["z"]
                 mode = fields["mode"]
                 block_type = fields["block_type"]
 
+                level = self._server.get_level(player.world)
+
                 # Sanity check
-                if x in range(WORLD_WIDTH) and y in range(WORLD_HEIGHT) and z in range(WORLD_DEPTH):
+                if level.world.contains(x, y, z):
                     if mode == 0:
                         block_type = 0
 
-                    self._server.broadcast(BlockUpdatePacket.make({
-                        "x": x,
-                        "y": y,
-                        "z": z,
-                        "block_type": block_type
-                    }))
-
-                    self._server.get_world().set_block(x, y, z, block_type)
+                    self._server.queue_block(player, x, y, z, block_type)
 
             elif packet == MessagePacket:
-                player = self._server.get_player_by_address(connection.get_address())
                 message = fields["message"]
 
                 if not message.startswith("/"):
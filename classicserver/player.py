@@ -28,6 +28,22 @@ class Player(object):
     connection = None
     user_type = None
 
+    # The name of the world the player is in
+    world = None
+    # The name of the world being loaded for the player to join, if any
+    joining = None
+
+    # The box copied with /copy, as returned by World.copy()
+    clipboard = None
+
+    # The position (in 1/32 block units) and orientation last sent to the other players, and the tick it was sent in
+    sent_position = None
+    sent_orientation = None
+    sent_tick = 0
+
+    # The tick of the last update received from every other player, by player ID
+    synced = None
+
     def __init__(self, player_id, connection, coordinates, name, user_type):
         self.player_id = player_id
         self.connection = connection
@@ -35,3 +51,16 @@ class Player(object):
             self.coordinates = coordinates
         self.name = name
         self.user_type = user_type
+        self.synced = {}
+
+    def get_sent_state(self):
+        """
+        Gets the position and orientation of the player as the other players know it.
+
+        :return: The position in 1/32 block units and the orientation.
+        :rtype: tuple
+        """
+        if self.sent_position is None:
+            return [int(coordinate * 32) for coordinate in self.coordinates], (self.yaw, self.pitch)
+
+        return self.sent_position, self.sent_orientation
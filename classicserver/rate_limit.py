@@ -0,0 +1,154 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+from classicserver.metrics import METRICS, RATE_LIMITED
+from classicserver.packet.packet import PositionAndOrientationPacket, SetBlockPacket, MessagePacket
+
+# The rate (per second) and burst of every limit, unless the config says otherwise
+DEFAULT_LIMITS = {
+    "packets_per_second": 200,
+    "packets_burst": 400,
+    "moves_per_second": 40,
+    "moves_burst": 60,
+    "blocks_per_second": 20,
+    "blocks_burst": 60,
+    "messages_per_second": 2,
+    "messages_burst": 5
+}
+
+# The limited packet types, by the name of their limit in the config
+LIMITED_PACKETS = (("moves", PositionAndOrientationPacket), ("blocks", SetBlockPacket), ("messages", MessagePacket))
+
+
+class TokenBucket(object):
+    """
+    Allows bursts of up to a number of events, refilled at a steady rate.
+    """
+
+    rate = 0
+    burst = 0
+
+    _tokens = 0
+    _updated = 0
+
+    def __init__(self, rate, burst):
+        """
+        Creates a full token bucket
+
+        :param rate: The tokens added per second.
+        :type rate: float
+        :param burst: The most tokens the bucket holds.
+        :type burst: float
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.time()
+
+    def take(self):
+        """
+        Takes a token if there is one.
+
+        :return: Whether a token was taken, i.e. whether the event is allowed.
+        :rtype: bool
+        """
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+        return True
+
+
+class RateLimits(object):
+    """
+    The rate limits of a connection: one bucket for all of its packets, which is checked by the networking to catch
+    floods before they're queued for the tick, and one bucket for each limited packet type, which are checked by the
+    tick. The packets over the limits are counted by limit.
+    """
+
+    # Whether the connection has gone over the packet limit
+    flooding = False
+
+    _packets = None
+    _buckets = None
+    _dropped = None
+
+    def __init__(self, config=None):
+        """
+        Creates the rate limits of a connection
+
+        :param config: The rate_limits section of the config, any limit not in it has its default.
+        :type config: dict
+        """
+        limits = dict(DEFAULT_LIMITS, **(config or {}))
+
+        self._packets = TokenBucket(limits["packets_per_second"], limits["packets_burst"])
+        self._buckets = dict((packet, (name, TokenBucket(limits[name + "_per_second"], limits[name + "_burst"])))
+                             for name, packet in LIMITED_PACKETS)
+        self._dropped = {}
+
+    def allow_packet(self):
+        """
+        Checks a received packet against the limit of all packets, only called by the networking.
+
+        :rtype: bool
+        """
+        if self._packets.take():
+            return True
+
+        self.flooding = True
+        self._count("packets")
+        return False
+
+    def allow(self, packet):
+        """
+        Checks a received packet against the limit of its type, only called by the tick.
+
+        :param packet: The packet class.
+        :return: Whether the packet is allowed, it's counted as dropped if it isn't.
+        :rtype: bool
+        """
+        if packet not in self._buckets:
+            return True
+
+        name, bucket = self._buckets[packet]
+        if bucket.take():
+            return True
+
+        self._count(name)
+        return False
+
+    def _count(self, name):
+        self._dropped[name] = self._dropped.get(name, 0) + 1
+        if METRICS.enabled:
+            RATE_LIMITED.inc((name,))
+
+    def get_dropped(self):
+        """
+        Gets the amount of packets dropped for going over the limits.
+
+        :return: The amounts by limit name, e.g. "blocks".
+        :rtype: dict
+        """
+        return dict(self._dropped)
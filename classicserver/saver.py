@@ -0,0 +1,332 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+import traceback
+
+from classicserver.mapped_file import is_mapped, open_mapped, read_sequence, write_mapped, write_sequence
+from classicserver.metrics import METRICS, SAVE_SECONDS, SAVE_SIZE
+from classicserver.section_file import SectionFile
+from classicserver.world import World, SECTION_SIZE
+
+
+class WorldSaver(object):
+    """
+    Saves snapshots of a world in the background.
+
+    The snapshot is a copy of the blocks taken by the caller, so the world can keep changing while the snapshot is
+    compressed and written on the saver's own thread. The save is written to a temporary file which replaces the save
+    file only once it's been synced to the disk, so a crash never leaves a truncated save behind.
+
+    In the sectioned format, only the sections changed since the last save are compressed and appended to the save
+    file. Saves in the older gzip formats are converted by writing the whole world in the sectioned format once.
+
+    In the mapped format, the blocks of the world are mapped from the save file, so saving only has to make sure the
+    changes have been written back to the file. As changes may reach the file before that, the file records the last
+    journal record it covers, and only the later records are replayed over it.
+
+    With a block journal, the journal is rotated right before each snapshot and the rotated part is deleted once the
+    save is complete.
+
+    A save requested while another one is in progress follows it, taking its snapshot once the first save is complete,
+    so the changes made in the meantime are never left unsaved. Saves requested until then share that follow-up. The
+    snapshot is taken by the thread which owns the world, the follow-up is handed to it with the schedule function.
+    """
+
+    _path = None
+    _format = None
+    _section_file = None
+    _journal = None
+    _executor = None
+    _pending = None
+    # The future of the save following the one in progress, and the world it saves
+    _follow_up = None
+    _follow_up_world = None
+    _schedule = None
+    _lock = None
+
+    # Statistics of the last completed save
+    last_duration = 0
+    last_size = 0
+    last_time = 0
+
+    FORMATS = ("gzip", "sectioned", "mapped")
+
+    def __init__(self, path, save_format="gzip", journal=None, schedule=None):
+        """
+        Creates a world saver
+
+        :param path: The path of the save file.
+        :type path: str
+        :param save_format: The format to save in, one of FORMATS.
+        :type save_format: str
+        :param journal: The journal of the block changes made since the last save, if any.
+        :type journal: BlockJournal
+        :param schedule: A function taking a function to call on the thread which changes the world, e.g. the tick.
+                         Without it, a follow-up save is started on the saver's thread.
+        """
+        if save_format not in self.FORMATS:
+            raise ValueError("Unknown save format: %s" % save_format)
+
+        self._path = path
+        self._format = save_format
+        self._journal = journal
+        if save_format == "sectioned":
+            self._section_file = SectionFile(path)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._schedule = schedule
+        # Reentrant, as a save completing right away calls _save_done() from save()
+        self._lock = threading.RLock()
+
+    def save(self, world):
+        """
+        Takes a snapshot of the world and saves it in the background. If the previous save hasn't completed yet, the
+        save follows it instead.
+
+        :type world: World
+        :return: A future completing when the save has been written.
+        :rtype: concurrent.futures.Future
+        """
+        with self._lock:
+            if self._follow_up or (self._pending and not self._pending.done()):
+                if not self._follow_up:
+                    logging.debug("The previous save is still in progress, saving again once it's complete")
+                    self._follow_up = concurrent.futures.Future()
+                    self._follow_up_world = world
+                return self._follow_up
+
+            return self._start(world)
+
+    def _start(self, world):
+        # Has to be called with the lock held
+        sequence = self._journal.rotate() if self._journal else None
+
+        if self._format == "mapped":
+            self._pending = self._executor.submit(self._flush, world, sequence)
+        elif not self._section_file:
+            self._pending = self._executor.submit(self._write, world.snapshot())
+        elif self._section_file.needs_rewrite(world.width, world.height, world.depth, SECTION_SIZE,
+                                              world.get_section_count()):
+            world.take_dirty_sections()
+            self._pending = self._executor.submit(self._write_all_sections, world.snapshot())
+        else:
+            dirty = world.take_dirty_sections()
+            sections = dict((index, world.get_section(index)) for index in dirty)
+            self._pending = self._executor.submit(self._write_sections, world, sections)
+
+        self._pending.add_done_callback(self._save_done)
+        return self._pending
+
+    def _save_done(self, future):
+        with self._lock:
+            if future is not self._pending:
+                return
+
+            if not self._follow_up:
+                # The rotated journal is only covered once the latest save is complete
+                if self._journal and not future.cancelled() and future.exception() is None:
+                    self._journal.discard_rotated()
+                return
+
+        if self._schedule:
+            self._schedule(self._start_follow_up)
+        else:
+            self._start_follow_up()
+
+    def _start_follow_up(self):
+        with self._lock:
+            if not self._follow_up or not self._pending.done():
+                return
+
+            follow_up, self._follow_up = self._follow_up, None
+            world, self._follow_up_world = self._follow_up_world, None
+
+            try:
+                self._start(world).add_done_callback(lambda done: self._chain(done, follow_up))
+            except BaseException as ex:
+                logging.error("Saving the world failed: %s" % repr(ex))
+                logging.debug(traceback.format_exc())
+                follow_up.set_exception(ex)
+
+    @staticmethod
+    def _chain(source, target):
+        if source.exception() is None:
+            target.set_result(source.result())
+        else:
+            target.set_exception(source.exception())
+
+    def is_mapped(self):
+        """
+        Checks whether the save file is in the mapped format.
+
+        :rtype: bool
+        """
+        return is_mapped(self._path)
+
+    def get_saved_sequence(self):
+        """
+        Gets the sequence number of the last journal record the save file covers, which is only known for the mapped
+        format: its blocks are changed in place, so they may hold any of the records made since.
+
+        :return: The sequence number, 0 if the save file covers none of the records in the journal.
+        :rtype: int
+        """
+        return read_sequence(self._path) if self.is_mapped() else 0
+
+    def map_world(self, world=None):
+        """
+        Maps the world from the save file when saving in the mapped format.
+
+        :param world: A world loaded from another format or generated, which is converted to the save file first.
+        :type world: World
+        :return: The mapped world. When not saving in the mapped format, the given world or an in-memory copy of the
+                 mapped save file.
+        :rtype: World
+        """
+        if world is None:
+            world = open_mapped(self._path)
+            if self._format != "mapped":
+                mapped_world, world = world, World(bytearray(world.blocks), world.width, world.height, world.depth)
+                mapped_world.close()
+            return world
+
+        if self._format != "mapped":
+            return world
+
+        logging.info("Converting the world to the mapped format...")
+        write_mapped(self._path, world)
+        world.close()
+        return open_mapped(self._path)
+
+    def _flush(self, world, sequence):
+        start = time.time()
+
+        try:
+            world.flush()
+            # Only recorded once the blocks are on the disk, the records after it are replayed over them
+            if sequence is not None:
+                write_sequence(self._path, sequence)
+        except BaseException as ex:
+            logging.error("Saving the world failed: %s" % repr(ex))
+            logging.debug(traceback.format_exc())
+            raise
+
+        self._saved(start, len(world.blocks), "the mapped world")
+
+    def _write_all_sections(self, snapshot):
+        start = time.time()
+        world = World(bytearray(snapshot[3]), *snapshot[:3])
+
+        try:
+            size = self._section_file.write_all(world.width, world.height, world.depth, SECTION_SIZE,
+                                                [world.get_section(index) for index in
+                                                 range(world.get_section_count())])
+        except BaseException as ex:
+            logging.error("Saving the world failed: %s" % repr(ex))
+            logging.debug(traceback.format_exc())
+            raise
+
+        self._saved(start, size, "all %d sections" % world.get_section_count())
+
+    def _write_sections(self, world, sections):
+        start = time.time()
+        if not sections:
+            self._saved(start, 0, "no changed sections")
+            return
+
+        try:
+            size = self._section_file.write_sections(sections)
+        except BaseException as ex:
+            # The sections have to be saved with the next save instead
+            world.mark_dirty_sections(sections.keys())
+            logging.error("Saving the world failed: %s" % repr(ex))
+            logging.debug(traceback.format_exc())
+            raise
+
+        self._saved(start, size, "%d changed sections" % len(sections))
+
+    def _saved(self, start, size, what):
+        self.last_duration = time.time() - start
+        self.last_size = size
+        self.last_time = time.time()
+        logging.info("Saved %s in %.3f seconds, %d bytes" % (what, self.last_duration, self.last_size))
+
+        if METRICS.enabled:
+            labels = (os.path.basename(self._path),)
+            SAVE_SECONDS.observe(self.last_duration, labels)
+            SAVE_SIZE.set(self.last_size, labels)
+
+    def _write(self, snapshot):
+        start = time.time()
+        temp_path = self._path + ".tmp"
+
+        try:
+            with open(temp_path, "wb") as save_file:
+                save_file.write(World.encode_save(*snapshot))
+                save_file.flush()
+                os.fsync(save_file.fileno())
+
+            os.replace(temp_path, self._path)
+            self._sync_directory()
+        except BaseException as ex:
+            logging.error("Saving the world failed: %s" % repr(ex))
+            logging.debug(traceback.format_exc())
+            raise
+
+        self._saved(start, os.path.getsize(self._path), "the world")
+
+    def _sync_directory(self):
+        # Makes the rename durable, only possible where directories can be opened
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+
+        fd = os.open(os.path.dirname(os.path.abspath(self._path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def save_and_wait(self, world):
+        """
+        Saves the world and waits for the save, once the thread which changes the world has stopped, e.g. on shutdown.
+
+        :type world: World
+        """
+        self._finish_follow_ups()
+        self.save(world).result()
+
+    def _finish_follow_ups(self):
+        # Starts the follow-up saves right away instead of handing them over, for when the world doesn't change anymore,
+        # and waits for the last save
+        while True:
+            with self._lock:
+                pending, follow_up = self._pending, self._follow_up
+            if pending:
+                concurrent.futures.wait([pending])
+            if not follow_up:
+                return
+            self._start_follow_up()
+
+    def shutdown(self):
+        # Called once the world has been taken out of its level or couldn't be loaded, so nothing changes it anymore
+        self._finish_follow_ups()
+        self._executor.shutdown(wait=True)
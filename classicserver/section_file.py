@@ -0,0 +1,177 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import struct
+import zlib
+
+# The file starts with the header, which points to the index of the compressed sections. Changed sections and a new
+# index are appended to the end of the file before the header is rewritten to point to them, so the file is
+# consistent at any point in time and only the changed sections are ever written.
+SECTION_MAGIC = b"CSWS"
+HEADER = struct.Struct("!4sHHHBQI")
+INDEX_ENTRY = struct.Struct("!QI")
+
+
+def read_sections(data):
+    """
+    Decodes the sections of a sectioned save.
+
+    :param data: The contents of the save file.
+    :type data: bytes
+    :return: The world width, height, depth, section size and the list of uncompressed sections.
+    :rtype: tuple
+    """
+    magic, width, height, depth, section_size, index_offset, count = HEADER.unpack_from(data)
+    if magic != SECTION_MAGIC:
+        raise ValueError("Not a sectioned save")
+
+    sections = []
+    for i in range(count):
+        offset, length = INDEX_ENTRY.unpack_from(data, index_offset + i * INDEX_ENTRY.size)
+        sections.append(zlib.decompress(data[offset:offset + length]))
+
+    return width, height, depth, section_size, sections
+
+
+class SectionFile(object):
+    """
+    A save file made of individually compressed world sections, which can be updated in place.
+    """
+
+    # The file is rewritten from scratch once it's more than this many times larger than its live data
+    MAX_GARBAGE_RATIO = 2
+    COMPRESSION_LEVEL = 6
+
+    _path = None
+    _header = None
+    _index = None
+    _file_size = 0
+
+    def __init__(self, path):
+        """
+        Creates a section file
+
+        :param path: The path of the save file.
+        :type path: str
+        """
+        self._path = path
+        self._load()
+
+    def _load(self):
+        # Reads the header and the index of an existing sectioned save, anything else has to be rewritten
+        self._header = None
+        self._index = None
+
+        try:
+            with open(self._path, "rb") as save_file:
+                header = save_file.read(HEADER.size)
+                if len(header) < HEADER.size or header[:len(SECTION_MAGIC)] != SECTION_MAGIC:
+                    return
+
+                header = HEADER.unpack(header)
+                save_file.seek(header[5])
+                index = save_file.read(header[6] * INDEX_ENTRY.size)
+                self._file_size = os.fstat(save_file.fileno()).st_size
+        except FileNotFoundError:
+            return
+
+        self._header = header
+        self._index = [INDEX_ENTRY.unpack_from(index, i * INDEX_ENTRY.size) for i in range(header[6])]
+
+    def needs_rewrite(self, width, height, depth, section_size, count):
+        """
+        Checks whether the file has to be written from scratch, because it doesn't exist, is in another format, holds
+        a world of another size or has too much garbage in it.
+
+        :rtype: bool
+        """
+        if self._header is None or self._header[1:5] != (width, height, depth, section_size) or \
+                len(self._index) != count:
+            return True
+
+        live = HEADER.size + len(self._index) * INDEX_ENTRY.size + sum(length for _, length in self._index)
+        return self._file_size > live * self.MAX_GARBAGE_RATIO
+
+    def write_all(self, width, height, depth, section_size, sections):
+        """
+        Writes every section to a new file which atomically replaces the old one.
+
+        :param sections: The uncompressed sections.
+        :type sections: list
+        :return: The amount of bytes written.
+        :rtype: int
+        """
+        temp_path = self._path + ".tmp"
+
+        with open(temp_path, "wb") as save_file:
+            save_file.write(bytes(HEADER.size))
+            index = []
+            offset = HEADER.size
+
+            for section in sections:
+                data = zlib.compress(section, self.COMPRESSION_LEVEL)
+                save_file.write(data)
+                index.append((offset, len(data)))
+                offset += len(data)
+
+            save_file.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+            save_file.seek(0)
+            save_file.write(HEADER.pack(SECTION_MAGIC, width, height, depth, section_size, offset, len(index)))
+            save_file.flush()
+            os.fsync(save_file.fileno())
+
+        os.replace(temp_path, self._path)
+        self._load()
+        return self._file_size
+
+    def write_sections(self, sections):
+        """
+        Appends changed sections and a new index to the file, then points the header to them.
+
+        :param sections: The uncompressed changed sections, by section index.
+        :type sections: dict
+        :return: The amount of bytes written.
+        :rtype: int
+        """
+        index = list(self._index)
+
+        with open(self._path, "r+b") as save_file:
+            offset = save_file.seek(0, os.SEEK_END)
+            start = offset
+
+            for section_index, section in sections.items():
+                data = zlib.compress(section, self.COMPRESSION_LEVEL)
+                save_file.write(data)
+                index[section_index] = (offset, len(data))
+                offset += len(data)
+
+            save_file.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+            save_file.flush()
+            os.fsync(save_file.fileno())
+
+            header = self._header[:5] + (offset, len(index))
+            save_file.seek(0)
+            save_file.write(HEADER.pack(*header))
+            save_file.flush()
+            os.fsync(save_file.fileno())
+
+        self._header = header
+        self._index = index
+        self._file_size = offset + len(index) * INDEX_ENTRY.size
+        return self._file_size - start
@@ -16,6 +16,9 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import asyncio
+import collections
+import concurrent.futures
 import random
 import socket
 import string
@@ -26,65 +29,144 @@ import logging
 import urllib.request
 import urllib.parse
 
-from classicserver.connection import Connection
-from classicserver.packet.packet import MessagePacket, PingPacket, DespawnPlayerPacket, DisconnectPlayerPacket
+from classicserver.block_queue import BlockQueue
+from classicserver.connection import Connection, AsyncConnection
+from classicserver.edit import BulkEdit, find_changes
+from classicserver.log import setup_logging, is_tracing, TRACE
+from classicserver.metrics import METRICS, MetricsServer, Counter, Gauge, TICK_SECONDS, BROADCAST_SECONDS, \
+    FLUSH_LOOP_SECONDS, INBOUND_WAIT_SECONDS, BLOCK_CHANGES_RECEIVED, BLOCK_CHANGES_APPLIED
+from classicserver.packet.packet import MessagePacket, PingPacket, DespawnPlayerPacket, DisconnectPlayerPacket, \
+    SpawnPlayerPacket, PositionAndOrientationPacket, BlockUpdatePacket
 from classicserver.packet_handler import PacketHandler
 from classicserver.player import Player
-from classicserver.world import World
+from classicserver.rate_limit import RateLimits
+from classicserver.spatial import SpatialGrid
+from classicserver.transfer import LevelTransfer
+from classicserver.world_manager import WorldManager, MAIN_WORLD
 
 
 class ClassicServer(object):
+    """
+    The server runs a single-writer game loop: the networking only decodes the packets and queues them together with
+    the connection events, and the tick applies them in order. The tick owns all world and player state, so the
+    state is never changed by several threads at once and needs no locks.
+
+    In the asyncio mode, the tick runs on the event loop. In the threaded mode, it runs on the tick thread, and the
+    networking on the connection and flush threads.
+    """
+
     MTU = 1024
 
+    HEARTBEAT_INTERVAL = 45
+    AUTOSAVE_INTERVAL = 120
+    KEEP_ALIVE_INTERVAL = 30
+    TICK_INTERVAL = 0.05
+
+    # Players further away than the view distance (in blocks) only get updates every FAR_UPDATE_TICKS ticks
+    VIEW_DISTANCE = 64
+    FAR_UPDATE_TICKS = 20
+
+    # Every level transfer gets up to this many bytes queued on the connection per tick
+    TRANSFER_SIZE = 64 * 1024
+
+    # The blocks changed by bulk edits are sent to the players at this many blocks per tick
+    EDIT_BLOCKS_PER_TICK = 2048
+
     _bind_address = None
     _running = None
     _sock = None
 
+    _use_asyncio = False
+    _loop = None
+
     _packet_handler = None
 
-    _connections = {}
+    # The callbacks queued by the networking for the tick, with their arguments and the time they were queued at
+    _inbound = None
+
+    _connections = None
+
+    _players = None
+    _players_by_address = None
 
-    _players = {}
-    _players_by_address = {}
+    _broadcasts = None
+    _movements = None
+    _block_queue = None
+    # The BulkEdits being sent to the players, in order
+    _edits = None
 
-    _connections_lock = None
-    _players_lock = None
+    _tick_count = 0
+    _grids = None
+    # The blocks changed since the last far update, with the players which were sent the change, by (world, position)
+    _far_blocks = None
+
+    # The level transfers by player ID, in the order they were started, of which the first ones are active
+    _transfers = None
+    _max_level_transfers = 4
 
     _player_id = 0
+    _rate_limits = None
 
     _server_name = ""
     _motd = ""
 
-    _save_file = ""
+    _worlds = None
+    # Runs the work too slow for the tick, e.g. finding the blocks changed by a bulk edit
+    _executor = None
+    _log_listener = None
+    _metrics_server = None
     _heartbeat_url = ""
     _salt = ""
 
-    _op_players = []
+    _op_players = None
     _max_players = -1
 
-    _world = None
-
     def __init__(self, config):
         # bind_address, server_name="", motd="", save_file="", heartbeat_url="", op_players=None, max_players=32
+        self._log_listener = setup_logging(config.get("logging", {}))
+
         self._bind_address = ("0.0.0.0", config["server"]["port"])
         self._running = False
         self._server_name = config["server"]["name"]
         self._motd = config["server"]["motd"]
-        self._save_file = config["save"]["file"]
+        self._worlds = WorldManager(config["save"], config.get("world", {}), config.get("worlds", {}),
+                                    lambda callback: self._inbound.append((callback, (), time.time())))
         self._heartbeat_url = config["heartbeat_url"]
         self._op_players = config["server"]["ops"]
         self._max_players = config["server"]["max_players"]
+        self._use_asyncio = config["server"].get("mode", "threaded") == "asyncio"
+        self._max_level_transfers = config["server"].get("max_level_transfers", 4)
+        self._rate_limits = config.get("rate_limits", {})
 
         if self._max_players > 255:
             raise ValueError("The player limit is up to 255 excluding the admin slot.")
 
-        logging.basicConfig(level=logging.DEBUG)
+        self._inbound = collections.deque()
+        self._connections = {}
+        self._players = {}
+        self._players_by_address = {}
+
+        self._broadcasts = []
+        self._movements = {}
+        self._block_queue = BlockQueue()
+        self._edits = collections.deque()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
-        self._connections_lock = threading.RLock()
-        self._players_lock = threading.RLock()
+        self._grids = {}
+
+        self._transfers = collections.OrderedDict()
+        self._far_blocks = {}
 
         self._packet_handler = PacketHandler(self)
 
+        metrics_config = config.get("metrics", {})
+        if metrics_config.get("port"):
+            METRICS.enabled = True
+            METRICS.add_collector(self._collect_metrics)
+            self._metrics_server = MetricsServer(METRICS, metrics_config.get("address", "127.0.0.1"),
+                                                 metrics_config["port"])
+            logging.info("Serving the metrics on port %d" % self._metrics_server.get_port())
+
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.bind(self._bind_address)
 
@@ -92,150 +174,725 @@ class ClassicServer(object):
         self._start()
 
     def data_hook(self, client, data):
-        try:
-            self._packet_handler.handle_packet(client, data)
-        except Exception as ex:
-            logging.error("Error in packet handler: %s" % repr(ex))
-            logging.debug(traceback.format_exc())
+        """
+        Decodes a frame received by the networking, on the networking's thread, and queues its packets to be handled
+        with the next tick.
 
-    def _heartbeat_thread(self):
-        while self._running:
-            try:
-                f = urllib.request.urlopen(self._heartbeat_url + (
-                    "?port=%d&max=%d&name=%s&public=True&version=7&salt=%s&users=%d" % (
-                        self._bind_address[1], self._max_players,
-                        urllib.parse.quote(self._server_name, safe=""), self._salt, len(self._players))
-                ))
+        :type client: BaseConnection
+        :param data: The frame, holding whole packets.
+        :type data: bytes
+        """
+        flooding = client.limits.flooding
+        if not client.limits.allow_packet():
+            # A flood is shed here, before it fills the queue, and the client is dropped with the next tick
+            if not flooding:
+                self._inbound.append((self._drop_flooder, (client,), time.time()))
+            return
 
-                data = f.read()
+        packets = self._packet_handler.decode(client, data)
+        if packets:
+            self._inbound.append((self._handle_packets, (client, packets), time.time()))
 
-                logging.debug("Heartbeat sent, json response: %s" % data.decode("utf-8"))
+    def _handle_packets(self, client, packets):
+        if client.get_address() not in self._connections:
+            # Left over from a connection which has been dropped since
+            return
 
-            except BaseException as ex:
-                logging.error("Heartbeat failed: %s" % repr(ex))
-                logging.debug(traceback.format_exc())
-            time.sleep(45)
+        self._packet_handler.handle_packets(client, packets)
 
-    def _save_thread(self):
-        while self._running:
+    def _drop_flooder(self, client):
+        if self._connections.get(client.get_address()) is not client:
+            return
+
+        logging.warning("Dropping connection %s for flooding" % repr(client.get_address()))
+        player = self._players_by_address.get(client.get_address())
+        if player:
+            self.kick_player(player.player_id, "too many packets")
+        else:
+            self._disconnect(client)
+
+    def _process_inbound(self):
+        # Only handles what has been queued so far, so a flood of packets can't keep the tick from completing
+        if METRICS.enabled and self._inbound:
+            INBOUND_WAIT_SECONDS.observe(time.time() - self._inbound[0][2])
+
+        for _ in range(len(self._inbound)):
+            callback, args, _ = self._inbound.popleft()
             try:
-                self.broadcast(MessagePacket.make({
-                    "player_id": 0,
-                    "message": "Autosaving the world..."
-                }))
-                self.save_world()
-                time.sleep(120)
-            except BaseException as ex:
-                logging.error("Autosaving failed: %s" % repr(ex))
+                callback(*args)
+            except Exception as ex:
+                logging.error("Error in packet handler: %s" % repr(ex))
                 logging.debug(traceback.format_exc())
 
-        self.save_world()
+    def _send_heartbeat(self):
+        try:
+            f = urllib.request.urlopen(self._heartbeat_url + (
+                "?port=%d&max=%d&name=%s&public=True&version=7&salt=%s&users=%d" % (
+                    self._bind_address[1], self._max_players,
+                    urllib.parse.quote(self._server_name, safe=""), self._salt, len(self._players))
+            ))
+
+            data = f.read()
+
+            logging.debug("Heartbeat sent, json response: %s" % data.decode("utf-8"))
+
+        except BaseException as ex:
+            logging.error("Heartbeat failed: %s" % repr(ex))
+            logging.debug(traceback.format_exc())
+
+    def _send_keep_alive(self):
+        for connection in list(self._connections.values()):
+            try:
+                connection.send(PingPacket.make())
+            except (IOError, BrokenPipeError):
+                self._disconnect(connection)
 
-    def _keep_alive_thread(self):
+    def _heartbeat_thread(self):
         while self._running:
-            logging.info("KEEP ALIVE THREAD: Acquiring connection lock")
-            with self._connections_lock:
-                logging.info("KEEP ALIVE: connection lock acquired")
-                for connection in self._connections.values():
-                    try:
-                            connection.send(PingPacket.make())
-                    except (IOError, BrokenPipeError):
-                            self._disconnect(connection)
-            logging.info("KEEP ALIVE: connection lock released")
-            time.sleep(30)
+            self._send_heartbeat()
+            time.sleep(self.HEARTBEAT_INTERVAL)
+
+    def _autosave(self):
+        self.broadcast(MessagePacket.make({
+            "player_id": 0,
+            "message": "Autosaving the world..."
+        }))
+        for level in self._worlds.get_loaded():
+            level.save()
+
+        in_use = set(player.world for player in self.get_players().values())
+        self._worlds.touch(in_use)
+        self._unload_idle(in_use)
+
+    def _unload_idle(self, in_use):
+        # The levels are unloaded by the tick once their last save is complete, the tick never waits for a save
+        for level, future in self._worlds.unload_idle(in_use):
+            future.add_done_callback(lambda _, level=level: self._inbound.append((self._finish_unload, (level,),
+                                                                                  time.time())))
+
+    def _finish_unload(self, level):
+        # A player may have joined the level while it was being saved, it's kept loaded then
+        if level.name in set(player.world for player in self.get_players().values()):
+            level.unload_started = 0
+            return
+
+        self._worlds.release(level)
 
     def _connection_thread(self):
         while self._running:
             sock, addr = self._sock.accept()
-
-            logging.info("CONNECTION THREAD: Acquiring connection lock")
-            with self._connections_lock:
-                logging.info("CONNECTION THREAD: connection lock acquired")
-                self._connections[addr] = Connection(self, addr, sock)
-            logging.info("CONNECTION THREAD: connection lock released")
+            self.add_connection(Connection(self, addr, sock))
 
     def _flush_thread(self):
+        # Reads and writes every connection, reading a copy of the connections as they're owned by the tick
         while self._running:
-            logging.info("FLUSH THREAD: Acquiring connection lock")
-            with self._connections_lock:
-                logging.info("FLUSH THREAD: connection lock acquired")
-                for connection in self._connections.copy().values():
-                    try:
-                        connection.flush()
-                    except (IOError, BrokenPipeError):
-                        self._disconnect(connection)
-            logging.info("FLUSH THREAD: connection lock released")
+            start = time.time()
+            for connection in list(self._connections.values()):
+                try:
+                    connection.flush()
+                except (IOError, BrokenPipeError):
+                    self.remove_connection(connection)
+
+            if METRICS.enabled:
+                FLUSH_LOOP_SECONDS.observe(time.time() - start)
             time.sleep(0.3)
 
-    def broadcast(self, data, ignore=None):
-        if not ignore:
-            ignore = []
+    def _tick_thread(self):
+        # Runs the tick and the periodic jobs which change the state, then saves the worlds once stopped
+        jobs = [[self.AUTOSAVE_INTERVAL, self._autosave, 0], [self.KEEP_ALIVE_INTERVAL, self._send_keep_alive, 0]]
+
+        while self._running:
+            start = time.time()
+            self._tick()
 
-        logging.info("BROADCAST: Acquiring player lock")
-        with self._players_lock:
-            logging.info("BROADCAST: player lock acquired")
-            for player in self._players.values():
-                connection = player.connection
-                if connection.get_address() not in ignore:
+            for job in jobs:
+                if start >= job[2]:
+                    job[2] = start + job[0]
                     try:
-                        connection.send(data)
-                    except (IOError, BrokenPipeError):
-                        self._disconnect(connection)
-        logging.info("BROADCAST: player lock released")
+                        job[1]()
+                    except BaseException as ex:
+                        logging.error("Error in periodic job: %s" % repr(ex))
+                        logging.debug(traceback.format_exc())
 
-    def _disconnect(self, connection):
-        player = None
+            time.sleep(max(self.TICK_INTERVAL - (time.time() - start), 0))
+
+        self._shutdown()
+
+    def _event_loop_thread(self):
+        """
+        Runs the asyncio networking core: connections are served by AsyncConnection protocols, which queue the packets
+        for the tick, and the tick and the periodic jobs are scheduled on the same loop instead of own threads.
+        """
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            self._loop.create_server(lambda: AsyncConnection(self), sock=self._sock)
+        )
+
+        self._loop.call_soon(self._tick_task)
+        self._loop.call_soon(self._save_task)
+        self._loop.call_soon(self._keep_alive_task)
+        if self._heartbeat_url:
+            self._loop.call_soon(self._heartbeat_task)
+
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+            self._loop.run_until_complete(server.wait_closed())
+            self._loop.close()
+            self._shutdown()
+
+    def _shutdown(self):
+        # Saves the worlds a last time, then writes out the remaining log records
+        try:
+            self._executor.shutdown(wait=True)
+            self._worlds.close()
+        finally:
+            if self._metrics_server:
+                self._metrics_server.stop()
+            self._log_listener.stop()
 
-        if connection.get_address() in self._players_by_address:
-            player = self.get_player_by_address(connection.get_address())
+    def _schedule(self, delay, callback):
+        if self._running:
+            self._loop.call_later(delay, callback)
 
-        logging.info("DISCONNECT: Acquiring connection lock")
-        with self._connections_lock:
-            logging.info("DISCONNECT: connection lock acquired")
-            del self._connections[connection.get_address()]
-        logging.info("DISCONNECT: connection lock released")
+    def _tick_task(self):
+        self._tick()
+        self._schedule(self.TICK_INTERVAL, self._tick_task)
+
+    def _heartbeat_task(self):
+        self._loop.run_in_executor(None, self._send_heartbeat)
+        self._schedule(self.HEARTBEAT_INTERVAL, self._heartbeat_task)
+
+    def _keep_alive_task(self):
+        self._send_keep_alive()
+        self._schedule(self.KEEP_ALIVE_INTERVAL, self._keep_alive_task)
+
+    def _save_task(self):
+        self._autosave()
+        self._schedule(self.AUTOSAVE_INTERVAL, self._save_task)
+
+    def _tick(self):
+        try:
+            tracing = is_tracing()
+            if tracing:
+                inbound, broadcasts, movements = len(self._inbound), len(self._broadcasts), len(self._movements)
+
+            start = time.time()
+            self._process_inbound()
+            self._apply_block_changes()
+            self._pump_edits()
+            broadcast_start = time.time()
+            self._flush_broadcasts()
+            broadcast_end = time.time()
+            self._pump_transfers()
+            end = time.time()
+
+            if METRICS.enabled:
+                TICK_SECONDS.observe(end - start)
+                BROADCAST_SECONDS.observe(broadcast_end - broadcast_start)
+
+            if tracing:
+                logging.log(TRACE, "Tick %d: %d inbound, %d broadcasts, %d movements, %d transfers in %.2f ms" % (
+                    self._tick_count, inbound, broadcasts, movements, len(self._transfers), (end - start) * 1000
+                ))
+        except Exception as ex:
+            logging.error("Error in tick: %s" % repr(ex))
+            logging.debug(traceback.format_exc())
+
+    def _collect_metrics(self):
+        # Called on the metrics thread, so it only reads copies of the state owned by the tick
+        connections = list(self._connections.values())
+
+        queued = Gauge("classic_connection_queued_bytes", "Outbound bytes not written to the socket yet.", ("address",))
+        sent = Counter("classic_connection_sent_bytes_total", "Bytes sent over the connection.", ("address",))
+        received = Counter("classic_connection_received_bytes_total", "Bytes received over the connection.",
+                           ("address",))
+        for connection in connections:
+            address = ("%s:%d" % connection.get_address()[:2],)
+            queued.set(connection.get_queued(), address)
+            sent.inc(address, connection.bytes_sent)
+            received.inc(address, connection.bytes_received)
+
+        metrics = [queued, sent, received]
+        for name, description, value in (
+                ("classic_connections", "Open connections.", len(connections)),
+                ("classic_players", "Players on the server.", len(self._players)),
+                ("classic_loaded_worlds", "Worlds held in memory.", len(self._worlds.get_loaded())),
+                ("classic_level_transfers", "Players loading a level.", len(self._transfers)),
+                ("classic_inbound_queue_length", "Packets and connection events waiting for the tick.",
+                 len(self._inbound))):
+            gauge = Gauge(name, description)
+            gauge.set(value)
+            metrics.append(gauge)
+
+        return metrics
+
+    def queue_block(self, player, x, y, z, block):
+        """
+        Queues a block change by a player, it's applied and broadcast with the next tick. When a block is changed
+        several times in a tick, only the last change is applied.
+
+        :type player: Player
+        :param block: The new block type.
+        :type block: int
+        """
+        self._block_queue.queue(player.world, x, y, z, block, player.player_id, player.name)
+
+    def _apply_block_changes(self):
+        # Applies the block changes of the tick world by world, and broadcasts the final state of every block changed.
+        # Blocks changed back within the tick are broadcast as well, as the clients which changed them may be off.
+        changes_by_world, count = self._block_queue.take()
+        if not count:
+            return
+
+        applied = 0
+        for world_name, changes in changes_by_world.items():
+            level = self._worlds.get(world_name)
+            if not level:
+                continue
+
+            old_blocks = level.world.set_blocks([(x, y, z, block) for (x, y, z), (block, _, _) in changes.items()])
+            for ((x, y, z), (block, player_id, player_name)), old_block in zip(changes.items(), old_blocks):
+                if old_block != block:
+                    level.record_block(x, y, z, old_block, block, player_id, player_name)
+
+                self.broadcast(BlockUpdatePacket.make({
+                    "x": x,
+                    "y": y,
+                    "z": z,
+                    "block_type": block
+                }), position=(x, y, z), world=world_name)
+
+            applied += len(changes)
+
+        if METRICS.enabled:
+            BLOCK_CHANGES_RECEIVED.inc(amount=count)
+            BLOCK_CHANGES_APPLIED.inc(amount=applied)
+
+    def edit_world(self, name, box, edit, done=None, player=None):
+        """
+        Makes a large change to a world. The blocks it changed are found in the background, then streamed to the
+        players in the world over the next ticks, unless sending the whole level again takes fewer bytes, in which case
+        the level is sent again instead.
+
+        :param name: The name of the world.
+        :type name: str
+        :param box: The corners of the box the edit may change, (x1, y1, z1, x2, y2, z2) with x1 <= x2 and so on.
+        :type box: tuple
+        :param edit: A function making the change to the World it's given, e.g. one calling World.fill().
+        :param done: A function called on the tick with the amount of blocks changed and whether the level is sent
+                     again, once the changed blocks have been found.
+        :param player: The player making the edit, whose name the edited box is recorded with in the block history.
+        :type player: Player
+        """
+        level = self._worlds.get(name)
+        world = level.world
+
+        # The size of the level as last sent is close enough to tell whether it's worth sending again. If it's never
+        # been sent, it's built ahead of comparing the copies on the same executor, so its size is known by then.
+        if world.get_level_stream_size() is None:
+            world.prepare_level_stream(self._executor)
+
+        _, before = world.copy(*box)
+        edit(world)
+        dimensions, after = world.copy(*box)
+
+        # Comparing the copies takes a while without NumPy, the tick goes on meanwhile
+        editor = (player.name, level.history.get_time()) if player and level.history else None
+        self._executor.submit(find_changes, before, after).add_done_callback(
+            lambda found: self._inbound.append((self._finish_edit, (level, box, dimensions, found, done, editor),
+                                                time.time())))
+
+    def _finish_edit(self, level, box, dimensions, found, done, editor):
+        changes = found.result()
+        resend = False
+        origin = tuple(max(coordinate, 0) for coordinate in box[:3])
+
+        # A level unloaded meanwhile has been saved with the edit, and nobody is in it to send it to
+        if changes and level.is_loaded():
+            # Bulk edits aren't journaled block by block, the sections they changed are saved right away instead
+            level.save()
+
+            if level.history and editor:
+                level.history.record_edit(editor[0], origin + tuple(origin[axis] + dimensions[axis] - 1
+                                                                    for axis in range(3)), editor[1])
+
+            level_size = level.world.get_level_stream_size()
+            resend = len(changes) * BlockUpdatePacket.SIZE > (level_size or len(level.world.blocks))
+            if resend:
+                for player in self.get_players().values():
+                    if player.world == level.name:
+                        self.resend_level(player)
+            else:
+                self._edits.append(BulkEdit(level.name, origin, dimensions, changes))
+
+            logging.info("Edited %d blocks of the world %s, %s" % (len(changes), level.name,
+                                                                    "sending the level again" if resend else
+                                                                    "streaming"))
+
+        if done:
+            done(len(changes), resend)
+
+    def undo_player(self, name, player, target_name, seconds, done):
+        """
+        Reverts the block changes a player made in a world over the last seconds, as a single edit. A block is only
+        reverted if it's still the way the player left it, so later changes by others aren't lost. The reverted
+        blocks are recorded as changed by the player undoing, so an undo can be undone in turn.
+
+        The changes are read from the block history in the background. The blocks replaced by bulk edits aren't
+        recorded, so if the player made any in the period, nothing is undone and the player undoing is told why.
+
+        :param name: The name of the world.
+        :type name: str
+        :param player: The player undoing the changes.
+        :type player: Player
+        :param target_name: The name of the player whose changes are undone.
+        :type target_name: str
+        :param seconds: How far back to undo.
+        :type seconds: float
+        :param done: A function called on the tick with the amount of blocks changed and whether the level is sent
+                     again, see edit_world(). Not called if the undo is refused.
+        :return: Whether the world has a block history.
+        :rtype: bool
+        """
+        level = self._worlds.get(name)
+        if not level.history:
+            return False
+
+        # The history answers in order, so the edits are known by the time the changes are
+        since = level.history.get_time() - seconds
+        edits = level.history.get_edits(target_name, since)
+        level.history.get_changes(target_name, since).add_done_callback(
+            lambda changes: self._inbound.append((self._finish_undo, (level, player, target_name, edits, changes, done),
+                                                  time.time())))
+        return True
+
+    def _finish_undo(self, level, player, target_name, edits, changes, done):
+        # Dropped along with the world if it's been unloaded meanwhile
+        if not level.is_loaded():
+            return
+
+        try:
+            edits, changes = edits.result(), changes.result()
+        except Exception as ex:
+            logging.error("Reading the block history of the world %s failed: %s" % (level.name, repr(ex)))
+            logging.debug(traceback.format_exc())
+            player.connection.send(MessagePacket.make({"player_id": 0,
+                                                       "message": "&4The block history couldn't be read."}))
+            return
+
+        if edits:
+            player.connection.send(MessagePacket.make({
+                "player_id": 0,
+                "message": "&4%s made %d bulk edits, which can't be undone." % (target_name, len(edits))
+            }))
+            return
+
+        # The block before the player's first change in the period, and after their last one
+        blocks = collections.OrderedDict()
+        for x, y, z, old_block, new_block, _ in changes:
+            blocks[(x, y, z)] = (blocks[(x, y, z)][0] if (x, y, z) in blocks else old_block, new_block)
+
+        world = level.world
+        reverts = [(x, y, z, old_block) for (x, y, z), (old_block, new_block) in blocks.items()
+                   if old_block != new_block and world.get_block(x, y, z) == new_block]
+        if not reverts:
+            done(0, False)
+            return True
+
+        box = tuple(min(revert[axis] for revert in reverts) for axis in range(3)) + \
+            tuple(max(revert[axis] for revert in reverts) for axis in range(3))
+        self.edit_world(level.name, box, lambda edited: edited.set_blocks(reverts), done)
+
+        now = level.history.get_time()
+        for x, y, z, old_block in reverts:
+            level.history.record(player.name, x, y, z, blocks[(x, y, z)][1], old_block, now)
+
+        logging.info("%s undid %d block changes of %s in the world %s" % (player.name, len(reverts), target_name,
+                                                                          level.name))
+
+    def get_block_history(self, name, x, y, z, done):
+        """
+        Gets who changed a block of a world, in the background.
+
+        :param name: The name of the world.
+        :type name: str
+        :param done: A function called on the tick with the (timestamp, player name, old block, new block) tuples,
+                     oldest first, and the time of the history's clock to tell their age by. Not called if the history
+                     can't be read.
+        :return: Whether the world has a block history.
+        :rtype: bool
+        """
+        level = self._worlds.get(name)
+        if not level.history:
+            return False
+
+        level.history.get_block_changes(x, y, z).add_done_callback(
+            lambda changes: self._inbound.append((self._finish_block_history, (level, changes, done), time.time())))
+        return True
+
+    def _finish_block_history(self, level, changes, done):
+        if not level.is_loaded():
+            return
+
+        try:
+            changes = changes.result()
+        except Exception as ex:
+            logging.error("Reading the block history of the world %s failed: %s" % (level.name, repr(ex)))
+            logging.debug(traceback.format_exc())
+            return
+
+        done(changes, level.history.get_time())
+
+    def _pump_edits(self):
+        # Broadcasts the next blocks of the bulk edits, the edits of worlds nobody is in anymore are dropped as the
+        # players joining them get the edited level anyway
+        budget = self.EDIT_BLOCKS_PER_TICK
+        in_use = set(player.world for player in self._players.values())
+
+        while self._edits and budget > 0:
+            edit = self._edits[0]
+            if edit.world in in_use:
+                data = edit.take(self._worlds.get(edit.world).world, budget)
+                budget -= len(data) // BlockUpdatePacket.SIZE
+                self.broadcast(data, world=edit.world)
+
+                if not edit.is_done():
+                    break
+
+            self._edits.popleft()
+
+    def broadcast(self, data, ignore=None, position=None, world=None):
+        """
+        Queues data to be sent to every player with the next tick.
+
+        :param data: The encoded packets.
+        :type data: bytes
+        :param ignore: The addresses of the players not to send the data to.
+        :type ignore: list
+        :param position: The coordinates of the block the data updates. If specified, only the players within the view
+                         distance get the data with the next tick, the others get the block as it is by then with the
+                         next far update.
+        :type position: tuple
+        :param world: The name of the world the data is about, only the players in it get the data. Every player gets
+                      it if not specified, a position can only be specified together with the world.
+        :type world: str
+        """
+        self._broadcasts.append((data, ignore, position, world))
+
+    def broadcast_movement(self, player):
+        """
+        Queues the position and orientation of a player to be sent to the other players with the next tick. Only the
+        latest position of each player is sent, and only to the players in the same world within the view distance, the
+        others are updated every FAR_UPDATE_TICKS ticks.
+
+        :type player: Player
+        """
+        self._movements[player.player_id] = player
+
+    def _flush_broadcasts(self):
+        # Sends everything broadcast since the last tick to every player as a single buffer. Each packet is encoded
+        # once, area broadcasts and movement only go to the players near them and the rest is sent to the far away
+        # players at a lower rate.
+        broadcasts, self._broadcasts = self._broadcasts, []
+        movements, self._movements = self._movements, {}
+
+        self._tick_count += 1
+        far_tick = self._tick_count % self.FAR_UPDATE_TICKS == 0
+
+        players = self.get_players()
+        loading = dict(self._transfers)
+
+        # Players loading a level don't take part in the world yet, whatever is broadcast to them is deferred
+        for player_id in loading:
+            players.pop(player_id, None)
+
+        self._update_grid(players)
+
+        if not broadcasts and not movements and not (far_tick and players):
+            return
+
+        for data, ignore, position, world in broadcasts:
+            for transfer in loading.values():
+                if (world is None or world == transfer.world) and \
+                        not (ignore and transfer.player.connection.get_address() in ignore):
+                    transfer.defer(data)
+
+        outgoing = dict((player_id, []) for player_id in players)
+
+        for data, ignore, position, world in broadcasts:
+            if world is None:
+                targets = players
+            elif position is None:
+                targets = [player_id for player_id, player in players.items() if player.world == world]
+            elif world in self._grids:
+                targets = self._grids[world].nearby(position[0], position[2], self.VIEW_DISTANCE)
+                # Only the latest change of a block matters to the players it's sent to later
+                self._far_blocks[(world, position)] = (ignore, targets)
+            else:
+                continue
+
+            for player_id in targets:
+                if player_id in outgoing and not (ignore and players[player_id].connection.get_address() in ignore):
+                    outgoing[player_id].append(data)
+
+        for subject_id, subject in movements.items():
+            if subject_id not in players:
+                continue
+
+            move = self._packet_handler.encode_movement(subject)
+            if not move:
+                continue
+
+            # Observers which got the subject's previous update get the relative one, the others need the absolute
+            # position to catch up
+            previous_tick, subject.sent_tick = subject.sent_tick, self._tick_count
+            absolute = None
+
+            grid = self._grids[subject.world]
+            for observer_id in grid.nearby(subject.coordinates[0], subject.coordinates[2], self.VIEW_DISTANCE):
+                if observer_id == subject_id or observer_id not in players:
+                    continue
+
+                observer = players[observer_id]
+                if observer.synced.get(subject_id) == previous_tick:
+                    outgoing[observer_id].append(move)
+                else:
+                    if absolute is None:
+                        absolute = self._packet_handler.encode_position(subject)
+                    outgoing[observer_id].append(absolute)
+                observer.synced[subject_id] = self._tick_count
+
+        if far_tick:
+            self._flush_far_updates(players, outgoing)
+
+        for player_id, packets in outgoing.items():
+            if packets:
+                connection = players[player_id].connection
+                try:
+                    connection.send(b"".join(packets))
+                except (IOError, BrokenPipeError):
+                    self._disconnect(connection)
+
+    def _flush_far_updates(self, players, outgoing):
+        # Brings every player up to date with the movement and block changes it missed for being too far away. The
+        # blocks are sent as they are now, a block may have changed again since, e.g. by a bulk edit.
+        absolutes = {}
+
+        far_blocks, self._far_blocks = self._far_blocks, {}
+        in_use = set(player.world for player in players.values())
+        block_updates = []
+        for (world, (x, y, z)), (ignore, targets) in far_blocks.items():
+            if world in in_use:
+                block_updates.append((BlockUpdatePacket.make({
+                    "x": x,
+                    "y": y,
+                    "z": z,
+                    "block_type": self._worlds.get(world).world.get_block(x, y, z)
+                }), ignore, world, targets))
+
+        for observer_id, observer in players.items():
+            for subject_id, subject in players.items():
+                if subject_id != observer_id and subject.world == observer.world and \
+                        subject.sent_position is not None and observer.synced.get(subject_id) != subject.sent_tick:
+                    if subject_id not in absolutes:
+                        absolutes[subject_id] = self._packet_handler.encode_position(subject)
+                    outgoing[observer_id].append(absolutes[subject_id])
+                    observer.synced[subject_id] = subject.sent_tick
+
+            address = observer.connection.get_address()
+            for data, ignore, world, targets in block_updates:
+                if observer.world == world and observer_id not in targets and not (ignore and address in ignore):
+                    outgoing[observer_id].append(data)
+
+    def _update_grid(self, players):
+        # Every world has its own grid, players which left the world are removed from it
+        for world, grid in self._grids.items():
+            for player_id in grid.keys():
+                if player_id not in players or players[player_id].world != world:
+                    grid.remove(player_id)
+
+        for player_id, player in players.items():
+            if player.world not in self._grids:
+                self._grids[player.world] = SpatialGrid()
+            self._grids[player.world].update(player_id, player.coordinates[0], player.coordinates[2])
+
+    def add_connection(self, connection):
+        """
+        Queues a new connection to be added with the next tick.
+        """
+        connection.limits = RateLimits(self._rate_limits)
+        self._inbound.append((self._add_connection, (connection,), time.time()))
+
+    def _add_connection(self, connection):
+        self._connections[connection.get_address()] = connection
+
+    def remove_connection(self, connection):
+        """
+        Queues a closed connection to be removed with the next tick.
+        """
+        self._inbound.append((self._remove_connection, (connection,), time.time()))
+
+    def _remove_connection(self, connection):
+        if self._connections.get(connection.get_address()) is connection:
+            self._disconnect(connection)
+
+    def _disconnect(self, connection):
+        player = self._players_by_address.get(connection.get_address())
+        self._connections.pop(connection.get_address(), None)
+
+        connection.close()
 
         if player:
             logging.info("Player %s has quit" % player.name)
-            del self._players_by_address[connection.get_address()]
-            del self._players[player.player_id]
-            self.broadcast(DespawnPlayerPacket.make({"player_id": player.player_id}))
+            self._players_by_address.pop(connection.get_address(), None)
+            self._players.pop(player.player_id, None)
+            for other in list(self._players.values()):
+                other.synced.pop(player.player_id, None)
+            self._movements.pop(player.player_id, None)
+            transfer = self._transfers.get(player.player_id)
+            if transfer and transfer.player is player:
+                del self._transfers[player.player_id]
+            self.broadcast(DespawnPlayerPacket.make({"player_id": player.player_id}), world=player.world)
             self.broadcast(MessagePacket.make({"player_id": 0, "message": "&e%s&f has quit!" % player.name}))
 
     def _start(self):
         self.generate_salt()
         self.load_world()
         self._running = True
-        threading.Thread(target=self._save_thread).start()
+
+        if self._use_asyncio:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._event_loop_thread).start()
+            return
+
+        threading.Thread(target=self._tick_thread).start()
         threading.Thread(target=self._connection_thread).start()
         threading.Thread(target=self._flush_thread).start()
-        threading.Thread(target=self._keep_alive_thread).start()
         if self._heartbeat_url:
             threading.Thread(target=self._heartbeat_thread).start()
 
     def _stop(self):
         self._running = False
-        self._sock.close()
 
-    def load_world(self):
-        try:
-            save = open(self._save_file, "rb").read()
-            self._world = World.from_save(save)
-            return
-        except FileNotFoundError:
-            logging.info("Save file not found, creating a new one")
-        except IOError as ex:
-            logging.error("Error during loading save file: %s" % repr(ex))
-            logging.error(traceback.format_exc())
+        if self._use_asyncio:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        else:
+            self._sock.close()
 
-        self._world = World()
+    def load_world(self):
+        # The main world is loaded before the tick starts, anyone joining is sent there
+        self._worlds.load(MAIN_WORLD).result()
 
     def save_world(self):
-        logging.info("Saving the world...")
-        save_file = open(self._save_file, "wb")
-        save_file.write(self._world.encode())
-        save_file.flush()
-        save_file.close()
+        """
+        Saves every loaded world and waits for the saves to complete. Not to be called on the tick, which starts the
+        saves following the ones in progress.
+        """
+        logging.info("Saving the worlds...")
+        for future in [level.save() for level in self._worlds.get_loaded()]:
+            future.result()
 
     def generate_salt(self):
         base_62 = string.ascii_letters + string.digits
@@ -263,27 +920,211 @@ class ClassicServer(object):
                 self._player_id += 1
 
             player = Player(player_id, connection, coordinates, name, 0x64 if self.is_op(name) else 0x00)
-            logging.info("ADD PLAYER: acquiring player lock")
-            with self._players_lock:
-                logging.info("ADD PLAYER: player lock acquired")
-                self._players[player_id] = player
-                self._players_by_address[connection.get_address()] = player
-            logging.info("ADD PLAYER: player lock released")
+            self._players[player_id] = player
+            self._players_by_address[connection.get_address()] = player
             return player_id
         else:
             logging.warning("Disconnecting player %s because no free slots left." % name)
             connection.send(DisconnectPlayerPacket.make({"reason": "Server full"}))
 
+    def join_world(self, player, name):
+        """
+        Starts sending a world to a player, who is spawned in it together with the other players in the world once
+        the level has been sent. At most max_level_transfers levels are sent at the same time, the others wait. A world
+        which isn't loaded is loaded in the background first, the player stays where it is meanwhile.
+
+        :type player: Player
+        :param name: The name of the world.
+        :type name: str
+        :return: Whether the world exists.
+        :rtype: bool
+        """
+        future = self._worlds.load(name)
+        if not future:
+            return False
+
+        player.joining = name
+        if future.done():
+            self._finish_join(player, name, future)
+        else:
+            player.connection.send(MessagePacket.make({"player_id": 0, "message": "&eLoading the world %s..." % name}))
+            future.add_done_callback(lambda done: self._inbound.append((self._finish_join, (player, name, done),
+                                                                        time.time())))
+        return True
+
+    def _finish_join(self, player, name, future):
+        # Only the world the player asked for last is joined, and only if the player is still there
+        if self._players.get(player.player_id) is not player or player.joining != name:
+            return
+        player.joining = None
+
+        try:
+            level = future.result()
+        except Exception as ex:
+            logging.error("Loading the world %s failed: %s" % (name, repr(ex)))
+            logging.debug(traceback.format_exc())
+            player.connection.send(MessagePacket.make({"player_id": 0,
+                                                       "message": "&4The world %s couldn't be loaded." % name}))
+            return
+
+        level.last_used = time.time()
+        players = self.get_players()
+        if player.world is not None:
+            self._leave_world(player, players)
+
+        player.world = name
+        player.coordinates = level.world.get_spawn()
+        player.sent_position, player.sent_orientation = None, None
+
+        transfer = self._transfers[player.player_id] = LevelTransfer(player, name)
+        self._send_level(transfer, level)
+
+        # Loading the world may have taken the loaded worlds over the memory budget
+        self._unload_idle(set(other.world for other in players.values()))
+
+    def resend_level(self, player):
+        """
+        Sends the level of a player's world again, e.g. after a large edit, leaving the player where it is.
+
+        :type player: Player
+        """
+        level = self._worlds.get(player.world)
+
+        transfer = self._transfers.get(player.player_id)
+        if transfer:
+            # Still loading, the level is started over with the new blocks
+            self._send_level(transfer, level)
+            return
+
+        self._leave_world(player, self.get_players())
+        player.sent_position, player.sent_orientation = None, None
+        transfer = self._transfers[player.player_id] = LevelTransfer(player, player.world)
+        self._send_level(transfer, level)
+
+    def _send_level(self, transfer, level):
+        # Starts a transfer over with the level stream, if it has to be built first the transfer waits until it's
+        # built in the background
+        future = level.world.prepare_level_stream(self._executor)
+        if future is None:
+            transfer.restart(level.world.iter_level_stream())
+            return
+
+        transfer.restart(None)
+        future.add_done_callback(lambda _: self._inbound.append((self._level_stream_built, (level,), time.time())))
+
+    def _level_stream_built(self, level):
+        if not level.is_loaded():
+            return
+
+        for transfer in list(self._transfers.values()):
+            if transfer.world == level.name and transfer.is_waiting():
+                self._send_level(transfer, level)
+
+    def _pump_transfers(self):
+        # Sends the next part of the levels being transferred, a player is spawned once it has the whole level
+        active = list(self._transfers.values())[:self._max_level_transfers]
+
+        for transfer in active:
+            connection = transfer.player.connection
+            size = self.TRANSFER_SIZE - connection.get_queued()
+            if size <= 0:
+                continue
+
+            try:
+                if not transfer.pump(size):
+                    continue
+            except (IOError, BrokenPipeError):
+                self._disconnect(connection)
+                continue
+
+            if self._transfers.get(transfer.player.player_id) is not transfer:
+                # The player has been sent to another world or disconnected meanwhile
+                continue
+            del self._transfers[transfer.player.player_id]
+            loading = [other.player.connection.get_address() for other in self._transfers.values()]
+
+            # A failed spawn only affects its own player, the other transfers go on
+            try:
+                self._spawn_player(transfer.player, loading)
+            except Exception as ex:
+                logging.error("Spawning the player %s failed: %s" % (transfer.player.name, repr(ex)))
+                logging.debug(traceback.format_exc())
+                self._disconnect(connection)
+
+    def _spawn_player(self, player, loading):
+        # Spawns a player which has loaded its world and the other players in the world for each other. Players which
+        # are still loading the world are left out, they get the spawn once they're done instead. Runs on the tick, so
+        # the spawns are sent directly, in order with the broadcasts.
+        player.sent_position, player.sent_orientation = player.get_sent_state()
+        spawn = SpawnPlayerPacket.make({
+            "player_id": player.player_id,
+            "username": player.name,
+            "x": player.sent_position[0],
+            "y": player.sent_position[1],
+            "z": player.sent_position[2],
+            "yaw": player.sent_orientation[0],
+            "pitch": player.sent_orientation[1]
+        })
+
+        for other in self.get_players().values():
+            if other.player_id != player.player_id and other.world == player.world and \
+                    other.connection.get_address() not in loading:
+                # Spawn the player where the others know it to be, further movement is sent relative to that
+                position, orientation = other.get_sent_state()
+                try:
+                    player.connection.send(SpawnPlayerPacket.make({
+                        "player_id": other.player_id,
+                        "username": other.name,
+                        "x": position[0],
+                        "y": position[1],
+                        "z": position[2],
+                        "yaw": orientation[0],
+                        "pitch": orientation[1]
+                    }))
+                except (IOError, BrokenPipeError):
+                    # The players already spawned for are sent the despawn
+                    self._disconnect(player.connection)
+                    return
+                player.synced[other.player_id] = other.sent_tick
+
+                try:
+                    other.connection.send(spawn)
+                except (IOError, BrokenPipeError):
+                    self._disconnect(other.connection)
+                    continue
+                other.synced[player.player_id] = player.sent_tick
+
+        try:
+            player.connection.send(PositionAndOrientationPacket.make({
+                "player_id": -1,
+                "frac_x": int(player.coordinates[0] * 32),
+                "frac_y": int(player.coordinates[1] * 32),
+                "frac_z": int(player.coordinates[2] * 32),
+                "yaw": player.yaw,
+                "pitch": player.pitch
+            }))
+        except (IOError, BrokenPipeError):
+            self._disconnect(player.connection)
+
+    def _leave_world(self, player, players):
+        # Despawns the player for the players in its world and the other way round
+        for other in players.values():
+            if other.player_id != player.player_id and other.world == player.world:
+                player.connection.send(DespawnPlayerPacket.make({"player_id": other.player_id}))
+                other.synced.pop(player.player_id, None)
+
+        player.synced.clear()
+        self._movements.pop(player.player_id, None)
+
+        self.broadcast(DespawnPlayerPacket.make({"player_id": player.player_id}), [player.connection.get_address()],
+                       world=player.world)
+
     def kick_player(self, player_id, reason):
         player = self._players[player_id]
         logging.info("Kicking player %s for %s" % (player.name, reason))
         player.connection.send(DisconnectPlayerPacket.make({"reason": reason}))
 
-        logging.info("KICK PLAYER: acquiring player lock")
-        with self._players_lock:
-            logging.info("KICK PLAYER: player lock acquired")
-            del self._players[player_id]
-        logging.info("KICK PLAYER: player lock released")
+        del self._players[player_id]
 
         self.broadcast(MessagePacket.make({"player_id": 0, "message": "Player %s kicked, %s" % (player.name, reason)}))
         self._disconnect(player.connection)
@@ -304,18 +1145,41 @@ class ClassicServer(object):
         return self._players[player_id]
 
     def get_player_by_address(self, address):
-        return self._players_by_address[address]
+        """
+        Gets the player connected from an address.
+
+        :type address: tuple
+        :return: The player, None if no player has joined from the address.
+        :rtype: Player
+        """
+        return self._players_by_address.get(address)
 
     def get_players(self):
-        logging.info("GET PLAYERS: acquiring player lock")
-        with self._players_lock:
-            logging.info("GET PLAYERS: player lock acquired")
-            players_copy = self._players.copy()
-        logging.info("GET PLAYERS: player lock released")
-        return players_copy
-
-    def get_world(self):
-        return self._world
+        return self._players.copy()
+
+    def get_world(self, name=MAIN_WORLD):
+        """
+        Gets a loaded world, e.g. the world of a player, see join_world() for the others.
+
+        :param name: The name of the world.
+        :type name: str
+        :rtype: World
+        """
+        return self._worlds.get(name).world
+
+    def get_level(self, name):
+        """
+        Gets a loaded level, e.g. the level of a player.
+
+        :param name: The name of the level.
+        :type name: str
+        :return: The level, None if there's no level with the name or it isn't loaded.
+        :rtype: Level
+        """
+        return self._worlds.get(name)
+
+    def get_world_names(self):
+        return self._worlds.get_names()
 
     def get_salt(self):
         return self._salt
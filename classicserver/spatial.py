@@ -0,0 +1,96 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+class SpatialGrid(object):
+    """
+    A uniform grid of chunk columns, used to find the players near a point without looking at every player.
+    """
+
+    CELL_SIZE = 16
+
+    _cells = None
+    _keys = None
+
+    def __init__(self):
+        self._cells = {}
+        self._keys = {}
+
+    def _cell(self, x, z):
+        return int(x) // self.CELL_SIZE, int(z) // self.CELL_SIZE
+
+    def update(self, key, x, z):
+        """
+        Inserts a key into the grid, or moves it if it's already there.
+
+        :param key: The key, e.g. a player ID.
+        :param x: The X coordinate in blocks.
+        :type x: float
+        :param z: The Z coordinate in blocks.
+        :type z: float
+        """
+        cell = self._cell(x, z)
+        old_cell = self._keys.get(key)
+
+        if cell == old_cell:
+            return
+
+        if old_cell is not None:
+            self._discard(key, old_cell)
+
+        self._keys[key] = cell
+        self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        cell = self._keys.pop(key, None)
+        if cell is not None:
+            self._discard(key, cell)
+
+    def _discard(self, key, cell):
+        keys = self._cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self._cells[cell]
+
+    def nearby(self, x, z, radius):
+        """
+        Finds the keys in the cells overlapping the square around a point.
+
+        :param x: The X coordinate in blocks.
+        :type x: float
+        :param z: The Z coordinate in blocks.
+        :type z: float
+        :param radius: The distance from the point to the sides of the square, in blocks.
+        :type radius: int
+        :return: The keys found.
+        :rtype: set
+        """
+        min_x, min_z = self._cell(x - radius, z - radius)
+        max_x, max_z = self._cell(x + radius, z + radius)
+
+        found = set()
+        for cell_x in range(min_x, max_x + 1):
+            for cell_z in range(min_z, max_z + 1):
+                keys = self._cells.get((cell_x, cell_z))
+                if keys:
+                    found |= keys
+
+        return found
+
+    def keys(self):
+        return list(self._keys)
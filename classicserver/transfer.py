@@ -0,0 +1,108 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+from classicserver.metrics import METRICS, LEVEL_SEND_SECONDS
+
+
+class LevelTransfer(object):
+    """
+    Sends a world to a player progressively, a few level chunks per tick.
+
+    Until the transfer is complete, whatever is broadcast to the player is deferred and sent after the level, as the
+    client can't handle anything else while it's loading the level. A transfer without level packets is waiting for
+    the level to be built, nothing is sent until it's given them.
+    """
+
+    player = None
+    world = None
+    started = 0
+
+    _packets = None
+    _deferred = None
+
+    def __init__(self, player, world, packets=None):
+        """
+        Creates a level transfer
+
+        :type player: Player
+        :param world: The name of the world sent.
+        :type world: str
+        :param packets: The encoded level packets, e.g. a World.iter_level_stream() iterator, None to wait for them.
+        """
+        self.player = player
+        self.world = world
+        self._packets = iter(packets) if packets is not None else None
+        self._deferred = []
+        self.started = time.time()
+
+    def restart(self, packets):
+        """
+        Starts the transfer over with other level packets, e.g. because the level changed too much to be patched up.
+        The deferred data is kept.
+
+        :param packets: The encoded level packets, None to wait for them.
+        """
+        self._packets = iter(packets) if packets is not None else None
+
+    def is_waiting(self):
+        return self._packets is None
+
+    def defer(self, data):
+        """
+        Holds back data for the player until the level has been sent.
+
+        :type data: bytes
+        """
+        self._deferred.append(data)
+
+    def pump(self, max_size):
+        """
+        Queues the next level packets on the player's connection.
+
+        :param max_size: The amount of bytes after which no more packets are queued.
+        :type max_size: int
+        :return: Whether the whole level has been queued, the deferred data is queued after it.
+        :rtype: bool
+        """
+        if self._packets is None:
+            return False
+
+        packets = []
+        size = 0
+        done = False
+
+        while size < max_size:
+            packet = next(self._packets, None)
+            if packet is None:
+                done = True
+                packets.extend(self._deferred)
+                self._deferred = []
+                break
+
+            packets.append(packet)
+            size += len(packet)
+
+        if packets:
+            self.player.connection.send(b"".join(packets))
+
+        if done and METRICS.enabled:
+            LEVEL_SEND_SECONDS.observe(time.time() - self.started)
+
+        return done
@@ -15,42 +15,575 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import collections
 import logging
 
 import struct
 import gzip
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from classicserver.generator import GENERATORS
+from classicserver.level_encoder import DEFAULT_ENCODER
+from classicserver.section_file import SECTION_MAGIC, read_sections
+from classicserver.packet.packet import LevelInitializePacket, LevelDataChunkPacket, LevelFinalizePacket, \
+    BlockUpdatePacket
 
 WORLD_WIDTH = 256
 WORLD_HEIGHT = 64
 WORLD_DEPTH = 256
 
+# Saves start with this magic and the world dimensions, older saves only contain the length-prefixed 256x64x256 map
+SAVE_MAGIC = b"CSW1"
+SAVE_HEADER = struct.Struct("!4sHHH")
+
+# The world is divided into sections of 16x16x16 blocks to track the changes which need to be saved
+SECTION_SHIFT = 4
+SECTION_SIZE = 1 << SECTION_SHIFT
+
 
 class World(object):
-    def __init__(self, blocks=None):
-        self.blocks = blocks if blocks else self._generate()
+    # The cached level stream is rebuilt at most once per this many seconds
+    LEVEL_STREAM_INTERVAL = 5
 
-    @staticmethod
-    def _generate():
-        logging.info("Generating the world...")
-        blocks = bytearray(WORLD_WIDTH * WORLD_HEIGHT * WORLD_DEPTH)
+    # The cached level stream is dropped once the blocks changed since it was built reach this fraction of the level,
+    # patching it up would take more than building it again with the next join
+    LEVEL_STREAM_MAX_CHANGES = 1 / 256
+
+    _generation = 0
+    _bulk_generation = 0
+
+    _level_stream = None
+    _level_stream_generation = -1
+    _level_stream_time = 0
+    _level_stream_changes = None
+    _level_stream_lock = None
+    # The future of the level stream being built in the background, the generation of the blocks it's built from and
+    # the blocks changed since
+    _level_stream_build = None
+    _level_stream_build_generation = -1
+    _level_stream_build_changes = None
+
+    width = WORLD_WIDTH
+    height = WORLD_HEIGHT
+    depth = WORLD_DEPTH
+
+    # A (y, z, x) NumPy view over the blocks, None when NumPy isn't installed
+    array = None
+
+    # The LevelEncoder gzipping the level data sent to joining players
+    encoder = DEFAULT_ENCODER
+
+    _sections_x = 0
+    _sections_z = 0
+    _sections_y = 0
+    _dirty_sections = None
+
+    def __init__(self, blocks=None, width=WORLD_WIDTH, height=WORLD_HEIGHT, depth=WORLD_DEPTH, generator="flat",
+                 seed=None):
+        """
+        Creates a world
+
+        :param blocks: The blocks of the world, a new world is generated if not specified.
+        :type blocks: bytearray | mmap.mmap
+        :param width: The size of the world along the X axis.
+        :type width: int
+        :param height: The size of the world along the Y axis.
+        :type height: int
+        :param depth: The size of the world along the Z axis.
+        :type depth: int
+        :param generator: The name of the generator in GENERATORS used to generate a new world.
+        :type generator: str
+        :param seed: The seed for the generator.
+        """
+        for size in (width, height, depth):
+            if not 0 < size <= 32767:
+                raise ValueError("Invalid world size: %dx%dx%d" % (width, height, depth))
+
+        self.width = width
+        self.height = height
+        self.depth = depth
 
-        for x in range(WORLD_WIDTH):
-            for y in range(WORLD_HEIGHT):
-                for z in range(WORLD_DEPTH):
-                    blocks[x + WORLD_DEPTH * (z + WORLD_WIDTH * y)] = 0 if y > 32 else (2 if y == 32 else 3)
+        self.blocks = blocks if blocks is not None else self._generate(generator, seed)
+        if len(self.blocks) != width * height * depth:
+            raise ValueError("The blocks don't match the world size %dx%dx%d" % (width, height, depth))
 
+        if numpy:
+            self.array = self._as_array(self.blocks)
+
+        self._sections_x = (width + SECTION_SIZE - 1) >> SECTION_SHIFT
+        self._sections_z = (depth + SECTION_SIZE - 1) >> SECTION_SHIFT
+        self._sections_y = (height + SECTION_SIZE - 1) >> SECTION_SHIFT
+        self._dirty_sections = set()
+
+        self._level_stream_changes = {}
+        self._level_stream_lock = threading.Lock()
+
+    def _as_array(self, blocks):
+        return numpy.frombuffer(blocks, dtype=numpy.uint8).reshape((self.height, self.depth, self.width))
+
+    def _generate(self, generator, seed):
+        if generator not in GENERATORS:
+            raise ValueError("Unknown world generator: %s" % generator)
+
+        logging.info("Generating a %dx%dx%d world with the %s generator..." % (self.width, self.height, self.depth,
+                                                                              generator))
+        blocks = GENERATORS[generator](self.width, self.height, self.depth, seed)
         logging.info("World generation done.")
         return blocks
 
+    def _box(self, x1, y1, z1, x2, y2, z2):
+        # Clips the box between two corners (inclusive, in any order) to the world and makes it a half-open range
+        return (max(min(x1, x2), 0), max(min(y1, y2), 0), max(min(z1, z2), 0),
+                min(max(x1, x2) + 1, self.width), min(max(y1, y2) + 1, self.height), min(max(z1, z2) + 1, self.depth))
+
+    def _rows(self, x1, y1, z1, x2, y2, z2):
+        # Yields the Y and Z coordinates and the (start, end) offsets of the rows along the X axis in a clipped box
+        for y in range(y1, y2):
+            for z in range(z1, z2):
+                start = x1 + self.width * (z + self.depth * y)
+                yield y, z, start, start + x2 - x1
+
+    def fill(self, x1, y1, z1, x2, y2, z2, block):
+        """
+        Fills the box between two corners with a block.
+        """
+        x1, y1, z1, x2, y2, z2 = self._box(x1, y1, z1, x2, y2, z2)
+        if x1 >= x2 or y1 >= y2 or z1 >= z2:
+            return
+
+        if self.array is not None:
+            self.array[y1:y2, z1:z2, x1:x2] = block
+        else:
+            row = bytes((block,)) * (x2 - x1)
+            for _, _, start, end in self._rows(x1, y1, z1, x2, y2, z2):
+                self.blocks[start:end] = row
+
+        self._invalidate(x1, y1, z1, x2, y2, z2)
+
+    def replace(self, x1, y1, z1, x2, y2, z2, old_block, new_block):
+        """
+        Replaces one block type with another in the box between two corners.
+        """
+        x1, y1, z1, x2, y2, z2 = self._box(x1, y1, z1, x2, y2, z2)
+        if x1 >= x2 or y1 >= y2 or z1 >= z2:
+            return
+
+        if self.array is not None:
+            box = self.array[y1:y2, z1:z2, x1:x2]
+            box[box == old_block] = new_block
+        else:
+            table = bytearray(range(256))
+            table[old_block] = new_block
+            for _, _, start, end in self._rows(x1, y1, z1, x2, y2, z2):
+                self.blocks[start:end] = self.blocks[start:end].translate(table)
+
+        self._invalidate(x1, y1, z1, x2, y2, z2)
+
+    def count_blocks(self, x1=0, y1=0, z1=0, x2=None, y2=None, z2=None):
+        """
+        Counts the blocks of every type in the box between two corners, the whole world by default.
+
+        :return: The block counts by block type, types which don't occur are left out.
+        :rtype: dict
+        """
+        x1, y1, z1, x2, y2, z2 = self._box(x1, y1, z1, self.width - 1 if x2 is None else x2,
+                                           self.height - 1 if y2 is None else y2, self.depth - 1 if z2 is None else z2)
+        if x1 >= x2 or y1 >= y2 or z1 >= z2:
+            return {}
+
+        if self.array is not None:
+            counts = numpy.bincount(self.array[y1:y2, z1:z2, x1:x2].ravel(), minlength=256)
+            return dict((int(block), int(counts[block])) for block in numpy.flatnonzero(counts))
+
+        counter = collections.Counter()
+        for _, _, start, end in self._rows(x1, y1, z1, x2, y2, z2):
+            counter.update(self.blocks[start:end])
+        return dict(counter)
+
+    def copy(self, x1, y1, z1, x2, y2, z2):
+        """
+        Copies the box between two corners.
+
+        :return: The (width, height, depth) of the copied box and its blocks in the same order as the world's blocks.
+        :rtype: tuple
+        """
+        x1, y1, z1, x2, y2, z2 = self._box(x1, y1, z1, x2, y2, z2)
+        dimensions = (max(x2 - x1, 0), max(y2 - y1, 0), max(z2 - z1, 0))
+
+        if self.array is not None:
+            return dimensions, self.array[y1:y2, z1:z2, x1:x2].tobytes()
+
+        return dimensions, b"".join(self.blocks[start:end] for _, _, start, end in self._rows(x1, y1, z1, x2, y2, z2))
+
+    def paste(self, x, y, z, box):
+        """
+        Pastes a box made by copy() with its lowest corner at the given coordinates, clipped to the world.
+        """
+        (width, height, depth), data = box
+        x1, y1, z1, x2, y2, z2 = self._box(x, y, z, x + width - 1, y + height - 1, z + depth - 1)
+        if x1 >= x2 or y1 >= y2 or z1 >= z2:
+            return
+
+        if self.array is not None:
+            source = numpy.frombuffer(data, dtype=numpy.uint8).reshape((height, depth, width))
+            self.array[y1:y2, z1:z2, x1:x2] = source[y1 - y:y2 - y, z1 - z:z2 - z, x1 - x:x2 - x]
+        else:
+            for row_y, row_z, start, end in self._rows(x1, y1, z1, x2, y2, z2):
+                offset = (x1 - x) + width * ((row_z - z) + depth * (row_y - y))
+                self.blocks[start:end] = data[offset:offset + end - start]
+
+        self._invalidate(x1, y1, z1, x2, y2, z2)
+
+    def _invalidate(self, x1, y1, z1, x2, y2, z2):
+        # Bulk changes aren't tracked per block, so the level stream has to be rebuilt for the next join
+        self._generation += 1
+        self._bulk_generation = self._generation
+
+        for section_y in range(y1 >> SECTION_SHIFT, ((y2 - 1) >> SECTION_SHIFT) + 1):
+            for section_z in range(z1 >> SECTION_SHIFT, ((z2 - 1) >> SECTION_SHIFT) + 1):
+                row = self._sections_x * (section_z + self._sections_z * section_y)
+                self._dirty_sections.update(range(row + (x1 >> SECTION_SHIFT), row + ((x2 - 1) >> SECTION_SHIFT) + 1))
+
+    def get_section_count(self):
+        return self._sections_x * self._sections_y * self._sections_z
+
+    def get_section_box(self, index):
+        """
+        Gets the box covered by a section.
+
+        :param index: The section index.
+        :type index: int
+        :return: The lowest corner of the box (inclusive) and the highest corner (exclusive).
+        :rtype: tuple
+        """
+        index, section_x = divmod(index, self._sections_x)
+        section_y, section_z = divmod(index, self._sections_z)
+        x1, y1, z1 = section_x << SECTION_SHIFT, section_y << SECTION_SHIFT, section_z << SECTION_SHIFT
+        return (x1, y1, z1, min(x1 + SECTION_SIZE, self.width), min(y1 + SECTION_SIZE, self.height),
+                min(z1 + SECTION_SIZE, self.depth))
+
+    def get_section(self, index):
+        """
+        Copies the blocks of a section.
+
+        :param index: The section index.
+        :type index: int
+        :return: The blocks in the same order as the world's blocks.
+        :rtype: bytes
+        """
+        x1, y1, z1, x2, y2, z2 = self.get_section_box(index)
+        return self.copy(x1, y1, z1, x2 - 1, y2 - 1, z2 - 1)[1]
+
+    def set_section(self, index, data):
+        x1, y1, z1, x2, y2, z2 = self.get_section_box(index)
+        self.paste(x1, y1, z1, ((x2 - x1, y2 - y1, z2 - z1), data))
+
+    def take_dirty_sections(self):
+        """
+        Gets the indexes of the sections changed since the last call and starts tracking the changes anew.
+
+        :rtype: set
+        """
+        dirty, self._dirty_sections = self._dirty_sections, set()
+        return dirty
+
+    def mark_dirty_sections(self, sections):
+        self._dirty_sections.update(sections)
+
+    def contains(self, x, y, z):
+        return 0 <= x < self.width and 0 <= y < self.height and 0 <= z < self.depth
+
     def get_block(self, x, y, z):
-        return self.blocks[x + WORLD_DEPTH * (z + WORLD_WIDTH * y)]
+        return self.blocks[x + self.width * (z + self.depth * y)]
 
     def set_block(self, x, y, z, block):
-        self.blocks[x + WORLD_DEPTH * (z + WORLD_WIDTH * y)] = block
+        self.blocks[x + self.width * (z + self.depth * y)] = block
+        self._generation += 1
+        self._dirty_sections.add((x >> SECTION_SHIFT) + self._sections_x * ((z >> SECTION_SHIFT) +
+                                                                           self._sections_z * (y >> SECTION_SHIFT)))
+        self._level_stream_changes[(x, y, z)] = block
+        if self._level_stream_build_changes is not None:
+            self._level_stream_build_changes[(x, y, z)] = block
+        self._limit_level_stream_changes()
+
+    def _limit_level_stream_changes(self):
+        max_changes = len(self.blocks) * self.LEVEL_STREAM_MAX_CHANGES
+        if len(self._level_stream_changes) > max_changes:
+            with self._level_stream_lock:
+                self._level_stream = None
+                self._level_stream_changes = {}
+
+        if self._level_stream_build_changes is not None and len(self._level_stream_build_changes) > max_changes:
+            # The stream being built is out of date before it's done
+            self._level_stream_build_generation = -1
+            self._level_stream_build_changes = {}
+
+    def set_blocks(self, changes):
+        """
+        Sets a batch of blocks, the blocks which already have their new type are left alone.
+
+        :param changes: The (x, y, z, block) tuples of the changes, the coordinates must be within the world.
+        :type changes: list
+        :return: The previous block of every change.
+        :rtype: list
+        """
+        blocks = self.blocks
+        old_blocks = []
+
+        for x, y, z, block in changes:
+            index = x + self.width * (z + self.depth * y)
+            old_block = blocks[index]
+            old_blocks.append(old_block)
+
+            if old_block != block:
+                blocks[index] = block
+                self._dirty_sections.add((x >> SECTION_SHIFT) + self._sections_x * (
+                    (z >> SECTION_SHIFT) + self._sections_z * (y >> SECTION_SHIFT)))
+                self._level_stream_changes[(x, y, z)] = block
+                if self._level_stream_build_changes is not None:
+                    self._level_stream_build_changes[(x, y, z)] = block
+
+        if changes:
+            self._generation += 1
+            self._limit_level_stream_changes()
+
+        return old_blocks
+
+    def get_spawn(self):
+        """
+        Gets the spawn point, on top of the highest block in the middle of the world.
+
+        :return: The spawn coordinates.
+        :rtype: list
+        """
+        x, z = self.width // 2 - 1, self.depth // 2 - 1
+        y = self.height - 1
+        while y > 0 and self.get_block(x, y, z) == 0:
+            y -= 1
+
+        return [float(x), float(y + 3), float(z)]
+
+    def flush(self):
+        """
+        Writes the changes to the blocks to the disk, if they're mapped from a file.
+        """
+        if hasattr(self.blocks, "flush"):
+            self.blocks.flush()
+
+    def close(self):
+        """
+        Releases the blocks, if they're mapped from a file the world can't be used anymore afterwards.
+        """
+        if hasattr(self.blocks, "close"):
+            # The NumPy view has to go first, the mapping can't be closed while it's exported
+            self.array = None
+            self.blocks.flush()
+            self.blocks.close()
 
     def encode(self):
-        return gzip.compress(struct.pack("!I", len(self.blocks)) + bytes(self.blocks))
+        return self.encoder.encode(self.encode_level())
+
+    def snapshot(self):
+        """
+        Takes a copy of the world which isn't affected by further changes.
+
+        :return: The width, height, depth and a copy of the blocks.
+        :rtype: tuple
+        """
+        return self.width, self.height, self.depth, bytes(self.blocks)
+
+    def to_save(self):
+        """
+        Encodes the world with its dimensions for saving.
+
+        :return: The gzipped save data.
+        :rtype: bytes
+        """
+        return World.encode_save(*self.snapshot())
+
+    @staticmethod
+    def encode_save(width, height, depth, blocks):
+        return gzip.compress(SAVE_HEADER.pack(SAVE_MAGIC, width, height, depth) + blocks)
+
+    def _is_level_stream_usable(self):
+        # Single block changes are patched up, bulk changes aren't tracked per block
+        return self._level_stream is not None and self._level_stream_generation >= self._bulk_generation
+
+    def prepare_level_stream(self, executor):
+        """
+        Makes sure there's a level stream to send to joining players, building it in the background if needed. The
+        blocks are copied right away, so the stream is built from the world as it is now, and the blocks changed
+        meanwhile are tracked to patch it up. To be called on the tick, which calls it again once the future has
+        completed to take the built stream.
+
+        The LevelInitialize, LevelDataChunk and LevelFinalize packets are built once and shared by all the joining
+        players. After block changes, the stream is rebuilt at most once per LEVEL_STREAM_INTERVAL seconds, until then
+        the blocks changed since it was built are sent as BlockUpdate packets after it.
+
+        :param executor: The executor the stream is built on.
+        :type executor: concurrent.futures.Executor
+        :return: None if the stream can be sent right away, otherwise the future of the stream being built.
+        :rtype: concurrent.futures.Future
+        """
+        self._finish_level_stream()
+
+        usable = self._is_level_stream_usable()
+        if usable and (self._level_stream_generation == self._generation or
+                       time.time() - self._level_stream_time < self.LEVEL_STREAM_INTERVAL):
+            return None
+
+        if self._level_stream_build is None:
+            data = self.encode_level()
+            self._level_stream_build_generation = self._generation
+            self._level_stream_build_changes = {}
+            self._level_stream_build = executor.submit(self._build_level_stream, data)
+
+        # An older stream which is only out of date by single block changes is sent meanwhile
+        return None if usable else self._level_stream_build
+
+    def _finish_level_stream(self):
+        # Takes the level stream built in the background once it's done
+        future = self._level_stream_build
+        if future is None or not future.done():
+            return
+
+        self._level_stream_build = None
+        changes, self._level_stream_build_changes = self._level_stream_build_changes, None
+
+        try:
+            stream = future.result()
+        except Exception as ex:
+            logging.error("Building the level stream failed: %s" % repr(ex))
+            return
+
+        with self._level_stream_lock:
+            self._level_stream = stream
+            self._level_stream_generation = self._level_stream_build_generation
+            self._level_stream_changes = changes
+            self._level_stream_time = time.time()
+
+    def get_level_stream(self):
+        """
+        Gets the encoded level packets sent to a joining player, see prepare_level_stream(). The stream is built right
+        away if there's no usable one, which takes a while, so the tick prepares it first.
+
+        :return: The encoded packets.
+        :rtype: bytes
+        """
+        with self._level_stream_lock:
+            if not self._is_level_stream_usable():
+                self._level_stream_changes = {}
+                self._level_stream_generation = self._generation
+                self._level_stream = self._build_level_stream(self.encode_level())
+                self._level_stream_time = time.time()
+
+            changes = list(self._level_stream_changes.items())
+
+        if not changes:
+            return self._level_stream
+
+        return self._level_stream + b"".join(BlockUpdatePacket.make({
+            "x": x,
+            "y": y,
+            "z": z,
+            "block_type": block
+        }) for (x, y, z), block in changes)
+
+    def get_level_stream_size(self):
+        """
+        Gets the size of the level stream as last built, or of the one being built once it's done. It's a good
+        estimate of the cost of sending the level even if the world has changed since.
+
+        :return: The size, None if no stream has been built yet.
+        :rtype: int
+        """
+        level_stream = self._level_stream
+        build = self._level_stream_build
+        if level_stream is None and build is not None and build.done() and not build.exception():
+            level_stream = build.result()
+        return len(level_stream) if level_stream is not None else None
+
+    def iter_level_stream(self):
+        """
+        Gets the packets of the level stream one LevelDataChunk packet at a time, so it can be sent progressively. The
+        stream is taken right away, the blocks changed afterwards have to be sent after it.
+
+        :return: An iterator of the encoded packets.
+        """
+        return self._iter_packets(self.get_level_stream())
+
+    @staticmethod
+    def _iter_packets(stream):
+        offset = LevelInitializePacket.SIZE
+        yield stream[:offset]
+
+        while stream[offset] == LevelDataChunkPacket.ID:
+            yield stream[offset:offset + LevelDataChunkPacket.SIZE]
+            offset += LevelDataChunkPacket.SIZE
+
+        # LevelFinalize and the changes since the stream was built
+        yield stream[offset:]
+
+    def encode_level(self):
+        # The level data as sent to the clients before it's gzipped, the block count followed by the blocks
+        return struct.pack("!I", len(self.blocks)) + bytes(self.blocks)
+
+    def _build_level_stream(self, data):
+        chunk = self.encoder.encode(data)
+        count = (len(chunk) + 1023) // 1024
+
+        stream = bytearray(LevelInitializePacket.SIZE + count * LevelDataChunkPacket.SIZE + LevelFinalizePacket.SIZE)
+        offset = LevelInitializePacket.pack_into(stream, 0)
+
+        for index in range(count):
+            part = chunk[index * 1024: (index + 1) * 1024]
+            offset = LevelDataChunkPacket.pack_into(stream, offset, {
+                "chunk_length": len(part),
+                "chunk": part,
+                "percent": (index + 1) * 100 // count
+            })
+
+        LevelFinalizePacket.pack_into(stream, offset, {
+            "x": self.width,
+            "y": self.height,
+            "z": self.depth
+        })
+
+        return bytes(stream)
+
+    @staticmethod
+    def from_sections(width, height, depth, sections):
+        """
+        Creates a world from its sections.
+
+        :param sections: The blocks of every section, ordered by section index.
+        :type sections: list
+        """
+        world = World(bytearray(width * height * depth), width, height, depth)
+        for index, section in enumerate(sections):
+            world.set_section(index, section)
+
+        world.take_dirty_sections()
+        return world
 
     @staticmethod
     def from_save(data):
-        return World(bytearray(gzip.decompress(data)[4:]))
+        if data[:len(SECTION_MAGIC)] == SECTION_MAGIC:
+            width, height, depth, section_size, sections = read_sections(data)
+            if section_size != SECTION_SIZE:
+                raise ValueError("Unsupported section size: %d" % section_size)
+            return World.from_sections(width, height, depth, sections)
+
+        data = gzip.decompress(data)
+
+        if data[:len(SAVE_MAGIC)] != SAVE_MAGIC:
+            return World(bytearray(data[4:]))
+
+        _, width, height, depth = SAVE_HEADER.unpack_from(data)
+        return World(bytearray(data[SAVE_HEADER.size:]), width, height, depth)
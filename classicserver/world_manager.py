@@ -0,0 +1,431 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+
+from classicserver.history import BlockHistory, FILE_RECORDS, MEMORY_RECORDS
+from classicserver.journal import BlockJournal
+from classicserver.level_encoder import LevelEncoder
+from classicserver.saver import WorldSaver
+from classicserver.world import World, WORLD_WIDTH, WORLD_HEIGHT, WORLD_DEPTH
+
+# The world players join, saved in the save file from the config
+MAIN_WORLD = "main"
+
+WORLD_NAME = re.compile(r"^[A-Za-z0-9_]{1,32}$")
+
+
+class Level(object):
+    """
+    A named world with its save file, which is only held in memory while it's loaded.
+    """
+
+    name = ""
+    world = None
+    history = None
+    last_used = 0
+    # When the level started being unloaded, 0 if it isn't being unloaded
+    unload_started = 0
+
+    _path = None
+    _save_config = None
+    _world_config = None
+    _saver = None
+    _journal = None
+    _encoder = None
+    _schedule = None
+
+    def __init__(self, name, path, save_config, world_config, encoder, schedule=None):
+        """
+        Creates a level, it isn't loaded until load() is called.
+
+        :param name: The name of the level.
+        :type name: str
+        :param path: The path of the save file.
+        :type path: str
+        :param save_config: The save section of the config.
+        :type save_config: dict
+        :param world_config: The world section of the config, used to generate the world if there's no save.
+        :type world_config: dict
+        :param encoder: The encoder of the level data sent to joining players.
+        :type encoder: LevelEncoder
+        :param schedule: A function taking a function to call on the tick, see WorldSaver.
+        """
+        self.name = name
+        self._path = path
+        self._save_config = save_config
+        self._world_config = world_config
+        self._encoder = encoder
+        self._schedule = schedule
+
+    def is_loaded(self):
+        return self.world is not None
+
+    def get_size(self):
+        """
+        Gets the amount of memory taken by the blocks of the world when it's loaded.
+
+        :rtype: int
+        """
+        if not self.world:
+            return 0
+        return self.world.width * self.world.height * self.world.depth
+
+    def load(self):
+        """
+        Loads the world from the save file, or generates it if there's no save file yet, then replays the journal.
+        """
+        if self.world:
+            return
+
+        journal = None
+        saver = None
+
+        try:
+            if self._save_config.get("journal", True):
+                journal = BlockJournal(self._path + ".journal")
+            saver = WorldSaver(self._path, self._save_config.get("format", "gzip"), journal, self._schedule)
+
+            world = self._read_world(saver)
+
+            if journal:
+                count = journal.replay(world, saver.get_saved_sequence())
+                if count:
+                    logging.info("Replayed %d block changes from the journal of the world %s" % (count, self.name))
+        except BaseException:
+            # A save which can't be read is left alone, without keeping the journal's thread and file open
+            if saver:
+                saver.shutdown()
+            if journal:
+                journal.close()
+            raise
+
+        if self._save_config.get("history", True):
+            self.history = BlockHistory(self._path + ".history",
+                                        self._save_config.get("history_memory_records", MEMORY_RECORDS),
+                                        self._save_config.get("history_file_records", FILE_RECORDS))
+
+        self._journal = journal
+        self._saver = saver
+        world.encoder = self._encoder
+        self.world = world
+        self.last_used = time.time()
+
+    def _read_world(self, saver):
+        world = None
+
+        if saver.is_mapped():
+            # Mapping the save only reads the pages which are used, on demand
+            world = saver.map_world()
+            logging.info("Loaded the %dx%dx%d world %s" % (world.width, world.height, world.depth, self.name))
+            return world
+
+        try:
+            save = open(self._path, "rb").read()
+            world = World.from_save(save)
+            logging.info("Loaded the %dx%dx%d world %s" % (world.width, world.height, world.depth, self.name))
+        except FileNotFoundError:
+            logging.info("Save file of the world %s not found, creating a new one" % self.name)
+        except Exception as ex:
+            # A new world would overwrite the save with the next save, so the level isn't loaded until it's fixed
+            logging.error("The save file %s of the world %s can't be read, move it aside to start the world over: %s"
+                          % (self._path, self.name, repr(ex)))
+            raise
+
+        if not world:
+            world = World(
+                width=self._world_config.get("width", WORLD_WIDTH),
+                height=self._world_config.get("height", WORLD_HEIGHT),
+                depth=self._world_config.get("depth", WORLD_DEPTH),
+                generator=self._world_config.get("generator", "flat"),
+                seed=self._world_config.get("seed")
+            )
+
+        return saver.map_world(world)
+
+    def save(self):
+        """
+        Saves the world in the background.
+
+        :return: A future completing when the save has been written.
+        :rtype: concurrent.futures.Future
+        """
+        return self._saver.save(self.world)
+
+    def unload(self):
+        """
+        Saves the world a last time and releases it, after which the journal has nothing left to protect. The block
+        history is moved to its files. Only called once the tick has stopped.
+        """
+        if not self.world:
+            return
+
+        self._saver.save_and_wait(self.world)
+        self.detach()()
+
+    def detach(self):
+        """
+        Takes the world out of the level once its last save is complete, so the level counts as unloaded.
+
+        :return: A function releasing the world, its saver, journal and history, which takes a while and can be called
+                 on any thread.
+        """
+        world, saver, journal, history = self.world, self._saver, self._journal, self.history
+        self.world = None
+        self.history = None
+        self._saver = None
+        self._journal = None
+
+        def release():
+            saver.shutdown()
+            world.close()
+
+            if journal:
+                journal.close()
+
+            if history:
+                history.close()
+
+            logging.info("Unloaded the world %s" % self.name)
+
+        return release
+
+    def record_block(self, x, y, z, old_block, new_block, player_id, player_name):
+        """
+        Records a block change in the journal, so it survives a crash before the next save, and in the block history.
+        """
+        if self._journal:
+            self._journal.append(x, y, z, old_block, new_block, player_id)
+
+        if self.history:
+            self.history.record(player_name, x, y, z, old_block, new_block)
+
+
+class WorldManager(object):
+    """
+    Holds the levels of the server. Levels are loaded on first use, and the least recently used levels nobody is in
+    are unloaded when the loaded worlds take more memory than the budget.
+
+    Levels are loaded and released on the manager's own thread, one at a time, so a level is never loaded again
+    while it's still being released.
+    """
+
+    _levels = None
+    _directory = None
+    _save_config = None
+    _world_config = None
+    _memory_budget = 0
+    _encoder = None
+    _schedule = None
+    _lock = None
+    _executor = None
+    # The futures of the levels being loaded, by name
+    _loading = None
+
+    def __init__(self, save_config, world_config, worlds_config, schedule=None):
+        """
+        Creates a world manager
+
+        :param save_config: The save section of the config, its file is the save of the main world.
+        :type save_config: dict
+        :param world_config: The world section of the config, used to generate new worlds.
+        :type world_config: dict
+        :param worlds_config: The worlds section of the config.
+        :type worlds_config: dict
+        :param schedule: A function taking a function to call on the tick, see WorldSaver.
+        """
+        self._save_config = save_config
+        self._world_config = world_config
+        self._directory = worlds_config.get("directory", "worlds")
+        self._memory_budget = worlds_config.get("memory_budget", 64) * 1024 * 1024
+        self._encoder = LevelEncoder(world_config.get("compression_level", 6), world_config.get("compression_threads"))
+        self._schedule = schedule
+        self._lock = threading.RLock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._loading = {}
+
+        self._levels = {MAIN_WORLD: Level(MAIN_WORLD, save_config["file"], save_config, world_config, self._encoder,
+                                          schedule)}
+
+        # Worlds listed in the config are generated with their own settings on first use
+        for name, level_config in worlds_config.get("levels", {}).items():
+            self._add_level(name, dict(world_config, **level_config))
+
+        if os.path.isdir(self._directory):
+            for file_name in os.listdir(self._directory):
+                name, extension = os.path.splitext(file_name)
+                if extension == ".dat":
+                    self._add_level(name, world_config)
+
+    def _add_level(self, name, world_config):
+        if name in self._levels:
+            return
+
+        if not WORLD_NAME.match(name):
+            logging.warning("Ignoring the world %s, the name may only contain letters, digits and underscores" % name)
+            return
+
+        self._levels[name] = Level(name, os.path.join(self._directory, name + ".dat"), self._save_config,
+                                   world_config, self._encoder, self._schedule)
+
+    def get(self, name):
+        """
+        Gets a loaded level, never waiting for a level to load, as it's called on the tick. The levels with players in
+        them are always loaded, the others are loaded with load() first.
+
+        :param name: The name of the level.
+        :type name: str
+        :return: The loaded level, None if there's no level with the name or it isn't loaded.
+        :rtype: Level
+        """
+        with self._lock:
+            level = self._levels.get(name)
+            if not level or not level.is_loaded():
+                return None
+
+        level.last_used = time.time()
+        return level
+
+    def load(self, name):
+        """
+        Loads a level in the background.
+
+        :param name: The name of the level.
+        :type name: str
+        :return: A future resolving to the loaded level, None if there's no level with the name.
+        :rtype: concurrent.futures.Future
+        """
+        with self._lock:
+            level = self._levels.get(name)
+            if not level:
+                return None
+
+            future = self._loading.get(name)
+            if future:
+                return future
+
+            if level.is_loaded():
+                future = concurrent.futures.Future()
+                future.set_result(level)
+                return future
+
+            future = self._loading[name] = self._executor.submit(self._load, level)
+            return future
+
+    def _load(self, level):
+        try:
+            if level.name != MAIN_WORLD:
+                os.makedirs(self._directory, exist_ok=True)
+            level.load()
+            return level
+        finally:
+            with self._lock:
+                self._loading.pop(level.name, None)
+
+    def get_names(self):
+        return sorted(self._levels)
+
+    def get_loaded(self):
+        with self._lock:
+            return [level for level in self._levels.values() if level.is_loaded()]
+
+    def touch(self, names):
+        """
+        Marks levels as used, e.g. because there are players in them.
+
+        :type names: set
+        """
+        now = time.time()
+        with self._lock:
+            for name in names:
+                if name in self._levels:
+                    self._levels[name].last_used = now
+
+    def unload_idle(self, in_use):
+        """
+        Starts unloading the least recently used levels until the loaded worlds fit in the memory budget. The main
+        world and the levels in use are kept. A level is saved first, it's released by release() once saved.
+
+        :param in_use: The names of the levels which have players in them.
+        :type in_use: set
+        :return: The (level, future of its last save) tuples of the levels being unloaded.
+        :rtype: list
+        """
+        unloading = []
+
+        with self._lock:
+            loaded = [level for level in self.get_loaded() if not level.unload_started]
+            total = sum(level.get_size() for level in loaded)
+
+            candidates = [level for level in loaded if level.name != MAIN_WORLD and level.name not in in_use]
+            for level in sorted(candidates, key=lambda candidate: candidate.last_used):
+                if total <= self._memory_budget:
+                    break
+
+                total -= level.get_size()
+                try:
+                    level.unload_started = time.time()
+                    unloading.append((level, level.save()))
+                except BaseException as ex:
+                    level.unload_started = 0
+                    logging.error("Unloading the world %s failed: %s" % (level.name, repr(ex)))
+                    logging.debug(traceback.format_exc())
+
+        return unloading
+
+    def release(self, level):
+        """
+        Releases the world of a level being unloaded once its last save is complete, in the background. The level is
+        kept loaded if it's been used since it started being unloaded.
+
+        :type level: Level
+        :return: Whether the level has been unloaded.
+        :rtype: bool
+        """
+        with self._lock:
+            started, level.unload_started = level.unload_started, 0
+            if not level.is_loaded() or level.last_used > started:
+                return False
+
+            self._executor.submit(self._release, level.name, level.detach())
+            return True
+
+    @staticmethod
+    def _release(name, release):
+        try:
+            release()
+        except BaseException as ex:
+            logging.error("Unloading the world %s failed: %s" % (name, repr(ex)))
+            logging.debug(traceback.format_exc())
+
+    def close(self):
+        """
+        Unloads every level.
+        """
+        with self._lock:
+            for level in self.get_loaded():
+                level.unload()
+
+        self._executor.shutdown(wait=True)
+        self._encoder.shutdown()
@@ -0,0 +1,77 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from classicserver.block_queue import BlockQueue
+from classicserver.world import World
+
+
+class BlockQueueTest(unittest.TestCase):
+    def test_last_change_wins(self):
+        queue = BlockQueue()
+        queue.queue("main", 1, 2, 3, 1, 0, "alice")
+        queue.queue("main", 4, 5, 6, 2, 0, "alice")
+        queue.queue("main", 1, 2, 3, 5, 1, "bob")
+        self.assertEqual(len(queue), 3)
+
+        changes, count = queue.take()
+        self.assertEqual(count, 3)
+        # A block keeps the place of its first change
+        self.assertEqual(list(changes["main"].items()), [((1, 2, 3), (5, 1, "bob")), ((4, 5, 6), (2, 0, "alice"))])
+
+    def test_worlds_apart(self):
+        queue = BlockQueue()
+        queue.queue("main", 1, 2, 3, 1, 0, "alice")
+        queue.queue("build", 1, 2, 3, 4, 1, "bob")
+
+        changes, _ = queue.take()
+        self.assertEqual(changes["main"][(1, 2, 3)], (1, 0, "alice"))
+        self.assertEqual(changes["build"][(1, 2, 3)], (4, 1, "bob"))
+
+    def test_take_empties(self):
+        queue = BlockQueue()
+        queue.queue("main", 1, 2, 3, 1, 0, "alice")
+        queue.take()
+
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.take(), ({}, 0))
+
+    def test_break_then_place(self):
+        # Breaking a block and placing the same type again in a tick collapses into no change of the world
+        world = World(width=16, height=16, depth=16, generator="flat")
+        block = world.get_block(3, 2, 3)
+        queue = BlockQueue()
+        queue.queue("main", 3, 2, 3, 0, 0, "alice")
+        queue.queue("main", 3, 2, 3, block, 0, "alice")
+        queue.queue("main", 4, 12, 4, 1, 0, "alice")
+        queue.queue("main", 4, 12, 4, 0, 0, "alice")
+
+        changes, count = queue.take()
+        self.assertEqual(count, 4)
+        self.assertEqual(list(changes["main"]), [(3, 2, 3), (4, 12, 4)])
+
+        world.take_dirty_sections()
+        old_blocks = world.set_blocks([(x, y, z, new_block)
+                                       for (x, y, z), (new_block, _, _) in changes["main"].items()])
+        self.assertEqual(old_blocks, [block, 0])
+        self.assertEqual(world.take_dirty_sections(), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from classicserver.packet.framer import FramingError, PacketFramer
+from classicserver.packet.packet import MessagePacket, SetBlockPacket
+
+
+class PacketFramerTest(unittest.TestCase):
+    def setUp(self):
+        self.framer = PacketFramer()
+        self.set_block = SetBlockPacket.make({"x": 1, "y": 2, "z": 3, "mode": 1, "block_type": 4})
+        self.message = MessagePacket.make({"player_id": 255, "message": "hello"})
+
+    def test_whole_packets(self):
+        self.framer.feed(self.set_block + self.message)
+        self.assertEqual(list(self.framer.frames()), [self.set_block, self.message])
+        self.assertEqual(self.framer.pending(), 0)
+
+    def test_split_packet(self):
+        data = self.set_block + self.message
+        split = len(self.set_block) + 10
+
+        self.framer.feed(data[:split])
+        self.assertEqual(list(self.framer.frames()), [self.set_block])
+        self.assertEqual(self.framer.pending(), 10)
+
+        self.framer.feed(data[split:])
+        self.assertEqual(list(self.framer.frames()), [self.message])
+        self.assertEqual(self.framer.pending(), 0)
+
+    def test_byte_by_byte(self):
+        frames = []
+        for byte in self.message:
+            self.framer.feed(bytes((byte,)))
+            frames.extend(self.framer.frames())
+        self.assertEqual(frames, [self.message])
+
+    def test_unknown_id(self):
+        self.framer.feed(self.set_block + b"\x42" + self.message)
+        frames = self.framer.frames()
+        self.assertEqual(next(frames), self.set_block)
+        self.assertRaises(FramingError, next, frames)
+
+    def test_compaction(self):
+        count = PacketFramer.COMPACT_THRESHOLD // len(self.set_block) + 1
+        self.framer.feed(self.set_block * count + self.set_block[:3])
+        self.assertEqual(len(list(self.framer.frames())), count)
+        self.assertEqual(self.framer.pending(), 3)
+
+        self.framer.feed(self.set_block[3:])
+        self.assertEqual(list(self.framer.frames()), [self.set_block])
+
+
+if __name__ == "__main__":
+    unittest.main()
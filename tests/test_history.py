@@ -0,0 +1,146 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from classicserver.history import MAX_EDITS, BlockHistory
+
+
+class BlockHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.histories = []
+
+    def tearDown(self):
+        for history in self.histories:
+            history.close()
+        shutil.rmtree(self.directory)
+
+    def open(self, *args):
+        history = BlockHistory(self.directory, *args)
+        self.histories.append(history)
+        return history
+
+    def close(self, history):
+        self.histories.remove(history)
+        history.close()
+
+    def test_changes(self):
+        history = self.open(4)
+        for x in range(10):
+            history.record("bob", x, 1, 2, 0, 1, 100 + x)
+        history.record("alice", 3, 1, 2, 1, 4, 200)
+
+        self.assertEqual(len(history.get_changes("bob").result()), 10)
+        self.assertEqual([change[0] for change in history.get_changes("bob", 105).result()], [5, 6, 7, 8, 9])
+        self.assertEqual(history.get_changes("carol").result(), [])
+        self.assertEqual(history.get_block_changes(3, 1, 2).result(), [(103, "bob", 0, 1), (200, "alice", 1, 4)])
+        self.assertEqual(history.get_block_changes(3, 1, 3).result(), [])
+
+    def test_reload(self):
+        history = self.open(4)
+        for x in range(10):
+            history.record("bob", x, 1, 2, 0, 1, 100 + x)
+        history.record("éve", 40, 1, 2, 0, 3, 200)
+        self.close(history)
+
+        history = self.open(4)
+        self.assertEqual(len(history.get_changes("bob").result()), 10)
+        self.assertEqual(history.get_block_changes(40, 1, 2).result(), [(200, "éve", 0, 3)])
+
+        history.record("bob", 40, 1, 2, 3, 0, 300)
+        self.assertEqual(history.get_block_changes(40, 1, 2).result(), [(200, "éve", 0, 3), (300, "bob", 3, 0)])
+
+    def test_rotation(self):
+        history = self.open(2, 4)
+        for x in range(16):
+            history.record("bob", x, 1, 2, 0, 1, 100 + x)
+        self.close(history)
+
+        # At most two files are kept, the oldest changes are forgotten along with their sections
+        self.assertLessEqual(len(os.listdir(self.directory)), 2)
+        history = self.open(2, 4)
+        changes = history.get_changes("bob").result()
+        self.assertLess(len(changes), 16)
+        self.assertEqual(changes[-1][0], 15)
+        self.assertEqual(history.get_block_changes(0, 1, 2).result(), [])
+        self.assertEqual(history.get_block_changes(15, 1, 2).result(), [(115, "bob", 0, 1)])
+        self.close(history)
+
+        self.assertEqual(self.open(2, 4).get_changes("bob").result(), changes)
+
+    def test_torn_record(self):
+        history = self.open()
+        history.record("bob", 1, 1, 1, 0, 1, 100)
+        history.record("bob", 2, 1, 1, 0, 1, 101)
+        self.close(history)
+
+        path = os.path.join(self.directory, "bob.log")
+        with open(path, "r+b") as log_file:
+            log_file.truncate(os.path.getsize(path) - 1)
+
+        self.assertEqual(self.open().get_changes("bob").result(), [(1, 1, 1, 0, 1, 100)])
+
+    def test_clock_set_back(self):
+        history = self.open(2)
+        history.record("bob", 1, 1, 1, 0, 1, 200)
+        history.record("bob", 2, 1, 1, 0, 1, 100)
+        history.record("alice", 3, 1, 1, 0, 1, 150)
+
+        # The changes count as made when the latest change was, so the logs stay in order
+        self.assertEqual([change[0] for change in history.get_changes("bob", 150).result()], [1, 2])
+        self.assertEqual(history.get_block_changes(2, 1, 1).result(), [(200, "bob", 0, 1)])
+        self.assertEqual(history.get_changes("alice", 200).result(), [(3, 1, 1, 0, 1, 200)])
+
+        # The clock doesn't go back to before the recorded changes either, even in the next run
+        future = int(time.time()) + 3600
+        history.record("bob", 3, 1, 1, 0, 1, future)
+        self.close(history)
+        self.assertGreaterEqual(self.open().get_time(), future)
+
+    def test_edits(self):
+        history = self.open()
+        history.record("bob", 5, 5, 5, 0, 1, 100)
+        history.record_edit("alice", (0, 0, 0, 9, 9, 9), 200)
+
+        self.assertEqual(history.get_block_changes(5, 5, 5).result(), [(100, "bob", 0, 1), (200, "alice", None, None)])
+        self.assertEqual(history.get_block_changes(10, 5, 5).result(), [])
+        self.assertEqual(history.get_edits("alice", 150).result(), [((0, 0, 0, 9, 9, 9), 200)])
+        self.assertEqual(history.get_edits("alice", 250).result(), [])
+        self.assertEqual(history.get_edits("bob").result(), [])
+        self.close(history)
+
+        self.assertEqual(self.open().get_block_changes(9, 9, 9).result(), [(200, "alice", None, None)])
+
+    def test_edits_capped(self):
+        history = self.open()
+        for timestamp in range(MAX_EDITS + 1):
+            history.record_edit("bob", (timestamp, 0, 0, timestamp, 0, 0), timestamp)
+
+        self.assertEqual(history.get_block_changes(0, 0, 0).result(), [])
+        self.assertEqual(history.get_block_changes(MAX_EDITS, 0, 0).result(), [(MAX_EDITS, "bob", None, None)])
+        self.close(history)
+        self.assertEqual(len(self.open().get_edits("bob").result()), MAX_EDITS // 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
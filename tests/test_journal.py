@@ -0,0 +1,150 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from classicserver.journal import JOURNAL_RECORD, BlockJournal
+from classicserver.saver import WorldSaver
+from classicserver.world import World
+
+
+class BlockJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "save.dat.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_world(self):
+        return World(width=16, height=16, depth=16, generator="flat")
+
+    def replay(self, world, after=0):
+        journal = BlockJournal(self.path)
+        try:
+            return journal.replay(world, after)
+        finally:
+            journal.close()
+
+    def test_replay(self):
+        journal = BlockJournal(self.path)
+        journal.append(1, 2, 3, 0, 1, 0)
+        journal.append(1, 2, 3, 1, 4, 0)
+        journal.append(100, 2, 3, 0, 1, 0)
+        journal.close()
+
+        world = self.make_world()
+        self.assertEqual(self.replay(world), 2)
+        self.assertEqual(world.get_block(1, 2, 3), 4)
+
+    def test_replay_after_truncation(self):
+        journal = BlockJournal(self.path)
+        for x in range(3):
+            journal.append(x, 12, 3, 0, 1, 0)
+        journal.close()
+
+        # A crash in the middle of writing the last record
+        with open(self.path, "r+b") as journal_file:
+            journal_file.truncate(JOURNAL_RECORD.size * 3 - 5)
+
+        world = self.make_world()
+        self.assertEqual(self.replay(world), 2)
+        self.assertEqual([world.get_block(x, 12, 3) for x in range(3)], [1, 1, 0])
+
+        # The torn record is dropped when the journal is opened, so new records line up again
+        journal = BlockJournal(self.path)
+        self.assertEqual(os.path.getsize(self.path), JOURNAL_RECORD.size * 2)
+        journal.append(2, 12, 3, 0, 5, 0)
+        journal.close()
+
+        world = self.make_world()
+        self.assertEqual(self.replay(world), 3)
+        self.assertEqual(world.get_block(2, 12, 3), 5)
+
+    def test_rotation(self):
+        journal = BlockJournal(self.path)
+        journal.append(1, 1, 1, 0, 1, 0)
+        journal.rotate()
+        journal.append(2, 1, 1, 0, 1, 0)
+        journal.close()
+
+        # Until the save completes, both journals are replayed
+        self.assertEqual(self.replay(self.make_world()), 2)
+
+        # A failed save leaves the rotated journal, which the next rotation adds to
+        journal = BlockJournal(self.path)
+        journal.rotate()
+        journal.append(3, 1, 1, 0, 1, 0)
+        journal.close()
+        self.assertEqual(self.replay(self.make_world()), 3)
+
+        journal = BlockJournal(self.path)
+        journal.discard_rotated()
+        journal.close()
+        self.assertFalse(os.path.exists(self.path + ".old"))
+
+        world = self.make_world()
+        self.assertEqual(self.replay(world), 1)
+        self.assertEqual(world.get_block(3, 1, 1), 1)
+
+    def test_replay_after_sequence(self):
+        journal = BlockJournal(self.path)
+        for x in range(3):
+            journal.append(x, 12, 3, 0, 1, 0)
+        self.assertEqual(journal.rotate(), 3)
+        journal.discard_rotated()
+        journal.close()
+
+        # The sequence numbers go on after the records a save covers, even once the journal holding them is deleted
+        journal = BlockJournal(self.path)
+        self.assertEqual(journal.replay(self.make_world(), 3), 0)
+        journal.append(3, 12, 3, 0, 1, 0)
+        journal.close()
+
+        world = self.make_world()
+        self.assertEqual(self.replay(world, 3), 1)
+        self.assertEqual([world.get_block(x, 12, 3) for x in range(4)], [0, 0, 0, 1])
+
+    def test_replay_over_mapped_save(self):
+        journal = BlockJournal(os.path.join(self.directory, "save.dat.journal"))
+        saver = WorldSaver(os.path.join(self.directory, "save.dat"), "mapped", journal)
+        world = saver.map_world(self.make_world())
+
+        # A crash right after the save, before the rotated journal is deleted
+        journal.discard_rotated = lambda: None
+        world.set_block(1, 12, 1, 1)
+        journal.append(1, 12, 1, 0, 1, 0)
+        saver.save_and_wait(world)
+
+        # A change which isn't journaled, like a bulk edit, reaches the mapped file too
+        world.set_block(1, 12, 1, 2)
+        world.close()
+        saver.shutdown()
+        journal.close()
+
+        world = saver.map_world()
+        self.assertEqual(self.replay(world, saver.get_saved_sequence()), 0)
+        self.assertEqual(world.get_block(1, 12, 1), 2)
+        world.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import os
+import unittest
+
+from classicserver.level_encoder import LevelEncoder
+
+
+class LevelEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.encoder = LevelEncoder(threads=4)
+
+    def tearDown(self):
+        self.encoder.shutdown()
+
+    def test_single_slice(self):
+        data = b"\x01\x02" * 1000
+        self.assertEqual(gzip.decompress(self.encoder.encode(data)), data)
+
+    def test_several_slices(self):
+        # Random data in the middle, so the slices don't all compress the same
+        data = bytes(LevelEncoder.MIN_SLICE_SIZE) + os.urandom(LevelEncoder.MIN_SLICE_SIZE * 2) + \
+            b"\x03" * (LevelEncoder.MIN_SLICE_SIZE + 5)
+        self.assertEqual(gzip.decompress(self.encoder.encode(data)), data)
+
+    def test_empty(self):
+        self.assertEqual(gzip.decompress(self.encoder.encode(b"")), b"")
+
+    def test_levels(self):
+        data = bytes(range(256)) * 4096
+        for level in (1, 9):
+            encoder = LevelEncoder(level, 2)
+            self.assertEqual(gzip.decompress(encoder.encode(data)), data)
+            encoder.shutdown()
+
+        self.assertRaises(ValueError, LevelEncoder, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
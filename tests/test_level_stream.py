@@ -0,0 +1,95 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures
+import gzip
+import struct
+import unittest
+
+from classicserver.packet.packet import BlockUpdatePacket, LevelDataChunkPacket, LevelInitializePacket
+from classicserver.world import World
+
+
+def read_level(stream):
+    # The gzipped level data of a level stream and the packets after the level
+    offset = LevelInitializePacket.SIZE
+    chunks = []
+    while stream[offset] == LevelDataChunkPacket.ID:
+        values = LevelDataChunkPacket.unpack(stream, offset)
+        chunks.append(values["chunk"][:values["chunk_length"]])
+        offset += LevelDataChunkPacket.SIZE
+
+    data = gzip.decompress(b"".join(chunks))
+    return data[struct.calcsize("!I"):], stream[offset:]
+
+
+class LevelStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.world = World(width=32, height=16, depth=32, generator="flat")
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+
+    def prepare(self):
+        future = self.world.prepare_level_stream(self.executor)
+        if future is not None:
+            future.result()
+        return future
+
+    def test_built_in_background(self):
+        self.assertIsNone(self.world.get_level_stream_size())
+        self.assertIsNotNone(self.prepare())
+        self.assertIsNotNone(self.world.get_level_stream_size())
+
+        self.assertIsNone(self.prepare())
+        blocks, _ = read_level(self.world.get_level_stream())
+        self.assertEqual(blocks, bytes(self.world.blocks))
+
+    def test_changes_during_build(self):
+        # The blocks are copied when the build starts, the changes made meanwhile are sent after the level
+        future = self.world.prepare_level_stream(self.executor)
+        self.world.set_block(1, 12, 1, 5)
+        future.result()
+
+        self.assertIsNone(self.prepare())
+        blocks, rest = read_level(self.world.get_level_stream())
+        self.assertEqual(blocks[1 + 32 * (1 + 32 * 12)], 0)
+        self.assertIn(BlockUpdatePacket.make({"x": 1, "y": 12, "z": 1, "block_type": 5}), rest)
+
+    def test_bulk_changes(self):
+        self.prepare()
+        self.world.set_block(2, 12, 2, 5)
+        self.assertIsNone(self.world.prepare_level_stream(self.executor))
+
+        # Bulk changes aren't tracked per block, so the stream has to be built again before it's sent
+        self.world.fill(0, 12, 0, 3, 12, 3, 7)
+        self.assertIsNotNone(self.prepare())
+        self.assertIsNone(self.prepare())
+
+        blocks, rest = read_level(self.world.get_level_stream())
+        self.assertEqual(blocks, bytes(self.world.blocks))
+        self.assertEqual(rest[0:1], b"\x04")
+
+    def test_iter_level_stream(self):
+        self.prepare()
+        self.assertEqual(b"".join(self.world.iter_level_stream()), self.world.get_level_stream())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from classicserver.packet.buffer import ReadBuffer
+from classicserver.packet.packet import Packet, LevelDataChunkPacket, MessagePacket, PingPacket, \
+    PositionAndOrientationPacket, SetBlockPacket, SpawnPlayerPacket
+
+SPAWN = {"player_id": -1, "username": "player", "x": 4096, "y": 1024, "z": -32, "yaw": 64, "pitch": 255}
+
+
+class PacketTest(unittest.TestCase):
+    def test_round_trip(self):
+        for packet, values in ((SpawnPlayerPacket, SPAWN),
+                               (SetBlockPacket, {"x": 1, "y": 2, "z": 3, "mode": 0, "block_type": 49}),
+                               (PositionAndOrientationPacket, {"player_id": 5, "frac_x": 32, "frac_y": 64,
+                                                               "frac_z": 96, "yaw": 0, "pitch": 128})):
+            data = packet.make(values)
+            self.assertEqual(len(data), packet.size())
+            self.assertEqual(data[0], packet.ID)
+            self.assertEqual(packet.unpack(data), values)
+
+    def test_pack_into(self):
+        buf = bytearray(3 + SpawnPlayerPacket.SIZE + SetBlockPacket.SIZE)
+        set_block = {"x": 10, "y": 20, "z": 30, "mode": 1, "block_type": 1}
+
+        offset = SpawnPlayerPacket.pack_into(buf, 3, SPAWN)
+        self.assertEqual(offset, 3 + SpawnPlayerPacket.SIZE)
+        self.assertEqual(SetBlockPacket.pack_into(buf, offset, set_block), len(buf))
+
+        self.assertEqual(bytes(buf[3:offset]), SpawnPlayerPacket.make(SPAWN))
+        self.assertEqual(SpawnPlayerPacket.unpack(buf, 3), SPAWN)
+        self.assertEqual(SetBlockPacket.unpack(buf, offset), set_block)
+
+    def test_strings(self):
+        data = MessagePacket.make({"player_id": 0, "message": "x" * 70})
+        self.assertEqual(len(data), MessagePacket.SIZE)
+        self.assertEqual(MessagePacket.unpack(data)["message"], "x" * 64)
+        self.assertEqual(MessagePacket.unpack(MessagePacket.make({"player_id": 0, "message": "hi "}))["message"],
+                         "hi")
+
+    def test_byte_array(self):
+        values = {"chunk_length": 3, "chunk": b"abc", "percent": 50}
+        unpacked = LevelDataChunkPacket.unpack(LevelDataChunkPacket.make(values))
+        self.assertEqual(unpacked["chunk"][:3], b"abc")
+        self.assertEqual(len(unpacked["chunk"]), 1024)
+
+    def test_no_fields(self):
+        self.assertEqual(PingPacket.make(), b"\x01")
+        self.assertEqual(PingPacket.unpack(b"\x01"), {})
+
+    def test_wrong_id(self):
+        self.assertRaises(ValueError, SetBlockPacket.unpack, MessagePacket.make({"player_id": 0, "message": ""}))
+
+    def test_from_buffer(self):
+        data = SetBlockPacket.make({"x": 1, "y": 2, "z": 3, "mode": 1, "block_type": 4})
+        packet, values = Packet.from_buffer(ReadBuffer(data), True)
+        self.assertIs(packet, SetBlockPacket)
+        self.assertEqual(values["block_type"], 4)
+        self.assertRaises(ValueError, Packet.from_buffer, ReadBuffer(b"\x42" + bytes(8)), True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from classicserver.packet.packet import PositionAndOrientationPacket, PositionAndOrientationUpdatePacket, \
+    PositionUpdatePacket, OrientationUpdatePacket
+from classicserver.packet_handler import PacketHandler
+from classicserver.player import Player
+
+
+class EncodeMovementTest(unittest.TestCase):
+    def setUp(self):
+        self.player = Player(5, None, [10.0, 20.0, 30.0], "bob", 0)
+        self.player.yaw, self.player.pitch = 64, 32
+
+    def encode(self):
+        data = PacketHandler.encode_movement(self.player)
+        if not data:
+            return None, None
+
+        packet = {
+            PositionAndOrientationPacket.ID: PositionAndOrientationPacket,
+            PositionAndOrientationUpdatePacket.ID: PositionAndOrientationUpdatePacket,
+            PositionUpdatePacket.ID: PositionUpdatePacket,
+            OrientationUpdatePacket.ID: OrientationUpdatePacket
+        }[data[0]]
+        self.assertEqual(len(data), packet.SIZE)
+        return packet, packet.unpack(data)
+
+    def test_first_update_absolute(self):
+        packet, fields = self.encode()
+        self.assertIs(packet, PositionAndOrientationPacket)
+        self.assertEqual((fields["player_id"], fields["frac_x"], fields["frac_y"], fields["frac_z"], fields["yaw"],
+                          fields["pitch"]), (5, 320, 640, 960, 64, 32))
+        self.assertEqual(self.player.sent_position, [320, 640, 960])
+
+    def test_no_change(self):
+        self.encode()
+        self.assertEqual(PacketHandler.encode_movement(self.player), b"")
+
+    def test_orientation_only(self):
+        self.encode()
+        self.player.yaw = 100
+
+        packet, fields = self.encode()
+        self.assertIs(packet, OrientationUpdatePacket)
+        self.assertEqual((fields["player_id"], fields["yaw"], fields["pitch"]), (5, 100, 32))
+
+    def test_position_only(self):
+        self.encode()
+        self.player.coordinates = [10.5, 19.0, 30.0]
+
+        packet, fields = self.encode()
+        self.assertIs(packet, PositionUpdatePacket)
+        self.assertEqual((fields["delta_x"], fields["delta_y"], fields["delta_z"]), (16, -32, 0))
+
+    def test_position_and_orientation(self):
+        self.encode()
+        self.player.coordinates = [9.0, 20.0, 31.0]
+        self.player.pitch = 0
+
+        packet, fields = self.encode()
+        self.assertIs(packet, PositionAndOrientationUpdatePacket)
+        self.assertEqual((fields["delta_x"], fields["delta_y"], fields["delta_z"], fields["yaw"], fields["pitch"]),
+                         (-32, 0, 32, 64, 0))
+
+    def test_largest_deltas(self):
+        self.encode()
+        self.player.coordinates = [10.0 + 127 / 32, 20.0 - 128 / 32, 30.0]
+
+        packet, fields = self.encode()
+        self.assertIs(packet, PositionUpdatePacket)
+        self.assertEqual((fields["delta_x"], fields["delta_y"]), (127, -128))
+
+    def test_overflow_absolute(self):
+        # Moves past what a signed byte holds on any axis fall back to the absolute position
+        for delta in ((128, 0, 0), (0, -129, 0), (0, 0, 400)):
+            self.encode()
+            position = self.player.sent_position
+            self.player.coordinates = [(position[axis] + delta[axis]) / 32 for axis in range(3)]
+
+            packet, fields = self.encode()
+            self.assertIs(packet, PositionAndOrientationPacket)
+            self.assertEqual([fields["frac_x"], fields["frac_y"], fields["frac_z"]],
+                             [position[axis] + delta[axis] for axis in range(3)])
+
+    def test_deltas_follow_sent_state(self):
+        # The deltas are relative to what was last sent, so they add up to the absolute position
+        self.encode()
+        position = list(self.player.sent_position)
+        for step in ((1.0, 0.0, 0.0), (0.0, 2.0, -3.5), (0.25, 0.0, 0.0)):
+            self.player.coordinates = [self.player.coordinates[axis] + step[axis] for axis in range(3)]
+            _, fields = self.encode()
+            position = [position[0] + fields["delta_x"], position[1] + fields["delta_y"],
+                        position[2] + fields["delta_z"]]
+
+        self.assertEqual(position, [int(coordinate * 32) for coordinate in self.player.coordinates])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+from unittest import mock
+
+from classicserver.packet.packet import MessagePacket, PingPacket
+from classicserver.rate_limit import RateLimits, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("classicserver.rate_limit.time.time", return_value=1000.0)
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def take(self, bucket, count):
+        return sum(bucket.take() for _ in range(count))
+
+    def test_burst(self):
+        bucket = TokenBucket(2, 5)
+        self.assertEqual(self.take(bucket, 10), 5)
+
+    def test_refill(self):
+        bucket = TokenBucket(2, 5)
+        self.take(bucket, 5)
+
+        self.time.return_value = 1000.25
+        self.assertFalse(bucket.take())
+
+        # The half token of the failed take is kept
+        self.time.return_value = 1000.5
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+
+        self.time.return_value = 1002.0
+        self.assertEqual(self.take(bucket, 10), 3)
+
+    def test_refill_capped_at_burst(self):
+        bucket = TokenBucket(2, 5)
+        self.take(bucket, 5)
+
+        self.time.return_value = 2000.0
+        self.assertEqual(self.take(bucket, 10), 5)
+
+
+class RateLimitsTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("classicserver.rate_limit.time.time", return_value=1000.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_limits(self):
+        limits = RateLimits({"messages_burst": 2, "packets_burst": 3})
+
+        self.assertEqual([limits.allow(MessagePacket) for _ in range(3)], [True, True, False])
+        self.assertTrue(limits.allow(PingPacket))
+        self.assertEqual(limits.get_dropped(), {"messages": 1})
+
+        self.assertEqual([limits.allow_packet() for _ in range(4)], [True, True, True, False])
+        self.assertTrue(limits.flooding)
+        self.assertEqual(limits.get_dropped(), {"messages": 1, "packets": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from classicserver.journal import BlockJournal
+from classicserver.saver import WorldSaver
+from classicserver.world import World
+
+
+class WorldSaverTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "save.dat")
+        self.scheduled = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_saver(self, save_format, journal=None):
+        saver = WorldSaver(self.path, save_format, journal, self.scheduled.append)
+        world = saver.map_world(World(width=32, height=16, depth=32, generator="flat"))
+        return saver, world
+
+    def read_block(self, saver, x, y, z):
+        if saver.is_mapped():
+            world = saver.map_world()
+        else:
+            with open(self.path, "rb") as save_file:
+                world = World.from_save(save_file.read())
+
+        block = world.get_block(x, y, z)
+        world.close()
+        return block
+
+    def hold(self, saver):
+        # Keeps the saver's thread busy, so the next save is still in progress when another one is requested
+        release = threading.Event()
+        saver._executor.submit(release.wait)
+        return release
+
+    def test_follow_up_on_tick(self):
+        for save_format in WorldSaver.FORMATS:
+            saver, world = self.make_saver(save_format)
+            saver.save(world).result()
+
+            release = self.hold(saver)
+            first = saver.save(world)
+            world.set_block(1, 12, 1, 5)
+            follow_up = saver.save(world)
+            self.assertIsNot(follow_up, first)
+            self.assertIs(saver.save(world), follow_up)
+
+            # The follow-up takes its snapshot on the tick, once the save before it is complete
+            release.set()
+            first.result()
+            self.assertFalse(follow_up.done())
+            self.assertEqual(len(self.scheduled), 1)
+
+            self.scheduled.pop()()
+            follow_up.result()
+            self.assertEqual(self.read_block(saver, 1, 12, 1), 5, save_format)
+
+            saver.shutdown()
+            world.close()
+
+    def test_save_and_wait(self):
+        journal = BlockJournal(self.path + ".journal")
+        saver, world = self.make_saver("sectioned", journal)
+
+        release = self.hold(saver)
+        saver.save(world)
+        world.set_block(2, 12, 2, 6)
+        saver.save(world)
+        release.set()
+
+        # Without a tick to hand the follow-up to, it's started right away
+        world.set_block(3, 12, 3, 7)
+        saver.save_and_wait(world)
+        self.assertEqual((self.read_block(saver, 2, 12, 2), self.read_block(saver, 3, 12, 3)), (6, 7))
+        self.assertFalse(os.path.exists(self.path + ".journal.old"))
+
+        saver.shutdown()
+        journal.close()
+
+    def test_shutdown_starts_follow_up(self):
+        saver, world = self.make_saver("gzip")
+
+        release = self.hold(saver)
+        saver.save(world)
+        world.set_block(4, 12, 4, 8)
+        follow_up = saver.save(world)
+        release.set()
+
+        saver.shutdown()
+        self.assertTrue(follow_up.done())
+        self.assertEqual(self.read_block(saver, 4, 12, 4), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from classicserver.section_file import HEADER, SectionFile, read_sections
+
+SIZE = (32, 16, 32, 16)
+
+
+class SectionFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "save.dat")
+        self.sections = [bytes((index,)) * 4096 for index in range(4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with open(self.path, "rb") as save_file:
+            return read_sections(save_file.read())
+
+    def test_write_all(self):
+        section_file = SectionFile(self.path)
+        self.assertTrue(section_file.needs_rewrite(*SIZE + (4,)))
+
+        section_file.write_all(*SIZE + (self.sections,))
+        self.assertEqual(self.read(), SIZE + (self.sections,))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        self.assertFalse(SectionFile(self.path).needs_rewrite(*SIZE + (4,)))
+
+    def test_append_and_repoint(self):
+        section_file = SectionFile(self.path)
+        section_file.write_all(*SIZE + (self.sections,))
+        size = os.path.getsize(self.path)
+
+        changed = b"\xff" * 4096
+        written = section_file.write_sections({2: changed})
+        self.assertEqual(os.path.getsize(self.path), size + written)
+
+        self.sections[2] = changed
+        self.assertEqual(self.read(), SIZE + (self.sections,))
+
+        # A file opened again finds the new index, and the unchanged sections weren't rewritten
+        reopened = SectionFile(self.path)
+        self.assertEqual(reopened._index, section_file._index)
+        self.assertLess(reopened._index[1][0], size)
+        self.assertGreaterEqual(reopened._index[2][0], size)
+
+    def test_needs_rewrite(self):
+        section_file = SectionFile(self.path)
+        section_file.write_all(*SIZE + (self.sections,))
+
+        self.assertTrue(section_file.needs_rewrite(64, 16, 32, 16, 4))
+        self.assertTrue(section_file.needs_rewrite(*SIZE + (8,)))
+
+        # Appending the same sections over and over leaves more garbage than live data
+        for _ in range(4):
+            section_file.write_sections(dict(enumerate(self.sections)))
+        self.assertTrue(section_file.needs_rewrite(*SIZE + (4,)))
+
+    def test_other_format(self):
+        with open(self.path, "wb") as save_file:
+            save_file.write(b"\x1f\x8b" + bytes(HEADER.size))
+
+        self.assertTrue(SectionFile(self.path).needs_rewrite(*SIZE + (4,)))
+        self.assertRaises(ValueError, self.read)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+
+from classicserver.spatial import SpatialGrid
+
+
+class SpatialGridTest(unittest.TestCase):
+    def test_nearby(self):
+        grid = SpatialGrid()
+        grid.update(1, 8, 8)
+        grid.update(2, 20, 8)
+        grid.update(3, 100, 100)
+
+        self.assertEqual(grid.nearby(8, 8, 0), {1})
+        self.assertEqual(grid.nearby(8, 8, 8), {1, 2})
+        self.assertEqual(grid.nearby(60, 60, 40), {3})
+        self.assertEqual(grid.nearby(200, 200, 16), set())
+        self.assertEqual(sorted(grid.keys()), [1, 2, 3])
+
+    def test_nearby_whole_cells(self):
+        # Every key in a cell overlapping the square is found, even a bit outside the square
+        grid = SpatialGrid()
+        grid.update(1, 31.9, 0)
+        self.assertEqual(grid.nearby(0, 0, SpatialGrid.CELL_SIZE), {1})
+        self.assertEqual(grid.nearby(0, 0, SpatialGrid.CELL_SIZE - 1), set())
+
+    def test_move(self):
+        grid = SpatialGrid()
+        grid.update(1, 8, 8)
+
+        # Moving within a cell keeps the key where it is, moving out of it takes it along
+        grid.update(1, 15.5, 0.5)
+        self.assertEqual(grid.nearby(8, 8, 0), {1})
+        grid.update(1, 40, 72)
+        self.assertEqual(grid.nearby(8, 8, 0), set())
+        self.assertEqual(grid.nearby(40, 72, 0), {1})
+        self.assertEqual(grid.keys(), [1])
+
+        # Empty cells aren't kept
+        self.assertEqual(len(grid._cells), 1)
+
+    def test_remove(self):
+        grid = SpatialGrid()
+        grid.update(1, 8, 8)
+        grid.update(2, 9, 9)
+        grid.remove(1)
+        grid.remove(5)
+
+        self.assertEqual(grid.nearby(8, 8, 0), {2})
+        grid.remove(2)
+        self.assertEqual(grid.nearby(8, 8, 0), set())
+        self.assertEqual(grid.keys(), [])
+        self.assertEqual(grid._cells, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+    classic-server - A basic Minecraft Classic server.
+    Copyright (C) 2015  SopaXorzTaker
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+import unittest
+
+from classicserver.world import World
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def make_worlds(seed=1, width=20, height=12, depth=16):
+    # The same random world twice, the second one without its NumPy view so it takes the pure-Python paths
+    blocks = bytearray(random.Random(seed).randrange(4) for _ in range(width * height * depth))
+    world = World(bytearray(blocks), width, height, depth)
+    fallback = World(bytearray(blocks), width, height, depth)
+    fallback.array = None
+    return world, fallback
+
+
+class WorldTest(unittest.TestCase):
+    def assertSameBlocks(self, world, fallback):
+        self.assertEqual(bytes(world.blocks), bytes(fallback.blocks))
+
+    def test_fill(self):
+        world, fallback = make_worlds()
+        for edited in (world, fallback):
+            edited.fill(3, 2, 1, 5, 4, 2, 7)
+
+        self.assertSameBlocks(world, fallback)
+        self.assertEqual(world.count_blocks(3, 2, 1, 5, 4, 2), {7: 18})
+        self.assertNotEqual(world.get_block(6, 2, 1), 7)
+
+    def test_fill_clipped(self):
+        world, fallback = make_worlds()
+        for edited in (world, fallback):
+            # The corners are in any order and the parts outside the world are left out
+            edited.fill(25, -3, 14, 18, 1, 40, 9)
+            edited.fill(-5, -5, -5, -1, -1, -1, 9)
+
+        self.assertSameBlocks(world, fallback)
+        self.assertEqual(world.count_blocks(18, 0, 14, 19, 1, 15), {9: 8})
+        self.assertEqual(world.count_blocks()[9], 8)
+
+    def test_replace(self):
+        world, fallback = make_worlds()
+        before = world.count_blocks(0, 0, 0, 9, 5, 7)
+        for edited in (world, fallback):
+            edited.replace(9, 5, 7, 0, 0, 0, 1, 6)
+
+        self.assertSameBlocks(world, fallback)
+        after = world.count_blocks(0, 0, 0, 9, 5, 7)
+        self.assertNotIn(1, after)
+        self.assertEqual(after[6], before[1])
+        self.assertEqual(world.count_blocks(10, 0, 0, 19, 11, 15).get(6), None)
+
+    def test_count_blocks(self):
+        world, fallback = make_worlds()
+        for box in ((), (0, 0, 0, 19, 11, 15), (2, 3, 4, 8, 9, 10), (-4, -4, -4, 50, 2, 3), (30, 0, 0, 40, 5, 5)):
+            self.assertEqual(world.count_blocks(*box), fallback.count_blocks(*box))
+
+        self.assertEqual(sum(world.count_blocks().values()), 20 * 12 * 16)
+        self.assertEqual(world.count_blocks(30, 0, 0, 40, 5, 5), {})
+
+    def test_copy_paste(self):
+        world, fallback = make_worlds()
+        box = world.copy(2, 3, 4, 6, 5, 9)
+        self.assertEqual(box, fallback.copy(2, 3, 4, 6, 5, 9))
+        self.assertEqual(box[0], (5, 3, 6))
+
+        # The copy is in the same order as the world's blocks, X first, then Z, then Y
+        (width, height, depth), data = box
+        self.assertEqual(data[1 + width * (2 + depth * 1)], world.get_block(3, 4, 6))
+
+        for edited in (world, fallback):
+            edited.paste(10, 0, 0, box)
+            # Partly outside the world on every side
+            edited.paste(17, 10, -2, box)
+            edited.paste(-3, -1, 13, box)
+
+        self.assertSameBlocks(world, fallback)
+        self.assertEqual(world.copy(10, 0, 0, 14, 2, 5), box)
+        self.assertEqual(world.get_block(17, 10, 0), data[width * (2 + depth * 0)])
+        self.assertEqual(world.get_block(0, 0, 13), data[3 + width * (0 + depth * 1)])
+
+    def test_copy_clipped(self):
+        world, _ = make_worlds()
+        self.assertEqual(world.copy(18, 10, 14, 25, 20, 30)[0], (2, 2, 2))
+        self.assertEqual(world.copy(30, 0, 0, 40, 5, 5), ((0, 6, 6), b""))
+
+    @unittest.skipIf(numpy is None, "NumPy isn't installed")
+    def test_view_order(self):
+        world, _ = make_worlds()
+        self.assertEqual(world.array.shape, (12, 16, 20))
+        for x, y, z in ((0, 0, 0), (19, 0, 0), (0, 11, 0), (0, 0, 15), (7, 5, 3)):
+            self.assertEqual(world.array[y, z, x], world.get_block(x, y, z))
+
+        world.array[5, 3, 7] = 42
+        self.assertEqual(world.get_block(7, 5, 3), 42)
+
+    def test_set_blocks(self):
+        world, fallback = make_worlds()
+        world.take_dirty_sections()
+        current = world.get_block(1, 1, 1)
+        changes = [(0, 0, 0, 8), (1, 1, 1, current), (19, 11, 15, 8), (0, 0, 0, 9)]
+
+        old_blocks = [world.get_block(0, 0, 0), current, world.get_block(19, 11, 15), 8]
+        self.assertEqual(world.set_blocks(changes), old_blocks)
+        self.assertEqual(fallback.set_blocks(changes), old_blocks)
+        self.assertSameBlocks(world, fallback)
+        self.assertEqual((world.get_block(0, 0, 0), world.get_block(19, 11, 15)), (9, 8))
+
+        # A block which already has its type isn't marked changed
+        dirty = world.take_dirty_sections()
+        self.assertEqual(len(dirty), 2)
+        self.assertEqual(world.set_blocks([(1, 1, 1, current)]), [current])
+        self.assertEqual(world.take_dirty_sections(), set())
+
+
+if __name__ == "__main__":
+    unittest.main()